@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 23:50
+# @File  : a2a_clients.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : A2A 客户端注册表：每个 agent 一个保持长连接的 httpx 连接池，agent card 按 TTL 缓存，提供连接池统计
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# agent card 缓存的秒数，过期后下一次请求时重新获取
+AGENT_CARD_TTL = float(os.getenv("AGENT_CARD_TTL", 300))
+# 每个 agent 的连接池大小，以及空闲的长连接保留多少秒
+A2A_MAX_CONNECTIONS = int(os.getenv("A2A_MAX_CONNECTIONS", 100))
+A2A_MAX_KEEPALIVE = int(os.getenv("A2A_MAX_KEEPALIVE", 20))
+A2A_KEEPALIVE_EXPIRY = float(os.getenv("A2A_KEEPALIVE_EXPIRY", 60))
+# 请求超时(秒)，流式响应时是两次读取之间的最长间隔
+A2A_TIMEOUT = float(os.getenv("A2A_TIMEOUT", 120))
+
+
+class _AgentEntry:
+    __slots__ = ("http", "client", "card_at", "lock", "card_fetches", "card_hits", "requests")
+
+    def __init__(self, http: httpx.AsyncClient):
+        self.http = http
+        self.client = None
+        self.card_at = 0.0
+        self.lock = asyncio.Lock()
+        self.card_fetches = 0
+        self.card_hits = 0
+        self.requests = 0
+
+
+class A2AClientRegistry:
+    """
+    替代每个请求都新建 httpx.AsyncClient + get_client_from_agent_card_url：
+    - 每个 agent url 一个 httpx.AsyncClient，连接保持长连接，在请求之间复用；
+    - agent card 缓存 AGENT_CARD_TTL 秒，过期后重新获取（同一时间只有一个请求去获取），
+      获取失败时继续使用旧的 card，调用失败时由调用方 invalidate() 让下一次请求重新获取；
+    - 在 FastAPI 的 lifespan 中创建和关闭。
+    """
+
+    def __init__(self, card_ttl: float = AGENT_CARD_TTL):
+        self.card_ttl = card_ttl
+        self._agents: Dict[str, _AgentEntry] = {}
+
+    def _entry(self, agent_url: str) -> _AgentEntry:
+        entry = self._agents.get(agent_url)
+        if entry is None:
+            http = httpx.AsyncClient(
+                timeout=httpx.Timeout(A2A_TIMEOUT),
+                limits=httpx.Limits(max_connections=A2A_MAX_CONNECTIONS,
+                                    max_keepalive_connections=A2A_MAX_KEEPALIVE,
+                                    keepalive_expiry=A2A_KEEPALIVE_EXPIRY),
+            )
+            entry = self._agents[agent_url] = _AgentEntry(http)
+        return entry
+
+    async def get(self, agent_url: str):
+        """返回 agent 的 A2AClient，agent card 过期时重新获取"""
+        from a2a.client import A2ACardResolver, A2AClient
+
+        entry = self._entry(agent_url)
+        entry.requests += 1
+        if entry.client is not None and time.monotonic() - entry.card_at < self.card_ttl:
+            entry.card_hits += 1
+            return entry.client
+        async with entry.lock:
+            # 等锁期间其它请求已经获取过了
+            if entry.client is not None and time.monotonic() - entry.card_at < self.card_ttl:
+                entry.card_hits += 1
+                return entry.client
+            try:
+                card = await A2ACardResolver(entry.http, base_url=agent_url).get_agent_card()
+            except Exception as e:
+                if entry.client is None:
+                    raise
+                logger.warning(f"刷新 {agent_url} 的 agent card 失败，继续使用缓存的 card: {e}")
+                entry.card_at = time.monotonic()
+                return entry.client
+            entry.card_fetches += 1
+            entry.client = A2AClient(httpx_client=entry.http, agent_card=card)
+            entry.card_at = time.monotonic()
+            return entry.client
+
+    def invalidate(self, agent_url: str):
+        """调用失败后让下一次请求重新获取 agent card（节点可能重启或者地址变了）"""
+        entry = self._agents.get(agent_url)
+        if entry is not None:
+            entry.card_at = 0.0
+
+    async def close(self):
+        for entry in self._agents.values():
+            await entry.http.aclose()
+        self._agents.clear()
+
+    @staticmethod
+    def _pool_stats(http: httpx.AsyncClient) -> Optional[dict]:
+        # httpx 没有公开连接池的状态，从 httpcore 的连接池读取，版本不一致时不返回
+        pool = getattr(getattr(http, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {
+            url: {
+                "requests": entry.requests,
+                "card_fetches": entry.card_fetches,
+                "card_hits": entry.card_hits,
+                "card_age": round(now - entry.card_at, 1) if entry.client is not None and entry.card_at else None,
+                "pool": self._pool_stats(entry.http),
+            }
+            for url, entry in self._agents.items()
+        }
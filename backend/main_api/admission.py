@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 00:20
+# @File  : admission.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : /search/stream 的准入控制：并发上限 + 有界等待队列（带超时），并发上限根据上游首字节延迟自适应(AIMD)调整
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 初始并发上限，以及自适应调整的范围
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", 20))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", 2))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", 200))
+# 等待队列长度，队列满时直接返回 429
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 50))
+# 在队列中最多等待多少秒，超时返回 503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+# 上游首字节延迟(秒)的目标值，超过时减小并发上限
+ADMISSION_TARGET_LATENCY = float(os.getenv("ADMISSION_TARGET_LATENCY", 8))
+# 每次减小时乘的系数
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", 0.8))
+
+
+class AdmissionRejected(Exception):
+    """请求没有被接收，status 为返回给客户端的 HTTP 状态码（429 队列已满，503 等待超时）"""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class Ticket:
+    """一个被接收的请求，结束时 release()；可以重复调用，只释放一次"""
+    __slots__ = ("controller", "admitted_at", "observed", "released")
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.admitted_at = time.monotonic()
+        self.observed = False
+        self.released = False
+
+    def observe(self, ok: bool = True):
+        """收到上游第一个响应（或者失败）时调用，用首字节延迟调整并发上限，只记录第一次"""
+        if self.observed:
+            return
+        self.observed = True
+        self.controller.observe(time.monotonic() - self.admitted_at, ok)
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.controller.release()
+
+
+class AdmissionController:
+    """
+    - 正在处理的请求数小于 limit 时直接接收；否则进入 FIFO 等待队列，队列满返回 429，等待超过 queue_timeout 返回 503；
+    - limit 按 AIMD 调整：首字节延迟超过 target_latency 或者上游失败时乘以 backoff（每 target_latency 秒最多减一次，
+      避免同一批慢请求把 limit 连续压到最低），请求数接近 limit 且延迟正常时每个请求加 1/limit（约每一轮加 1）；
+    - 所有操作都在事件循环中进行，不需要加锁。
+    """
+
+    def __init__(self, initial_limit: int = ADMISSION_INITIAL_LIMIT, min_limit: int = ADMISSION_MIN_LIMIT,
+                 max_limit: int = ADMISSION_MAX_LIMIT, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, target_latency: float = ADMISSION_TARGET_LATENCY,
+                 backoff: float = ADMISSION_BACKOFF):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.inflight = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._last_decrease = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    async def acquire(self) -> Ticket:
+        if self._has_capacity() and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return Ticket(self)
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_full += 1
+            raise AdmissionRejected(429, "服务繁忙，请稍后再试")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        try:
+            # release() 把名额直接交给队首的请求（inflight 已经加过了）
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove_waiter(future)
+            self.rejected_timeout += 1
+            raise AdmissionRejected(503, "排队超时，请稍后再试")
+        except asyncio.CancelledError:
+            # 客户端在排队时断开，已经拿到名额的要还回去
+            self._remove_waiter(future)
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.admitted += 1
+        return Ticket(self)
+
+    def _remove_waiter(self, future: asyncio.Future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def release(self):
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._has_capacity():
+            future = self._waiters.popleft()
+            if not future.done():
+                self.inflight += 1
+                future.set_result(True)
+
+    def observe(self, latency: float, ok: bool = True):
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        now = time.monotonic()
+        if not ok or latency > self.target_latency:
+            if now - self._last_decrease >= self.target_latency:
+                self._last_decrease = now
+                old = self.limit
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                if int(old) != int(self.limit):
+                    logger.warning(f"上游变慢(首字节 {latency:.1f}s, 成功 {ok})，并发上限 {int(old)} -> {int(self.limit)}")
+        elif self.inflight >= int(self.limit) - 1:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "waiting": len(self._waiters),
+            "queue_size": self.queue_size,
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 23:20
+# @File  : agent_pool.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : search_agent 节点池：按会话 id 一致性哈希选节点（会话缓存保持在同一个节点上），健康检查剔除/恢复节点
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 每个节点在哈希环上的虚拟节点数，越多分布越均匀
+AGENT_RING_VNODES = int(os.getenv("AGENT_RING_VNODES", 160))
+# 健康检查间隔和超时(秒)
+AGENT_HEALTH_INTERVAL = float(os.getenv("AGENT_HEALTH_INTERVAL", 10))
+AGENT_HEALTH_TIMEOUT = float(os.getenv("AGENT_HEALTH_TIMEOUT", 2))
+# 连续失败多少次剔除节点
+AGENT_EJECT_FAILURES = int(os.getenv("AGENT_EJECT_FAILURES", 2))
+# 健康检查访问的路径（A2A 服务的 agent card）
+AGENT_HEALTH_PATH = "/.well-known/agent.json"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def session_key(session_id: str, history: List[dict], message: str) -> str:
+    """
+    路由用的会话 id：优先使用前端传来的 session_id；
+    老版本前端没有 session_id 时，用对话中的第一条用户消息生成（同一个对话里不会变）。
+    只用于一致性哈希选节点，不能作为 agent 的 session id：开头相同的不同对话会得到相同的 key。
+    """
+    if session_id:
+        return session_id
+    first = next((turn.get("content") for turn in history or []
+                  if isinstance(turn, dict) and turn.get("role") == "user" and turn.get("content")), message)
+    return "h-" + hashlib.sha1(str(first).encode("utf-8")).hexdigest()
+
+
+class HashRing:
+    """
+    一致性哈希环：每个节点放 vnodes 个虚拟节点，key 顺时针找到的第一个节点就是它的归属。
+    节点剔除时只有这个节点上的 key 会移动到环上的下一个节点，其它 key 不受影响。
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = AGENT_RING_VNODES):
+        self.vnodes = vnodes
+        points = []
+        for node in nodes:
+            for i in range(vnodes):
+                points.append((_hash(f"{node}#{i}"), node))
+        points.sort()
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def walk(self, key: str) -> Iterable[str]:
+        """从 key 的位置顺时针依次返回不重复的节点"""
+        if not self._points:
+            return
+        start = bisect.bisect(self._points, _hash(key))
+        seen = set()
+        total = len(self._points)
+        for offset in range(total):
+            node = self._nodes[(start + offset) % total]
+            if node not in seen:
+                seen.add(node)
+                yield node
+
+
+class NodeHealth:
+    __slots__ = ("failures", "healthy", "ejected_at", "last_check", "last_error")
+
+    def __init__(self):
+        self.failures = 0
+        self.healthy = True
+        self.ejected_at: Optional[float] = None
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+class AgentPool:
+    """
+    一组 search_agent 节点：
+    - pick(key): 在哈希环上找 key 的节点，跳过不健康的节点（只有不健康节点上的 key 会移动）；
+    - 后台定期访问每个节点的 agent card，连续失败 AGENT_EJECT_FAILURES 次剔除，成功一次恢复；
+    - 调用失败时 report_failure() 也会计入失败次数，不用等下一次健康检查。
+    """
+
+    def __init__(self, urls: List[str]):
+        self.urls = list(dict.fromkeys(url.rstrip("/") for url in urls if url.strip()))
+        if not self.urls:
+            raise ValueError("没有配置 search agent 节点，请设置 SEARCH_AGENT_URLS 或 SEARCH_AGENT_URL")
+        self.ring = HashRing(self.urls)
+        self.health: Dict[str, NodeHealth] = {url: NodeHealth() for url in self.urls}
+        self.routed: Dict[str, int] = {url: 0 for url in self.urls}
+        self._task: Optional[asyncio.Task] = None
+
+    def pick(self, key: str, exclude: Iterable[str] = ()) -> str:
+        """返回 key 的节点；所有节点都不健康时仍按哈希返回（由调用方报错），不会返回 exclude 中的节点，除非没有别的选择"""
+        exclude = set(exclude)
+        fallback = None
+        for url in self.ring.walk(key):
+            if url in exclude:
+                continue
+            if fallback is None:
+                fallback = url
+            if self.health[url].healthy:
+                self.routed[url] += 1
+                return url
+        url = fallback or next(iter(self.ring.walk(key)))
+        self.routed[url] += 1
+        return url
+
+    def _mark(self, url: str, ok: bool, error: str = None):
+        health = self.health.get(url)
+        if health is None:
+            return
+        if ok:
+            if not health.healthy:
+                logger.info(f"search agent 节点恢复: {url}")
+            health.failures = 0
+            health.healthy = True
+            health.ejected_at = None
+            health.last_error = None
+            return
+        health.failures += 1
+        health.last_error = error
+        if health.healthy and health.failures >= AGENT_EJECT_FAILURES:
+            health.healthy = False
+            health.ejected_at = time.time()
+            logger.warning(f"search agent 节点连续失败 {health.failures} 次，已剔除: {url}, 错误: {error}")
+
+    def report_success(self, url: str):
+        self._mark(url, True)
+
+    def report_failure(self, url: str, error: str):
+        self._mark(url, False, error)
+
+    async def check_once(self, client: httpx.AsyncClient):
+        async def check(url: str):
+            self.health[url].last_check = time.time()
+            try:
+                response = await client.get(url + AGENT_HEALTH_PATH, timeout=AGENT_HEALTH_TIMEOUT)
+                response.raise_for_status()
+                self._mark(url, True)
+            except Exception as e:
+                self._mark(url, False, f"{type(e).__name__}: {e}")
+        await asyncio.gather(*(check(url) for url in self.urls))
+
+    async def _run(self):
+        async with httpx.AsyncClient() as client:
+            while True:
+                await self.check_once(client)
+                await asyncio.sleep(AGENT_HEALTH_INTERVAL)
+
+    def start(self):
+        """启动后台健康检查（只有一个节点时不需要）"""
+        if self._task is None and len(self.urls) > 1:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            url: {
+                "healthy": health.healthy,
+                "failures": health.failures,
+                "ejected_at": health.ejected_at,
+                "last_check": health.last_check,
+                "last_error": health.last_error,
+                "routed": self.routed[url],
+            }
+            for url, health in self.health.items()
+        }
+
+
+def agent_urls_from_env() -> List[str]:
+    """SEARCH_AGENT_URLS 为逗号分隔的多个节点，没有配置时使用 SEARCH_AGENT_URL"""
+    urls = os.getenv("SEARCH_AGENT_URLS", "")
+    if urls.strip():
+        return [url.strip() for url in urls.split(",") if url.strip()]
+    return [os.environ["SEARCH_AGENT_URL"]]
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 01:30
+# @File  : conversation_store.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 服务端保存的对话（历史消息和最近一次搜索结果），客户端每轮只需要发送新消息；内存 LRU + 空闲过期，可选 SQLite 持久化
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# SQLite 文件路径，默认为空（只保存在内存中，重启后客户端会重新发送完整历史）；和其它存储一样需要显式配置路径
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "")
+# 内存中最多保留多少个对话
+CONVERSATION_CACHE_MAX = int(os.getenv("CONVERSATION_CACHE_MAX", 1024))
+# 对话空闲多少秒后过期（内存和磁盘都按这个时间清理）
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", 24 * 3600))
+# 每个对话最多保存多少条历史消息，超过时按一半为单位丢弃最早的（见 ConversationStore.trim）
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", 100))
+
+
+class Conversation:
+    """
+    count 是对话中一共有多少条消息（包括已经因为 CONVERSATION_MAX_MESSAGES 丢弃的），
+    和客户端本地的消息条数比较，判断两边的对话是否一致
+    """
+    __slots__ = ("history", "search_result", "count", "updated_at")
+
+    def __init__(self, history: List[dict], search_result: List[Any], count: int, updated_at: float):
+        self.history = history
+        self.search_result = search_result
+        self.count = count
+        self.updated_at = updated_at
+
+    def dumps(self) -> bytes:
+        return zlib.compress(json.dumps({"history": self.history, "search_result": self.search_result},
+                                        ensure_ascii=False, default=str).encode("utf-8"))
+
+    @classmethod
+    def loads(cls, data: bytes, count: int, updated_at: float) -> "Conversation":
+        raw = json.loads(zlib.decompress(data))
+        return cls(raw["history"], raw["search_result"], count, updated_at)
+
+
+class ConversationDB:
+    """对话的 SQLite(WAL) 存储"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                session_id  TEXT PRIMARY KEY,
+                data        BLOB NOT NULL,
+                count       INTEGER NOT NULL,
+                updated_at  REAL NOT NULL
+            )
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[Conversation]:
+        row = self._conn().execute(
+            "SELECT data, count, updated_at FROM conversations WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - CONVERSATION_TTL),
+        ).fetchone()
+        return Conversation.loads(*row) if row else None
+
+    def put(self, session_id: str, conversation: Conversation):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO conversations (session_id, data, count, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, conversation.dumps(), conversation.count, conversation.updated_at),
+        )
+
+    def purge(self):
+        self._conn().execute("DELETE FROM conversations WHERE updated_at < ?", (time.time() - CONVERSATION_TTL,))
+
+
+class ConversationStore:
+    """
+    - load(session_id, count): 客户端只发送新消息和本地消息条数，条数一致时返回服务端保存的对话，
+      内存中没有或者条数不一致时再读一次 SQLite（可能是其它 worker 写的），仍然不一致返回 None（客户端需要发送完整历史）；
+    - save(...): 一轮对话成功结束后保存（客户端发送了完整历史时以客户端的为准）；
+    - 内存中按 LRU 最多保留 max_size 个对话，空闲超过 ttl 秒淘汰，SQLite 中的对话也按 ttl 清理。
+    """
+
+    def __init__(self, db_path: str = CONVERSATION_DB_PATH, max_size: int = CONVERSATION_CACHE_MAX,
+                 ttl: float = CONVERSATION_TTL, max_messages: int = CONVERSATION_MAX_MESSAGES):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._cache: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.db = ConversationDB(db_path) if db_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._last_purge = 0.0
+
+    def _evict(self, now: float):
+        while self._cache:
+            conversation = next(iter(self._cache.values()))
+            if len(self._cache) <= self.max_size and now - conversation.updated_at < self.ttl:
+                break
+            self._cache.popitem(last=False)
+
+    async def load(self, session_id: str, count: int) -> Optional[Conversation]:
+        if count == 0:
+            # 新对话不需要历史
+            return Conversation([], [], 0, time.time())
+        conversation = self._cache.get(session_id)
+        if conversation is not None and conversation.count == count and time.time() - conversation.updated_at < self.ttl:
+            self._cache.move_to_end(session_id)
+            self.hits += 1
+            return conversation
+        if self.db is not None:
+            conversation = await asyncio.to_thread(self.db.get, session_id)
+            if conversation is not None and conversation.count == count:
+                self._cache[session_id] = conversation
+                self._cache.move_to_end(session_id)
+                self._evict(time.time())
+                self.disk_hits += 1
+                return conversation
+        self.misses += 1
+        return None
+
+    def trim(self, history: List[dict], count: int) -> List[dict]:
+        """
+        超过 max_messages 条时，从对齐到 max_messages // 2 整数倍的位置开始保留（保留的条数在一半到 max_messages 之间）。
+        search agent 按历史前缀的滚动哈希复用会话（memory_controller），每轮只丢最早的一两条会让前缀每轮都变、每轮重建；
+        按块丢弃后开头在很多轮内保持不变。起点按消息总条数 count 计算，客户端发送完整历史时得到的起点也相同。
+        """
+        if count <= self.max_messages:
+            return history
+        chunk = max(1, self.max_messages // 2)
+        start = ((count - self.max_messages) // chunk + 1) * chunk
+        # history[0] 在整个对话中的位置
+        offset = count - len(history)
+        return history[start - offset:] if start > offset else history
+
+    async def save(self, session_id: str, history: List[dict], search_result: List[Any], count: int):
+        """history 是这一轮之后的完整历史（可能已经超过 max_messages，这里截断），count 是消息总条数"""
+        now = time.time()
+        conversation = Conversation(self.trim(history, count), search_result, count, now)
+        self._cache[session_id] = conversation
+        self._cache.move_to_end(session_id)
+        self._evict(now)
+        if self.db is not None:
+            await asyncio.to_thread(self.db.put, session_id, conversation)
+            # 每小时清理一次磁盘上过期的对话
+            if now - self._last_purge > 3600:
+                self._last_purge = now
+                await asyncio.to_thread(self.db.purge)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "conversations": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "db_path": self.db.path if self.db else None,
+        }
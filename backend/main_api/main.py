@@ -3,11 +3,14 @@ import json
 import os
 import dotenv
 import time
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 import uuid
 import sys
 import httpx
-from fastapi.responses import StreamingResponse
+from typing import Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi import UploadFile, File, HTTPException, Form
@@ -15,6 +18,12 @@ from fastapi import FastAPI, HTTPException, Query, Request, Response
 import logging
 
 dotenv.load_dotenv()
+from agent_pool import AgentPool, agent_urls_from_env, session_key
+from a2a_clients import A2AClientRegistry
+from admission import AdmissionController, AdmissionRejected
+from sse import sse_frame, sse_stream
+from conversation_store import ConversationStore
+
 logging.basicConfig(
     handlers=[
         logging.StreamHandler()
@@ -25,7 +34,25 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-app = FastAPI()
+# 搜索Agent，可以配置多个节点(SEARCH_AGENT_URLS)，按会话 id 一致性哈希路由
+agent_pool = AgentPool(agent_urls_from_env())
+# 每个 search agent 的长连接池和缓存的 agent card，在 lifespan 中关闭
+a2a_clients = A2AClientRegistry()
+# /search/stream 的并发上限和等待队列，上游变慢时自动降低并发，处理不了的请求直接返回 429/503
+admission = AdmissionController()
+# 服务端保存的对话，客户端只发送新消息
+conversations = ConversationStore()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    agent_pool.start()
+    yield
+    await agent_pool.stop()
+    await a2a_clients.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,94 +66,153 @@ class ChatRequest(BaseModel):
     message: str
     history: list = []
     search_result: list = []
-
-# 搜索Agent
-SEARCH_AGENT_URL = os.environ["SEARCH_AGENT_URL"]
+    # 会话 id，同一个对话保持不变；用作 A2A 的 contextId（search agent 的 session id）和路由的 key
+    session_id: str = ""
+    # 客户端本地的历史消息条数；传了 history_len 而没有传 history 时使用服务端保存的对话和搜索结果
+    history_len: Optional[int] = None
 
 
-async def call_search_agent(user_message: str, history: list = [], search_result=[],language: str = "chinese"):
+async def call_search_agent(user_message: str, history: list = [], search_result=[],language: str = "chinese",
+                            session_id: str = "", upstream: dict = None):
     """调用 Search agent 获取流式响应（包含文本和工具调用信息）
     history: 历史聊天记录
     search_result： 最近的一次搜索结果
+    session_id: 会话 id，同一个会话总是路由到同一个 search agent 节点
+    upstream: 可选，记录实际调用的节点和任务 id（agent_url、task_id），客户端断开时用来取消任务
     """
-    try:
-        from a2a.client import A2AClient
-        from a2a.types import MessageSendParams, SendStreamingMessageRequest
-
-        timeout = httpx.Timeout(120.0)
-        async with httpx.AsyncClient(timeout=timeout) as httpx_client:
-            client = await A2AClient.get_client_from_agent_card_url(
-                httpx_client, SEARCH_AGENT_URL
-            )
-
-            request_id = uuid.uuid4().hex
-
-            send_message_payload = {
-                'message': {
-                    'role': 'user',
-                    'parts': [{'type': 'text', 'text': user_message}],
-                    'messageId': request_id,
-                    'metadata': {
-                        "language": language,
-                        "history": history,
-                        "search_result": search_result
-                    }
-                }
+    if upstream is None:
+        upstream = {}
+    # 路由 key 只用于选节点；contextId（search agent 的 session id）只使用客户端传来的 session_id，
+    # 没有时不传，由 agent 为每次请求新建会话，避免开头相同的不同对话共用同一个 session
+    routing_key = session_key(session_id, history, user_message)
+    context_id = session_id or None
+    tried = []
+    while True:
+        agent_url = agent_pool.pick(routing_key, exclude=tried)
+        tried.append(agent_url)
+        chunk_count = 0
+        try:
+            async for item in _stream_search_agent(agent_url, context_id, user_message, history, search_result, language,
+                                                   upstream):
+                chunk_count += 1
+                yield item
+            agent_pool.report_success(agent_url)
+            return
+        except ImportError:
+            logger.error("[A2A] !!! a2a module not found")
+            yield {"type": "error", "content": "系统配置错误：缺少必要的库。"}
+            return
+        except Exception as e:
+            agent_pool.report_failure(agent_url, f"{type(e).__name__}: {e}")
+            a2a_clients.invalidate(agent_url)
+            # 上游还没有创建任务、也没有返回任何内容时换下一个节点重试；已经创建了任务（收到 task / status 事件）
+            # 说明这条消息已经在该节点上开始执行，重试会在另一个节点上再执行一遍
+            if chunk_count == 0 and not upstream.get("task_id") and len(tried) < len(agent_pool.urls):
+                logger.warning(f"[A2A] !!! {agent_url} 调用失败，换下一个节点重试: {e}")
+                continue
+            logger.error(f"[A2A] !!! Error: {e}", exc_info=True)
+            yield {"type": "error", "content": f"系统错误：{str(e)}"}
+            return
+
+
+async def _stream_search_agent(agent_url: str, context_id: Optional[str], user_message: str, history: list,
+                               search_result: list, language: str, upstream: dict):
+    """调用指定节点的 search agent，逐条返回解析后的文本、工具调用和搜索结果"""
+    from a2a.types import MessageSendParams, SendStreamingMessageRequest
+
+    client = await a2a_clients.get(agent_url)
+    upstream["agent_url"] = agent_url
+    upstream.pop("task_id", None)
+    request_id = uuid.uuid4().hex
+
+    send_message_payload = {
+        'message': {
+            'role': 'user',
+            'parts': [{'type': 'text', 'text': user_message}],
+            'messageId': request_id,
+            'metadata': {
+                "language": language,
+                "history": history,
+                "search_result": search_result
             }
+        }
+    }
+    if context_id:
+        send_message_payload['message']['contextId'] = context_id
 
-            logger.info(f"[A2A] >>> Calling search agent: {user_message}")
+    logger.info(f"[A2A] >>> Calling search agent {agent_url} (context {context_id}): {user_message}")
 
-            streaming_request = SendStreamingMessageRequest(
-                id=request_id,
-                params=MessageSendParams(**send_message_payload)
-            )
+    streaming_request = SendStreamingMessageRequest(
+        id=request_id,
+        params=MessageSendParams(**send_message_payload)
+    )
 
-            stream_response = client.send_message_streaming(streaming_request)
+    stream_response = client.send_message_streaming(streaming_request)
+
+    chunk_count = 0
+    async for chunk in stream_response:
+        chunk_count += 1
+        chunk_data = chunk.model_dump(mode='json', exclude_none=True)
+        result = chunk_data.get('result', {})
+        if 'task_id' not in upstream and result.get('kind') in ('task', 'status-update', 'artifact-update'):
+            upstream['task_id'] = result.get('id') if result.get('kind') == 'task' else result.get('taskId')
+
+        if chunk_data.get('result', {}).get('kind') == 'status-update':
+            status = chunk_data['result'].get('status', {})
+
+            if 'message' in status:
+                message = status['message']
+                if 'parts' in message:
+                    for part in message['parts']:
+                        part_kind = part.get('kind')
+
+                        # 1. 处理文本
+                        if part_kind == 'text' and 'text' in part:
+                            yield {"type": "text", "content": part['text']}
+                            logger.info(f"[A2A] <<< Streaming text chunk: {part['text'][:30]}...")
+
+                        # 2. 处理工具
+                        elif part_kind == 'data' and 'data' in part:
+                            inner_data_list = part['data'].get('data', [])
+                            for item in inner_data_list:
+                                item_type = item.get('type')
+                                if item_type == 'function_call':
+                                    yield {"type": "function_call", "content": item}
+                                    logger.info(f"[A2A] <<< Function Call: {item.get('name')}")
+                                elif item_type == 'function_response':
+                                    yield {"type": "function_response", "content": item}
+                                    logger.info(f"[A2A] <<< Function Response: {item.get('name')}")
+
+                # 3. 搜索结果的完整记录（模型只看到精简视图，完整记录走 metadata 给前端展示）
+                search_dbs = (message.get('metadata') or {}).get('search_dbs')
+                if search_dbs:
+                    yield {"type": "search_records", "content": search_dbs}
+                    logger.info(f"[A2A] <<< Search records: {len(search_dbs)} items")
+
+        elif chunk_data.get('result', {}).get('kind') == 'artifact-update':
+            continue
+
+
+async def cancel_search_task(upstream: dict):
+    """客户端断开后取消 search agent 上还在运行的任务，不再继续消耗模型的 token"""
+    task_id = upstream.get("task_id")
+    if not task_id:
+        return
+    from a2a.types import CancelTaskRequest, TaskIdParams
 
-            chunk_count = 0
-            async for chunk in stream_response:
-                chunk_count += 1
-                chunk_data = chunk.model_dump(mode='json', exclude_none=True)
-
-                if chunk_data.get('result', {}).get('kind') == 'status-update':
-                    status = chunk_data['result'].get('status', {})
-
-                    if 'message' in status:
-                        message = status['message']
-                        if 'parts' in message:
-                            for part in message['parts']:
-                                part_kind = part.get('kind')
-
-                                # 1. 处理文本
-                                if part_kind == 'text' and 'text' in part:
-                                    yield {"type": "text", "content": part['text']}
-                                    logger.info(f"[A2A] <<< Streaming text chunk: {part['text'][:30]}...")
-
-                                # 2. 处理工具
-                                elif part_kind == 'data' and 'data' in part:
-                                    inner_data_list = part['data'].get('data', [])
-                                    for item in inner_data_list:
-                                        item_type = item.get('type')
-                                        if item_type == 'function_call':
-                                            yield {"type": "function_call", "content": item}
-                                            logger.info(f"[A2A] <<< Function Call: {item.get('name')}")
-                                        elif item_type == 'function_response':
-                                            yield {"type": "function_response", "content": item}
-                                            logger.info(f"[A2A] <<< Function Response: {item.get('name')}")
-
-                elif chunk_data.get('result', {}).get('kind') == 'artifact-update':
-                    continue
-
-    except ImportError:
-        logger.error("[A2A] !!! a2a module not found")
-        yield {"type": "error", "content": "系统配置错误：缺少必要的库。"}
+    try:
+        client = await a2a_clients.get(upstream["agent_url"])
+        await asyncio.wait_for(
+            client.cancel_task(CancelTaskRequest(id=uuid.uuid4().hex, params=TaskIdParams(id=task_id))),
+            timeout=10,
+        )
+        logger.info(f"[A2A] >>> 客户端已断开，取消任务 {task_id} ({upstream['agent_url']})")
     except Exception as e:
-        logger.error(f"[A2A] !!! Error: {e}", exc_info=True)
-        yield {"type": "error", "content": f"系统错误：{str(e)}"}
+        logger.warning(f"[A2A] !!! 取消任务 {task_id} 失败: {e}")
 
 
 @app.post("/search/stream")
-async def search_stream(request: ChatRequest):
+async def search_stream(request: ChatRequest, http_request: Request):
     """搜索文献stream（SSE）
     
     Args:
@@ -135,48 +221,95 @@ async def search_stream(request: ChatRequest):
         request.search_result: 最近一次的搜索结果（用于后续对话的上下文）
     """
     logger.info(f"[STREAM] Request: {request.message}")
-    logger.info(f"[STREAM] Search result context: {len(request.search_result) if request.search_result else 0} items")
+    history, search_result = request.history, request.search_result
+    if request.session_id and request.history_len is not None and not request.history:
+        conversation = await conversations.load(request.session_id, request.history_len)
+        if conversation is None:
+            # 服务端没有这个对话（过期或者和客户端不一致），让客户端重新发送完整的历史
+            logger.info(f"[STREAM] Conversation {request.session_id} not found ({request.history_len} messages), resync")
+            return JSONResponse(status_code=409, content={"error": "conversation_not_found", "resync": True})
+        history, search_result, history_count = conversation.history, conversation.search_result, conversation.count
+    else:
+        history_count = len(history)
+    logger.info(f"[STREAM] Search result context: {len(search_result) if search_result else 0} items")
+    try:
+        ticket = await admission.acquire()
+    except AdmissionRejected as e:
+        logger.warning(f"[STREAM] Rejected ({e.status}): {e.reason}, {admission.stats()}")
+        return StreamingResponse(
+            iter([sse_frame({'error': e.reason}), sse_frame({'done': True})]),
+            status_code=e.status,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "Retry-After": "1"},
+        )
+
     # request.search_result是最近的一次搜索记录
+    upstream = {}
+
     async def event_generator():
         try:
             chunk_sent = False
-            async for chunk_obj in call_search_agent(request.message, request.history, request.search_result):
+            failed = False
+            reply = []
+            latest_search = None
+            async for chunk_obj in call_search_agent(request.message, history, search_result,
+                                                     session_id=request.session_id, upstream=upstream):
                 if chunk_obj:
                     event_type = chunk_obj.get("type")
                     content = chunk_obj.get("content")
+                    # 第一个响应的延迟用来调整并发上限
+                    ticket.observe(ok=event_type != "error")
 
                     response_payload = {}
 
                     if event_type == "text":
                         response_payload = {"text": content}
+                        reply.append(content)
                     elif event_type == "function_call":
                         response_payload = {"function_call": content}
                     elif event_type == "function_response":
                         response_payload = {"function_response": content}
+                    elif event_type == "search_records":
+                        response_payload = {"search_records": content}
+                        latest_search = content
                     elif event_type == "error":
                         response_payload = {"error": content}
+                        failed = True
 
                     if response_payload:
-                        yield f"data: {json.dumps(response_payload, ensure_ascii=False)}\n\n"
+                        yield response_payload
                         chunk_sent = True
 
-            if chunk_sent:
-                yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
-            else:
-                yield f"data: {json.dumps({'text': '抱歉，未能获取到回复。'}, ensure_ascii=False)}\n\n"
-                yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
+            ticket.observe(ok=chunk_sent)
+            if chunk_sent and not failed and request.session_id:
+                # 保存这一轮对话，下一轮客户端只需要发送新消息（在 done 之前保存，客户端马上发起的下一轮能读到）
+                turns = [{"role": "user", "content": request.message}]
+                if "".join(reply).strip():
+                    turns.append({"role": "assistant", "content": "".join(reply)})
+                await conversations.save(request.session_id, list(history) + turns,
+                                         latest_search if latest_search is not None else search_result,
+                                         history_count + len(turns))
+            if not chunk_sent:
+                yield {'text': '抱歉，未能获取到回复。'}
+            yield {'done': True}
         except Exception as e:
             logger.error(f"[STREAM] Error: {e}", exc_info=True)
-            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+            ticket.observe(ok=False)
+            yield {'error': str(e)}
+        finally:
+            ticket.release()
 
+    # 文本片段合并、心跳、客户端断开时取消 search agent 上的任务
     return StreamingResponse(
-        event_generator(),
+        sse_stream(event_generator(), http_request, on_abort=lambda: cancel_search_task(upstream)),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no",
-        }
+        },
+        # 客户端在开始输出前断开时生成器不会运行，由 background 释放名额
+        background=BackgroundTask(ticket.release),
     )
 
 
@@ -185,6 +318,30 @@ def ping():
     return "Pong"
 
 
+@app.get("/stats/agents")
+def agent_stats():
+    """search agent 节点的健康状态和路由次数"""
+    return agent_pool.stats()
+
+
+@app.get("/stats/a2a_clients")
+def a2a_client_stats():
+    """每个 search agent 的连接池、agent card 缓存命中次数"""
+    return a2a_clients.stats()
+
+
+@app.get("/stats/admission")
+def admission_stats():
+    """/search/stream 的并发上限、排队和拒绝次数"""
+    return admission.stats()
+
+
+@app.get("/stats/conversations")
+def conversation_stats():
+    """服务端保存的对话数量和命中次数"""
+    return conversations.stats()
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 00:50
+# @File  : sse.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : SSE 输出层：合并连续的文本片段，定期发送心跳注释，有界缓冲做背压，客户端断开时立即取消上游
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+# 文本片段合并的时间窗口(毫秒)和最大字符数，任一条件满足时输出
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", 50))
+SSE_COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", 256))
+# 多少秒没有输出时发送一次心跳注释（避免代理/浏览器断开空闲连接）
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15))
+# 上游和客户端之间最多缓冲多少个事件，满了之后上游停止读取（背压）
+SSE_BUFFER_EVENTS = int(os.getenv("SSE_BUFFER_EVENTS", 256))
+# 缓冲区满了多少秒客户端仍然没有读走，认为客户端已经不可用，取消上游
+SSE_SLOW_CLIENT_TIMEOUT = float(os.getenv("SSE_SLOW_CLIENT_TIMEOUT", 60))
+# 检查客户端是否断开的间隔(秒)
+SSE_DISCONNECT_POLL = 1.0
+
+HEARTBEAT = ": ping\n\n"
+
+_END = object()
+
+
+def sse_frame(payload: dict) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class _SlowClient(Exception):
+    pass
+
+
+async def sse_stream(source: AsyncIterator[dict], request: Request,
+                     on_abort: Optional[Callable[[], Awaitable[None]]] = None) -> AsyncIterator[str]:
+    """
+    把 source 产生的 payload（{"text": ...}、{"function_call": ...} 等）转换成 SSE 输出：
+    - 连续的 {"text": ...} 在 SSE_COALESCE_MS 内或者累计到 SSE_COALESCE_CHARS 个字符合并成一帧，其它事件输出前先输出已合并的文本；
+    - 同时可读的多帧合并成一次写入；
+    - SSE_HEARTBEAT_INTERVAL 秒没有输出时发送 ": ping" 注释；
+    - source 在单独的任务中读取，缓冲区有界，客户端读得慢时上游也会停下来；
+    - 客户端断开、缓冲区长时间是满的、或者本生成器被关闭时，取消读取 source 的任务并调用 on_abort（取消上游任务）。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_BUFFER_EVENTS)
+
+    async def produce():
+        try:
+            async for payload in source:
+                try:
+                    await asyncio.wait_for(queue.put(payload), timeout=SSE_SLOW_CLIENT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise _SlowClient()
+        finally:
+            # 被取消时 source 停在 yield 处，需要主动关闭，释放上游连接
+            await source.aclose()
+        await queue.put(_END)
+
+    producer = asyncio.create_task(produce())
+    text_buffer = []
+    text_size = 0
+    text_since = 0.0
+    last_write = time.monotonic()
+    last_poll = time.monotonic()
+    finished = False
+
+    def flush_text(frames: list):
+        nonlocal text_size
+        if text_buffer:
+            frames.append(sse_frame({"text": "".join(text_buffer)}))
+            text_buffer.clear()
+            text_size = 0
+
+    try:
+        while True:
+            now = time.monotonic()
+            deadline = last_write + SSE_HEARTBEAT_INTERVAL
+            if text_buffer:
+                deadline = min(deadline, text_since + SSE_COALESCE_MS / 1000)
+            timeout = max(0.0, min(deadline - now, SSE_DISCONNECT_POLL))
+
+            frames = []
+            items = []
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, producer} if not producer.done() else {getter}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                items.append(getter.result())
+                # 已经在缓冲区中的事件一次取完
+                while not queue.empty():
+                    items.append(queue.get_nowait())
+            else:
+                getter.cancel()
+                if producer.done() and not producer.cancelled() and producer.exception() is not None \
+                        and queue.empty():
+                    error = producer.exception()
+                    if isinstance(error, _SlowClient):
+                        logger.warning("[SSE] 客户端长时间没有读取数据，取消上游")
+                        return
+                    logger.error(f"[SSE] 上游出错: {error}")
+                    items.extend([{"error": str(error)}, _END])
+
+            for payload in items:
+                if payload is _END:
+                    finished = True
+                    break
+                if set(payload) == {"text"}:
+                    if not text_buffer:
+                        text_since = time.monotonic()
+                    text_buffer.append(payload["text"])
+                    text_size += len(payload["text"])
+                    if text_size >= SSE_COALESCE_CHARS:
+                        flush_text(frames)
+                    continue
+                flush_text(frames)
+                frames.append(sse_frame(payload))
+
+            now = time.monotonic()
+            if text_buffer and (finished or now - text_since >= SSE_COALESCE_MS / 1000):
+                flush_text(frames)
+            if not frames and now - last_write >= SSE_HEARTBEAT_INTERVAL:
+                frames.append(HEARTBEAT)
+            if frames:
+                yield "".join(frames)
+                last_write = time.monotonic()
+            if finished:
+                return
+
+            if now - last_poll >= SSE_DISCONNECT_POLL:
+                last_poll = now
+                if await request.is_disconnected():
+                    logger.info("[SSE] 客户端已断开，取消上游")
+                    return
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, Exception):
+                pass
+        # 没有正常结束（客户端断开、读得太慢或者生成器被关闭），取消上游任务
+        if not finished and on_abort is not None:
+            _spawn(on_abort())
+
+
+_background = set()
+
+
+def _spawn(coro):
+    # 生成器可能正在被取消，取消上游的请求放到单独的任务中
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/19 11:20
+# @File  : test_admission.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : admission 的单元测试：并发上限、等待队列和 AIMD 调整
+
+import asyncio
+import unittest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+class AdmissionControllerTest(unittest.IsolatedAsyncioTestCase):
+
+    def make(self, **kwargs):
+        options = dict(initial_limit=2, min_limit=1, max_limit=10, queue_size=1, queue_timeout=0.2,
+                       target_latency=1.0, backoff=0.5)
+        options.update(kwargs)
+        return AdmissionController(**options)
+
+    async def test_queue_full_and_timeout(self):
+        controller = self.make()
+        await controller.acquire()
+        await controller.acquire()
+        waiting = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        with self.assertRaises(AdmissionRejected) as ctx:
+            await controller.acquire()
+        self.assertEqual(ctx.exception.status, 429)
+        with self.assertRaises(AdmissionRejected) as ctx:
+            await waiting
+        self.assertEqual(ctx.exception.status, 503)
+        self.assertEqual(controller.stats()["waiting"], 0)
+
+    async def test_release_hands_slot_to_first_waiter(self):
+        controller = self.make()
+        first = await controller.acquire()
+        await controller.acquire()
+        waiting = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        first.release()
+        first.release()  # 重复释放只算一次
+        await waiting
+        self.assertEqual(controller.inflight, 2)
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        controller = self.make(queue_timeout=5)
+        first = await controller.acquire()
+        await controller.acquire()
+        waiting = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(controller.stats()["waiting"], 0)
+        first.release()
+        self.assertEqual(controller.inflight, 1)
+
+    async def test_slow_upstream_decreases_limit_once_per_window(self):
+        controller = self.make(initial_limit=8)
+        controller.observe(5.0)
+        self.assertEqual(controller.stats()["limit"], 4)
+        controller.observe(5.0)
+        self.assertEqual(controller.stats()["limit"], 4)
+        controller._last_decrease -= 1.0
+        controller.observe(0.1, ok=False)
+        self.assertEqual(controller.stats()["limit"], 2)
+
+    async def test_fast_upstream_at_limit_increases_limit(self):
+        controller = self.make(initial_limit=2)
+        tickets = [await controller.acquire(), await controller.acquire()]
+        for _ in range(4):
+            controller.observe(0.1)
+        self.assertEqual(controller.stats()["limit"], 3)
+        for ticket in tickets:
+            ticket.release()
+        self.assertEqual(controller.inflight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/19 11:00
+# @File  : test_agent_pool.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : agent_pool 的单元测试：一致性哈希选节点、剔除和恢复
+
+import unittest
+from collections import Counter
+
+from agent_pool import AGENT_EJECT_FAILURES, AgentPool, HashRing, session_key
+
+URLS = [f"http://agent-{i}:10080" for i in range(4)]
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_walk_returns_every_node_once(self):
+        ring = HashRing(URLS)
+        self.assertEqual(sorted(ring.walk("session-1")), sorted(URLS))
+
+    def test_keys_are_spread_over_nodes(self):
+        ring = HashRing(URLS)
+        counts = Counter(next(iter(ring.walk(f"session-{i}"))) for i in range(4000))
+        self.assertEqual(set(counts), set(URLS))
+        self.assertLess(max(counts.values()) / min(counts.values()), 2)
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        before = HashRing(URLS)
+        after = HashRing(URLS[1:])
+        for i in range(2000):
+            key = f"session-{i}"
+            owner = next(iter(before.walk(key)))
+            if owner != URLS[0]:
+                self.assertEqual(next(iter(after.walk(key))), owner)
+
+
+class AgentPoolTest(unittest.TestCase):
+
+    def test_same_key_same_node(self):
+        pool = AgentPool(URLS)
+        self.assertEqual(len({pool.pick("session-1") for _ in range(10)}), 1)
+
+    def test_unhealthy_node_is_skipped_and_restored(self):
+        pool = AgentPool(URLS)
+        owner = pool.pick("session-1")
+        for _ in range(AGENT_EJECT_FAILURES):
+            pool.report_failure(owner, "boom")
+        self.assertNotEqual(pool.pick("session-1"), owner)
+        pool.report_success(owner)
+        self.assertEqual(pool.pick("session-1"), owner)
+
+    def test_exclude_is_used_for_retries(self):
+        pool = AgentPool(URLS)
+        first = pool.pick("session-1")
+        self.assertNotEqual(pool.pick("session-1", exclude=[first]), first)
+        # 全部排除时仍然返回一个节点
+        self.assertIn(pool.pick("session-1", exclude=URLS), URLS)
+
+    def test_duplicate_urls_and_trailing_slash(self):
+        pool = AgentPool(["http://a:1/", "http://a:1", " "])
+        self.assertEqual(pool.urls, ["http://a:1"])
+        with self.assertRaises(ValueError):
+            AgentPool([])
+
+
+class SessionKeyTest(unittest.TestCase):
+
+    def test_session_id_wins(self):
+        self.assertEqual(session_key("s-1", [], "hi"), "s-1")
+
+    def test_fallback_uses_first_user_message(self):
+        history = [{"role": "user", "content": "first"}, {"role": "assistant", "content": "ok"}]
+        self.assertEqual(session_key("", history, "second"), session_key("", [], "first"))
+
+
+if __name__ == "__main__":
+    unittest.main()
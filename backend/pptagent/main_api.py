@@ -9,16 +9,17 @@ from dotenv import load_dotenv
 from google.adk.artifacts import InMemoryArtifactService
 from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
 from starlette.routing import Route
 from google.adk.agents.run_config import RunConfig, StreamingMode
 from a2a.server.apps import A2AStarletteApplication
 from a2a.server.request_handlers import DefaultRequestHandler
-from a2a.server.tasks import InMemoryTaskStore
 from a2a.types import AgentCapabilities, AgentCard, AgentSkill
 from starlette.middleware.cors import CORSMiddleware
 from starlette.applications import Starlette
 from agent import root_agent
+from session_service import get_session_service
+from task_store import get_task_store
+from shared_state import get_queue_manager, is_shared
 
 # 加载环境变量
 load_dotenv()
@@ -71,7 +72,8 @@ def create_app(host: str, port: int, agent_url: str = "") -> Starlette:
         app_name=agent_card.name,
         agent=root_agent,
         artifact_service=InMemoryArtifactService(),
-        session_service=InMemorySessionService(),
+        # 有上限的会话缓存，写入 SQLite，重启后会话仍在
+        session_service=get_session_service(),
         memory_service=InMemoryMemoryService(),
     )
 
@@ -94,7 +96,9 @@ def create_app(host: str, port: int, agent_url: str = "") -> Starlette:
 
     # 请求处理器，管理任务存储和请求分发
     request_handler = DefaultRequestHandler(
-        agent_executor=agent_executor, task_store=InMemoryTaskStore()
+        agent_executor=agent_executor, task_store=get_task_store(),
+        # 配置了 SHARED_STATE_DIR 时，事件流通过共享目录分发给其它 worker
+        queue_manager=get_queue_manager(),
     )
 
     # 构建 Starlette 应用
@@ -125,19 +129,39 @@ def create_app(host: str, port: int, agent_url: str = "") -> Starlette:
 @click.option("--agent_url", default="")
 def main(host: str, port: int, agent_url: str=""):
     logger.info("启动 Outline Agent 服务")
-    app = create_app(host, port, agent_url)
-
     workers = int(os.environ.get("UVICORN_WORKERS", "1"))
-    if os.environ.get("STREAMING") == "true":
+    if workers > 1 and os.environ.get("STREAMING") == "true" and not is_shared():
+        # 会话、任务和事件流默认只在当前进程内，流式模式多 worker 需要共享
+        logger.warning("流式模式使用多个 worker 需要配置 SHARED_STATE_DIR，改为单 worker 运行")
         workers = 1
 
-    uvicorn.run(app, host=host, port=port, workers=workers)
+    if workers > 1:
+        # 多 worker 时 app 只在每个 worker 中创建（build_app），主进程不创建 app，也不占用 outbox 等进程级资源；
+        # 命令行参数通过环境变量传给 worker。
+        # 注意 uvicorn 的多个 worker 共用一个端口，请求随机分配，没有按 contextId 的粘性路由：
+        # 同一个会话的请求串行到达时（前端一个对话同时只有一个请求）由共享的 SQLite 保证一致，
+        # 同一个会话的并发请求需要在前面加按 contextId 路由的代理，或者用多个单 worker 的副本
+        os.environ.update(HOST=host, PORT=str(port), AGENT_URL=agent_url)
+        uvicorn.run("main_api:build_app", factory=True, host=host, port=port, workers=workers)
+    else:
+        uvicorn.run(create_app(host, port, agent_url), host=host, port=port)
+
+
+def build_app() -> Starlette:
+    """按环境变量创建 app，给 uvicorn 的多 worker（factory）和 `uvicorn main_api:app` 使用"""
+    return create_app(host=os.environ.get("HOST", "0.0.0.0"),
+                      port=int(os.environ.get("PORT", "10071")),
+                      agent_url=os.environ.get("AGENT_URL", ""))
+
+
+def __getattr__(name: str):
+    # 让 uvicorn/gunicorn 可直接 import:app，只在第一次访问时创建，import 本模块本身没有副作用
+    if name == "app":
+        global app
+        app = build_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# 让 uvicorn/gunicorn 可直接 import:app
-# 默认 host/port 只是给本地 CLI 用
-app = create_app(host=os.environ.get("HOST", "0.0.0.0"),
-                 port=int(os.environ.get("PORT", "10071")),
-                 agent_url=os.environ.get("AGENT_URL", ""))
 
 if __name__ == "__main__":
     main()
@@ -34,6 +34,7 @@ from a2a.types import (
     SendMessageSuccessResponse,
     Task,
     TaskQueryParams,
+    TaskNotCancelableError,
     TaskState,
     TaskStatus,
     TextPart,
@@ -153,17 +154,11 @@ class ADKAgentExecutor(AgentExecutor):
             if event.get_function_responses():
                 logger.info(f"工具返回了结果... 返回DataPart数据, {event}")
                 references = {}
-                try:
-                    final_session = await self.runner.session_service.get_session(
-                        app_name=self.runner.app_name,
-                        user_id="self",
-                        session_id=session_id,
-                    )
-                    if final_session is not None and getattr(final_session, "state", None):
-                        search_dbs = final_session.state.get("search_dbs", [])
-                        references = {"search_dbs": search_dbs}
-                except Exception as e:
-                    logger.exception(f"获取工具引用信息失败: {e}")
+                # 搜索工具把完整记录写在本次事件的 state_delta 里（模型只拿到精简结果），
+                # 直接从事件中取，不用再读整个 session，也不会带上之前搜索的旧结果
+                state_delta = event.actions.state_delta if event.actions else {}
+                if "search_dbs" in state_delta:
+                    references = {"search_dbs": state_delta["search_dbs"]}
 
                 await task_updater.update_status(
                     TaskState.working,
@@ -213,8 +208,18 @@ class ADKAgentExecutor(AgentExecutor):
         logger.debug("[adk agent] 执行完成，退出")
 
     async def cancel(self, context: RequestContext, event_queue: EventQueue):
-        """取消请求"""
-        raise ServerError(error=UnsupportedOperationError())
+        """
+        取消请求（main_api 在客户端断开时调用 tasks/cancel）：发出 canceled 状态，
+        DefaultRequestHandler 随后取消正在运行的 execute，中断模型调用，不再消耗 token
+        """
+        task = context.current_task
+        if task is None or task.status.state in (
+            TaskState.completed, TaskState.canceled, TaskState.failed, TaskState.rejected
+        ):
+            raise ServerError(error=TaskNotCancelableError())
+        logger.info(f"取消任务: {task.id}, 会话: {task.contextId}")
+        updater = TaskUpdater(event_queue, task.id, task.contextId)
+        await updater.cancel()
 
     async def _upsert_session(self, session_id: str, metadata: dict | None = None) -> any:
         """
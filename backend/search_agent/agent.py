@@ -1,3 +1,4 @@
+import logging
 import os
 import random
 
@@ -13,18 +14,22 @@ from create_model import create_model
 from google.adk.planners import BuiltInPlanner
 from google.genai import types
 from tools import search_advanced,translate_paper_tool,generate_ppt_tool
+from context_manager import get_context_manager
 from dotenv import load_dotenv
 import prompt
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def before_model_callback(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
     # 1. 检查用户输入
     agent_name = callback_context.agent_name
     history_length = len(llm_request.contents)
-    metadata = callback_context.state.get("metadata")
-    print(f"调用了{agent_name}模型前的callback, 现在Agent共有{history_length}条历史记录,metadata数据为：{metadata}")
+    logger.debug(f"调用了{agent_name}模型前的callback, 现在Agent共有{history_length}条历史记录")
     #清空contents,不需要上一步的拆分topic的记录, 不能在这里清理，否则，每次调用工具都会清除记忆，白操作了
     # llm_request.contents.clear()
+    # 超出 token 预算时压缩较早的工具返回和对话
+    get_context_manager().fit(llm_request)
     # 返回 None，继续调用 LLM
     return None
 def after_model_callback(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
@@ -60,7 +65,7 @@ class SearchAgent(LlmAgent):
             model=create_model(model=os.environ["LLM_MODEL"], provider=os.environ["MODEL_PROVIDER"]),
             description="搜索Agent",
             instruction=self._get_dynamic_instruction,
-            # before_model_callback=before_model_callback,
+            before_model_callback=before_model_callback,
             # after_model_callback=after_model_callback,
             # after_tool_callback=after_tool_callback,
             tools=[search_advanced,translate_paper_tool,generate_ppt_tool],
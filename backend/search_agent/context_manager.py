@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 20:30
+# @File  : context_manager.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 上下文窗口管理：在 before_model_callback 中按 token 预算压缩历史，长会话每轮的输入长度保持稳定
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# 发给模型的 token 预算（历史 + 系统提示词），0 表示不限制
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 16000))
+# 最近的多少条消息始终原样保留
+CONTEXT_KEEP_RECENT = int(os.getenv("CONTEXT_KEEP_RECENT", 6))
+# 旧的工具返回压缩后保留的字符数
+CONTEXT_TOOL_RESPONSE_CHARS = int(os.getenv("CONTEXT_TOOL_RESPONSE_CHARS", 300))
+# 被省略的用户问题在摘要中保留的字符数
+CONTEXT_SUMMARY_QUESTION_CHARS = 80
+# token 计数缓存的条数
+TOKEN_CACHE_SIZE = 4096
+
+
+class TokenCounter:
+    """
+    带缓存的 token 计数：历史消息每轮都会重复出现，同一段文本只计算一次。
+    litellm 不可用或者计数失败时按字符数粗略估算。
+    """
+
+    def __init__(self, model: str, max_entries: int = TOKEN_CACHE_SIZE):
+        self.model = model
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        try:
+            from litellm import token_counter
+            self._token_counter = token_counter
+        except ImportError:
+            self._token_counter = None
+
+    @staticmethod
+    def _estimate(text: str) -> int:
+        # 中文大约 1 字 1 token，英文大约 4 个字符 1 token
+        cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+        return cjk + (len(text) - cjk) // 4 + 1
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        key = hashlib.md5(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        tokens = None
+        if self._token_counter is not None:
+            try:
+                tokens = self._token_counter(model=self.model, text=text)
+            except Exception as e:
+                logger.debug(f"token 计数失败，改为估算: {e}")
+        if tokens is None:
+            tokens = self._estimate(text)
+        with self._lock:
+            self._cache[key] = tokens
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+
+def _part_text(part: types.Part) -> str:
+    if part.text:
+        return part.text
+    if part.function_call:
+        return json.dumps({"name": part.function_call.name, "args": part.function_call.args},
+                          ensure_ascii=False, default=str)
+    if part.function_response:
+        return json.dumps({"name": part.function_response.name, "response": part.function_response.response},
+                          ensure_ascii=False, default=str)
+    return ""
+
+
+def _is_function_response(content: types.Content) -> bool:
+    return any(part.function_response for part in content.parts or [])
+
+
+def _is_user_text(content: types.Content) -> bool:
+    return content.role == "user" and any(part.text for part in content.parts or [])
+
+
+def _compact_response(response: Any) -> Dict[str, Any]:
+    """旧的工具返回只保留状态字段和一段截断的内容"""
+    compact: Dict[str, Any] = {}
+    if isinstance(response, dict):
+        for key in ("code", "msg", "total", "status"):
+            if key in response:
+                compact[key] = response[key]
+    text = json.dumps(response, ensure_ascii=False, default=str)
+    compact["truncated_content"] = text[:CONTEXT_TOOL_RESPONSE_CHARS] + ("…" if len(text) > CONTEXT_TOOL_RESPONSE_CHARS else "")
+    compact["note"] = "较早的工具返回已压缩，需要完整内容请重新调用工具"
+    return compact
+
+
+class ContextWindowManager:
+    """
+    发给模型前检查 token 数，超过预算时依次：
+    1. 把较早的 function_response 压缩成摘要（搜索结果通常是最大的部分）；
+    2. 仍然超出时，把最早的若干条消息替换成一条摘要消息（列出被省略的用户问题）。
+    最近 CONTEXT_KEEP_RECENT 条消息和本轮用户问题之后的消息（含本轮的工具调用）不会被改动。
+    只替换 llm_request.contents 中的对象，不修改 session 中的 events。
+    """
+
+    def __init__(self, model: str, budget: int = CONTEXT_TOKEN_BUDGET, keep_recent: int = CONTEXT_KEEP_RECENT):
+        self.counter = TokenCounter(model)
+        self.budget = budget
+        self.keep_recent = keep_recent
+
+    def _content_tokens(self, content: types.Content) -> int:
+        return sum(self.counter.count(_part_text(part)) for part in content.parts or []) + 4
+
+    def _system_tokens(self, llm_request) -> int:
+        config = getattr(llm_request, "config", None)
+        instruction = getattr(config, "system_instruction", None) if config else None
+        if isinstance(instruction, str):
+            return self.counter.count(instruction)
+        if isinstance(instruction, types.Content):
+            return self._content_tokens(instruction)
+        return 0
+
+    def _protected_from(self, contents: List[types.Content]) -> int:
+        """从这个下标开始的消息不压缩"""
+        protected = max(0, len(contents) - self.keep_recent)
+        for idx in range(len(contents) - 1, -1, -1):
+            if _is_user_text(contents[idx]):
+                return min(protected, idx)
+        return protected
+
+    def fit(self, llm_request) -> Optional[Dict[str, int]]:
+        """按预算压缩 llm_request.contents，返回压缩前后的 token 数；没有超出预算时返回 None"""
+        contents: List[types.Content] = llm_request.contents
+        if self.budget <= 0 or not contents:
+            return None
+        tokens = [self._content_tokens(content) for content in contents]
+        system_tokens = self._system_tokens(llm_request)
+        before = total = system_tokens + sum(tokens)
+        if total <= self.budget:
+            return None
+
+        protected = self._protected_from(contents)
+
+        # 1. 压缩较早的工具返回
+        for idx in range(protected):
+            if total <= self.budget:
+                break
+            content = contents[idx]
+            if not _is_function_response(content):
+                continue
+            parts = []
+            for part in content.parts:
+                if part.function_response:
+                    part = types.Part(function_response=types.FunctionResponse(
+                        id=part.function_response.id,
+                        name=part.function_response.name,
+                        response=_compact_response(part.function_response.response),
+                    ))
+                parts.append(part)
+            contents[idx] = types.Content(role=content.role, parts=parts)
+            new_tokens = self._content_tokens(contents[idx])
+            total += new_tokens - tokens[idx]
+            tokens[idx] = new_tokens
+
+        # 2. 省略最早的消息，换成一条摘要
+        if total > self.budget:
+            cut = 0
+            while cut < protected and total > self.budget:
+                total -= tokens[cut]
+                cut += 1
+            # 不要让保留的部分以工具返回开头（否则它对应的工具调用已经被省略）
+            while cut < protected and _is_function_response(contents[cut]):
+                total -= tokens[cut]
+                cut += 1
+            if cut:
+                questions = []
+                for content in contents[:cut]:
+                    if _is_user_text(content):
+                        text = " ".join(part.text for part in content.parts if part.text)
+                        questions.append(" ".join(text.split())[:CONTEXT_SUMMARY_QUESTION_CHARS])
+                summary = f"[较早的 {cut} 条对话已省略以控制上下文长度。"
+                if questions:
+                    summary += "用户之前问过：" + "；".join(questions)
+                summary += "]"
+                summary_content = types.Content(role="user", parts=[types.Part(text=summary)])
+                contents[:cut] = [summary_content]
+                total += self._content_tokens(summary_content)
+
+        logger.info(f"上下文超出预算 {self.budget}，token 数 {before} -> {total}，消息数 {len(contents)}")
+        return {"before": before, "after": total}
+
+
+_context_manager: Optional[ContextWindowManager] = None
+_context_manager_lock = threading.Lock()
+
+
+def get_context_manager() -> ContextWindowManager:
+    """返回进程级单例，token 计数缓存在所有会话之间共享"""
+    global _context_manager
+    if _context_manager is None:
+        with _context_manager_lock:
+            if _context_manager is None:
+                _context_manager = ContextWindowManager(os.getenv("LLM_MODEL", "gpt-4o"))
+    return _context_manager
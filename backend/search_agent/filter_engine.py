@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 18:30
+# @File  : filter_engine.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : filter_string 的列式执行：文档属性按列存成 numpy 数组，范围/多选条件向量化求值
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from search_cache import normalize_filter
+
+logger = logging.getLogger(__name__)
+
+# 缓存整库掩码的个数（相同的 filter 反复出现时不必重复计算）
+FILTER_MASK_CACHE_SIZE = int(os.getenv("FILTER_MASK_CACHE_SIZE", 32))
+
+# 缺失值：日期/整数列用最小值，浮点列用 NaN，分类列用 -1；任何范围条件都不会命中缺失值
+MISSING_INT = np.iinfo(np.int32).min
+MISSING_CODE = -1
+
+# 列类型
+COLUMN_DATE = "date"  # 距 1970-01-01 的天数，int32
+COLUMN_FLOAT = "float"  # float32
+COLUMN_INT = "int"  # int32
+COLUMN_CATEGORY = "category"  # 字典编码，int32 编码 + 取值列表
+
+# 列名 -> (类型, 语料记录中的 key)
+COLUMNS = {
+    "publish_days": (COLUMN_DATE, "publish_date"),
+    "impact_factor": (COLUMN_FLOAT, "impact_factor"),
+    "cited_by": (COLUMN_INT, "cited_by"),
+    "publication_type": (COLUMN_CATEGORY, "publication_type"),
+    "journal": (COLUMN_CATEGORY, "journal"),
+}
+
+# FilterBuilder 中的 key -> 列名
+FILTER_KEYS = {
+    "doc_publish_time": "publish_days",
+    "doc_if": "impact_factor",
+    "doc_cited_by": "cited_by",
+    "doc_publish_type": "publication_type",
+    "doc_journal": "journal",
+}
+
+_EPOCH = date(1970, 1, 1)
+
+
+def to_days(value: Any) -> int:
+    """'2025-02-28' 或 '2025-02-28 00:00:00' -> 距 1970-01-01 的天数，只有年份时取 1 月 1 日"""
+    text = str(value).strip()[:10]
+    if len(text) == 4 and text.isdigit():
+        text = f"{text}-01-01"
+    return (date.fromisoformat(text) - _EPOCH).days
+
+
+def _to_number(value: Any, cast, missing):
+    if value is None or value == "":
+        return missing
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return missing
+
+
+# -----------------------------------------------------------------------------
+# 建列
+# -----------------------------------------------------------------------------
+
+class ColumnWriter:
+    """建索引时逐条收集文档属性，最后写成 columns/*.npy 和 columns/categories.json"""
+
+    def __init__(self):
+        self.values: Dict[str, List[Any]] = {name: [] for name in COLUMNS}
+        self.categories: Dict[str, Dict[str, int]] = {
+            name: {} for name, (kind, _) in COLUMNS.items() if kind == COLUMN_CATEGORY
+        }
+
+    def add(self, record: Dict[str, Any]):
+        for name, (kind, key) in COLUMNS.items():
+            value = record.get(key)
+            if kind == COLUMN_DATE:
+                try:
+                    value = to_days(value) if value else MISSING_INT
+                except ValueError:
+                    value = MISSING_INT
+            elif kind == COLUMN_FLOAT:
+                value = _to_number(value, float, np.nan)
+            elif kind == COLUMN_INT:
+                value = _to_number(value, int, MISSING_INT)
+            else:
+                text = str(value).strip() if value is not None else ""
+                if text:
+                    value = self.categories[name].setdefault(text, len(self.categories[name]))
+                else:
+                    value = MISSING_CODE
+            self.values[name].append(value)
+
+    def save(self, index_dir: str):
+        column_dir = os.path.join(index_dir, "columns")
+        os.makedirs(column_dir, exist_ok=True)
+        for name, (kind, _) in COLUMNS.items():
+            dtype = np.float32 if kind == COLUMN_FLOAT else np.int32
+            np.save(os.path.join(column_dir, f"{name}.npy"), np.asarray(self.values[name], dtype=dtype))
+        categories = {name: sorted(mapping, key=mapping.get) for name, mapping in self.categories.items()}
+        with open(os.path.join(column_dir, "categories.json"), "w", encoding="utf-8") as f:
+            json.dump(categories, f, ensure_ascii=False)
+
+
+# -----------------------------------------------------------------------------
+# 解析 filter_string
+# -----------------------------------------------------------------------------
+
+class FilterClause:
+    """一个筛选条件：范围 [low, high]（任一端可以为空）或者多选值"""
+
+    __slots__ = ("key", "column", "low", "high", "options")
+
+    def __init__(self, key: str, column: str, low=None, high=None, options: Optional[List[str]] = None):
+        self.key = key
+        self.column = column
+        self.low = low
+        self.high = high
+        self.options = options
+
+
+def parse_filter(filter_string: str) -> List[FilterClause]:
+    """
+    解析 FilterBuilder 生成的 filter_string：
+    @@AND$$doc_if$$5$$30@@AND$$doc_publish_type$$Review$OR$Clinical Trial
+    不支持的 key 或格式错误时抛出 ValueError。
+    """
+    clauses: List[FilterClause] = []
+    for raw in (filter_string or "").split("@@AND$$"):
+        raw = raw.strip()
+        if not raw:
+            continue
+        key, *values = [part.strip() for part in raw.split("$$")]
+        column = FILTER_KEYS.get(key)
+        if column is None:
+            raise ValueError(f"不支持的筛选条件: {key}，可用的有 {', '.join(FILTER_KEYS)}")
+        kind = COLUMNS[column][0]
+        if not values or len(values) > 2:
+            raise ValueError(f"筛选条件 {raw} 格式错误")
+        if kind == COLUMN_CATEGORY:
+            options = [v.strip() for v in "$$".join(values).split("$OR$") if v.strip()]
+            clauses.append(FilterClause(key, column, options=options))
+            continue
+        # 数值/日期：一个值表示等于，两个值表示闭区间，空字符串表示不限
+        low, high = (values[0], values[0]) if len(values) == 1 else values
+        cast = to_days if kind == COLUMN_DATE else (float if kind == COLUMN_FLOAT else int)
+        try:
+            low = cast(low) if low else None
+            high = cast(high) if high else None
+        except ValueError:
+            if kind == COLUMN_DATE:
+                raise ValueError(f"{key} 日期格式错误，请使用 YYYY-MM-DD，例如 2023-01-01")
+            raise ValueError(f"{key} 的取值必须是数字: {raw}")
+        clauses.append(FilterClause(key, column, low=low, high=high))
+    return clauses
+
+
+# -----------------------------------------------------------------------------
+# 执行
+# -----------------------------------------------------------------------------
+
+class FilterEngine:
+    """
+    列式筛选：每列一个 mmap 的 numpy 数组，下标就是文档编号。
+    - 候选文档少时只取候选文档那几行求值(gather)；
+    - 候选文档多(或没有全文检索条件)时对整列求掩码，掩码按 filter 缓存，再用候选文档编号取值。
+    """
+
+    def __init__(self, index_dir: str):
+        column_dir = os.path.join(index_dir, "columns")
+        self.columns: Dict[str, np.ndarray] = {
+            name: np.load(os.path.join(column_dir, f"{name}.npy"), mmap_mode="r") for name in COLUMNS
+        }
+        with open(os.path.join(column_dir, "categories.json"), "r", encoding="utf-8") as f:
+            categories = json.load(f)
+        self.category_codes: Dict[str, Dict[str, int]] = {
+            name: {value: code for code, value in enumerate(values)} for name, values in categories.items()
+        }
+        self.num_docs = len(next(iter(self.columns.values())))
+        self._mask_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _clause_mask(self, clause: FilterClause, values: np.ndarray) -> np.ndarray:
+        kind = COLUMNS[clause.column][0]
+        if kind == COLUMN_CATEGORY:
+            mapping = self.category_codes.get(clause.column, {})
+            codes = [mapping[v] for v in clause.options if v in mapping]
+            if not codes:
+                return np.zeros(len(values), dtype=bool)
+            if len(codes) == 1:
+                return values == codes[0]
+            return np.isin(values, np.asarray(codes, dtype=values.dtype))
+        if kind == COLUMN_FLOAT:
+            mask = ~np.isnan(values)
+        else:
+            mask = values != MISSING_INT
+        if clause.low is not None:
+            mask &= values >= clause.low
+        if clause.high is not None:
+            mask &= values <= clause.high
+        return mask
+
+    def _evaluate(self, clauses: List[FilterClause], docs: Optional[np.ndarray]) -> np.ndarray:
+        mask = None
+        for clause in clauses:
+            column = self.columns[clause.column]
+            values = column if docs is None else column[docs]
+            clause_mask = self._clause_mask(clause, values)
+            mask = clause_mask if mask is None else (mask & clause_mask)
+        return mask
+
+    def full_mask(self, filter_key: str, clauses: List[FilterClause]) -> np.ndarray:
+        """整库的布尔掩码，按 filter 缓存"""
+        with self._lock:
+            mask = self._mask_cache.get(filter_key)
+            if mask is not None:
+                self._mask_cache.move_to_end(filter_key)
+                return mask
+        mask = self._evaluate(clauses, None)
+        with self._lock:
+            self._mask_cache[filter_key] = mask
+            while len(self._mask_cache) > FILTER_MASK_CACHE_SIZE:
+                self._mask_cache.popitem(last=False)
+        return mask
+
+    def apply(self, filter_string: str, docs: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """对全文检索的候选文档(升序编号)应用 filter，返回留下的文档和分数"""
+        clauses = parse_filter(filter_string)
+        if not clauses or not len(docs):
+            return docs, scores
+        # 候选文档不到总数的 1/8 时逐行取值更省，否则用(缓存的)整库掩码
+        if len(docs) * 8 < self.num_docs:
+            keep = self._evaluate(clauses, docs)
+        else:
+            keep = self.full_mask(normalize_filter(filter_string), clauses)[docs]
+        return docs[keep], scores[keep]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"num_docs": self.num_docs, "cached_masks": len(self._mask_cache)}
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 17:50
+# @File  : local_index.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 本地文献倒排索引：按字段建索引、BM25 打分、postings 内存映射，直接执行检索式语法树
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import click
+import numpy as np
+
+from filter_engine import ColumnWriter, FilterEngine
+from query_parser import Node, Term, parse_query
+from search_cache import make_search_cache_key
+from sort_orders import SORT_RELEVANT, SortOrders, build_sort_orders
+
+logger = logging.getLogger(__name__)
+
+# 本地索引目录，配置后 search_advanced 直接查询本地索引
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "")
+# BM25 参数
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+
+INDEX_VERSION = 3
+
+# 建索引的字段 -> 语料记录中的 key
+INDEXED_FIELDS = {
+    "Title": "title",
+    "Abstract": "abstract",
+    "MeSH Terms": "mesh_terms",
+    "Author": "authors",
+    "Journal": "journal",
+    "Affiliation": "affiliation",
+}
+
+# 检索式中的字段限定符 -> 实际查询的字段，和 tools.SearchField 对应；没有限定符时查询全部字段
+FIELD_ALIASES = {
+    "Title": ("Title",),
+    "Abstract": ("Abstract",),
+    "Title/Abstract": ("Title", "Abstract"),
+    "MeSH Terms": ("MeSH Terms",),
+    "Author": ("Author",),
+    "First Author": ("Author",),
+    "Last Author": ("Author",),
+    "Corporate Author": ("Author",),
+    "Journal": ("Journal",),
+    "Affiliation": ("Affiliation",),
+    "First Author Affiliation": ("Affiliation",),
+    "Last Author Affiliation": ("Affiliation",),
+}
+
+# 英文数字按单词切分；中日韩文字没有分隔符，按字的二元组(bigram)切分
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def analyze(text: str) -> List[str]:
+    """分词：小写化，英文按单词，中文按 bigram（单个汉字保留为一个词）"""
+    tokens: List[str] = []
+    for chunk in _TOKEN_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(chunk):
+            if len(chunk) == 1:
+                tokens.append(chunk)
+            else:
+                tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+        else:
+            tokens.append(chunk)
+    return tokens
+
+
+def _field_text(record: Dict[str, Any], key: str) -> str:
+    value = record.get(key)
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+
+def _term_key(field: str, token: str) -> str:
+    return f"{field}\t{token}"
+
+
+# -----------------------------------------------------------------------------
+# 建索引
+# -----------------------------------------------------------------------------
+
+def build_index(corpus_path: str, index_dir: str, k1: float = BM25_K1, b: float = BM25_B) -> Dict[str, Any]:
+    """
+    从 JSONL 语料建索引，每行一篇文献，字段和 search_advanced 返回的 records 一致
+    (id, title, abstract, authors, journal, publish_date, impact_factor, publication_type, link)，
+    可选 mesh_terms、affiliation。
+    输出文件：
+    - meta.json: 文档数、各字段平均长度、BM25 参数
+    - vocab.json: "字段\\t词" -> 词编号
+    - term_offsets.npy: 每个词在 postings 中的起止位置
+    - postings_doc.npy / postings_score.npy: 文档编号(升序) 和预先算好的 BM25 分数
+    - records.jsonl / record_offsets.npy: 原始记录，按文档编号随机读取
+    - columns/: 筛选用的文档属性列，见 filter_engine.ColumnWriter
+    - sort/: 各排序字段的名次数组，见 sort_orders.build_sort_orders
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    doc_lengths: Dict[str, List[int]] = {field: [] for field in INDEXED_FIELDS}
+    record_offsets = [0]
+    columns = ColumnWriter()
+
+    with open(corpus_path, "r", encoding="utf-8") as corpus, \
+            open(os.path.join(index_dir, "records.jsonl"), "wb") as records_out:
+        doc_id = 0
+        for line in corpus:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            for field, key in INDEXED_FIELDS.items():
+                tokens = analyze(_field_text(record, key))
+                doc_lengths[field].append(len(tokens))
+                for token, tf in Counter(tokens).items():
+                    postings[_term_key(field, token)].append((doc_id, tf))
+            columns.add(record)
+            data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            records_out.write(data)
+            record_offsets.append(record_offsets[-1] + len(data))
+            doc_id += 1
+    num_docs = doc_id
+
+    lengths = {field: np.asarray(values, dtype=np.float32) for field, values in doc_lengths.items()}
+    avgdl = {field: float(values.mean()) if num_docs else 0.0 for field, values in lengths.items()}
+
+    vocab: Dict[str, int] = {}
+    term_offsets = [0]
+    doc_chunks: List[np.ndarray] = []
+    score_chunks: List[np.ndarray] = []
+    for term_id, key in enumerate(sorted(postings)):
+        field = key.split("\t", 1)[0]
+        entries = postings[key]
+        docs = np.fromiter((d for d, _ in entries), dtype=np.int32, count=len(entries))
+        tfs = np.fromiter((tf for _, tf in entries), dtype=np.float32, count=len(entries))
+        df = len(entries)
+        idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+        norm = k1 * (1.0 - b + b * lengths[field][docs] / max(avgdl[field], 1e-6))
+        doc_chunks.append(docs)
+        score_chunks.append((idf * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32))
+        vocab[key] = term_id
+        term_offsets.append(term_offsets[-1] + df)
+
+    np.save(os.path.join(index_dir, "postings_doc.npy"),
+            np.concatenate(doc_chunks) if doc_chunks else np.zeros(0, dtype=np.int32))
+    np.save(os.path.join(index_dir, "postings_score.npy"),
+            np.concatenate(score_chunks) if score_chunks else np.zeros(0, dtype=np.float32))
+    np.save(os.path.join(index_dir, "term_offsets.npy"), np.asarray(term_offsets, dtype=np.int64))
+    np.save(os.path.join(index_dir, "record_offsets.npy"), np.asarray(record_offsets, dtype=np.int64))
+    columns.save(index_dir)
+    build_sort_orders(index_dir)
+    with open(os.path.join(index_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    meta = {
+        "version": INDEX_VERSION,
+        "num_docs": num_docs,
+        "num_terms": len(vocab),
+        "avgdl": avgdl,
+        "k1": k1,
+        "b": b,
+    }
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    logger.info(f"本地索引建立完成: {index_dir}, 文档数 {num_docs}, 词数 {len(vocab)}")
+    return meta
+
+
+# -----------------------------------------------------------------------------
+# 查询
+# -----------------------------------------------------------------------------
+
+# 匹配结果：(升序的文档编号, 对应的分数)
+Matches = Tuple[np.ndarray, np.ndarray]
+
+_EMPTY_DOCS = np.zeros(0, dtype=np.int32)
+_EMPTY_SCORES = np.zeros(0, dtype=np.float32)
+
+
+def _union(parts: List[Matches]) -> Matches:
+    """并集，同一文档的分数相加"""
+    parts = [part for part in parts if len(part[0])]
+    if not parts:
+        return _EMPTY_DOCS, _EMPTY_SCORES
+    if len(parts) == 1:
+        return parts[0]
+    docs = np.concatenate([part[0] for part in parts])
+    scores = np.concatenate([part[1] for part in parts])
+    unique_docs, inverse = np.unique(docs, return_inverse=True)
+    return unique_docs.astype(np.int32), np.bincount(inverse, weights=scores).astype(np.float32)
+
+
+def _intersect(parts: List[Matches]) -> Matches:
+    """交集，分数相加；从最短的列表开始求交"""
+    parts = sorted(parts, key=lambda part: len(part[0]))
+    docs, scores = parts[0]
+    for other_docs, other_scores in parts[1:]:
+        if not len(docs):
+            break
+        docs, left, right = np.intersect1d(docs, other_docs, assume_unique=True, return_indices=True)
+        scores = scores[left] + other_scores[right]
+    return docs, scores
+
+
+def _difference(left: Matches, right: Matches) -> Matches:
+    """left 去掉 right 中的文档，分数保持 left 的分数"""
+    if not len(left[0]) or not len(right[0]):
+        return left
+    keep = np.isin(left[0], right[0], assume_unique=True, invert=True)
+    return left[0][keep], left[1][keep]
+
+
+class LocalIndex:
+    """
+    只读的本地索引，postings 和记录偏移都用 mmap 打开，多个进程加载同一个目录时共享页缓存。
+    search() 是同步的 CPU 计算，在协程中调用时放到线程里执行。
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"本地索引版本不匹配: {self.meta.get('version')} != {INDEX_VERSION}，请重新建索引")
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+        self.num_docs = int(self.meta["num_docs"])
+        self.term_offsets = np.load(os.path.join(index_dir, "term_offsets.npy"), mmap_mode="r")
+        self.postings_doc = np.load(os.path.join(index_dir, "postings_doc.npy"), mmap_mode="r")
+        self.postings_score = np.load(os.path.join(index_dir, "postings_score.npy"), mmap_mode="r")
+        self.record_offsets = np.load(os.path.join(index_dir, "record_offsets.npy"), mmap_mode="r")
+        self.filters = FilterEngine(index_dir)
+        self.sort_orders = SortOrders(index_dir)
+        self._records_fd = os.open(os.path.join(index_dir, "records.jsonl"), os.O_RDONLY)
+
+    def close(self):
+        os.close(self._records_fd)
+
+    # ---- 检索词 ----
+
+    def _postings(self, field: str, token: str) -> Matches:
+        term_id = self.vocab.get(_term_key(field, token))
+        if term_id is None:
+            return _EMPTY_DOCS, _EMPTY_SCORES
+        start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+        return self.postings_doc[start:end], self.postings_score[start:end]
+
+    def _match_term(self, term: Term) -> Matches:
+        """
+        一个检索词：词中所有 token 都要出现(按 token 求交集)，每个 token 在限定的字段之间求并集。
+        短语只要求所有 token 出现，不校验相邻位置。
+        """
+        if term.field is None:
+            fields = tuple(INDEXED_FIELDS)
+        else:
+            fields = FIELD_ALIASES.get(term.field)
+            if fields is None:
+                raise ValueError(f"本地索引不支持字段限定符 [{term.field}]")
+        tokens = list(dict.fromkeys(analyze(term.text)))
+        if not tokens:
+            return _EMPTY_DOCS, _EMPTY_SCORES
+        per_token = [_union([self._postings(field, token) for field in fields]) for token in tokens]
+        return _intersect(per_token)
+
+    def evaluate(self, node: Node) -> Matches:
+        """执行语法树，返回匹配的文档编号(升序)和 BM25 分数"""
+        if isinstance(node, Term):
+            return self._match_term(node)
+        operands = [self.evaluate(operand) for operand in node.operands]
+        if node.op == "AND":
+            return _intersect(operands)
+        if node.op == "OR":
+            return _union(operands)
+        # NOT：第一个操作数去掉其余操作数
+        return _difference(operands[0], _union(operands[1:]))
+
+    # ---- 记录 ----
+
+    def get_record(self, doc_id: int) -> Dict[str, Any]:
+        start, end = int(self.record_offsets[doc_id]), int(self.record_offsets[doc_id + 1])
+        return json.loads(os.pread(self._records_fd, end - start, start).decode("utf-8"))
+
+    def get_records(self, doc_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self.get_record(int(doc_id)) for doc_id in doc_ids]
+
+    # ---- 检索 ----
+
+    def search(self, query_string: str, filter_string: str = "", sort_field: str = SORT_RELEVANT,
+               page_num: int = 1, page_size: int = 5, search_after: str = "") -> Dict[str, Any]:
+        """
+        返回一页结果，返回格式和远程搜索接口一致，另外带上下一页的游标 search_after（没有下一页时为空）
+        """
+        docs, scores = self.evaluate(parse_query(query_string))
+        docs, scores = self.filters.apply(filter_string, docs, scores)
+        page_num = max(1, int(page_num))
+        page_size = max(1, int(page_size))
+        query_key = make_search_cache_key(query_string, filter_string, sort_field, 0, 0)
+        page_docs, next_cursor = self.sort_orders.top_k(
+            docs, scores, sort_field, (page_num - 1) * page_size, page_size,
+            query_key=query_key, search_after=search_after,
+        )
+        return {
+            "code": 200,
+            "msg": "成功",
+            "records": self.get_records(page_docs),
+            "total": int(len(docs)),
+            "search_after": next_cursor or "",
+        }
+
+
+_local_index: Optional[LocalIndex] = None
+_local_index_lock = threading.Lock()
+
+
+def get_local_index() -> Optional[LocalIndex]:
+    """返回进程级单例，没有配置 LOCAL_INDEX_DIR 时返回 None"""
+    global _local_index
+    if not LOCAL_INDEX_DIR:
+        return None
+    if _local_index is None:
+        with _local_index_lock:
+            if _local_index is None:
+                _local_index = LocalIndex(LOCAL_INDEX_DIR)
+                logger.info(f"加载本地索引: {LOCAL_INDEX_DIR}, 文档数 {_local_index.num_docs}")
+    return _local_index
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("corpus_path")
+@click.argument("index_dir")
+def build(corpus_path, index_dir):
+    """从 JSONL 语料建立本地索引"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    build_index(corpus_path, index_dir)
+
+
+@cli.command()
+@click.argument("index_dir")
+@click.argument("query_string")
+@click.option("--filter_string", default="")
+@click.option("--sort_field", default=SORT_RELEVANT)
+@click.option("--page_num", default=1)
+@click.option("--page_size", default=5)
+@click.option("--search_after", default="")
+def search(index_dir, query_string, filter_string, sort_field, page_num, page_size, search_after):
+    """在本地索引上执行一次检索"""
+    result = LocalIndex(index_dir).search(query_string, filter_string, sort_field, page_num, page_size, search_after)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
@@ -6,25 +6,134 @@
 # @Contact : github: johnson7788
 # @Desc  : 记忆控制,从metadata的history中获取记忆
 
+import hashlib
 import logging
-import json
+import os
 import uuid
-from typing import List, Dict, Any
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
 from google.genai import types
 from google.adk.runners import Runner
 from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService
+from result_projection import format_records_for_prompt
 
 logger = logging.getLogger(__name__)
 
+# 最多记录多少个会话的同步状态
+HISTORY_SYNC_MAX_SESSIONS = int(os.getenv("HISTORY_SYNC_MAX_SESSIONS", 1024))
+SEARCH_RESULT_SEPARATOR = "\n\n[上次的搜索结果：]\n"
+
+
+def turn_fingerprints(turns: List[Dict[str, str]]) -> List[str]:
+    """
+    滚动哈希：h[i] = hash(h[i-1] + role + content)。
+    两份历史的前 k 条相同，当且仅当 h[k-1] 相同。
+    """
+    fingerprints = []
+    previous = b""
+    for turn in turns:
+        digest = hashlib.blake2b(previous, digest_size=16)
+        digest.update(turn["role"].encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(turn["content"].encode("utf-8"))
+        previous = digest.digest()
+        fingerprints.append(previous.hex())
+    return fingerprints
+
+
+class HistorySyncState:
+    """
+    某个会话上一次注入历史后的状态：
+    - fingerprints: 每条历史的滚动哈希
+    - positions: 每条历史对应的 event 在 session.events 中的位置
+    - synced_len / last_event_id: 注入完成时 events 的长度和最后一个 event 的 id，用来判断 session 是否被外部改过
+    - suffixed_turn: 追加了 search_result 的那条历史（文本被改过，下次需要重新生成）
+    """
+
+    def __init__(self, fingerprints: List[str], positions: List[int], synced_len: int,
+                 last_event_id: Optional[str], suffixed_turn: Optional[int]):
+        self.fingerprints = fingerprints
+        self.positions = positions
+        self.synced_len = synced_len
+        self.last_event_id = last_event_id
+        self.suffixed_turn = suffixed_turn
+
 
 class MemoryController:
     def __init__(self, runner: Runner):
         self.runner = runner
         self.app_name = runner.app_name
+        self._sync_states: "OrderedDict[str, HistorySyncState]" = OrderedDict()
+
+    @staticmethod
+    def _normalize_history(history_data: List[Any]) -> List[Dict[str, str]]:
+        """过滤无效的历史，统一 role：ADK 中 Content.role 只能是 "user" 或 "model" """
+        turns = []
+        for turn in history_data:
+            if not isinstance(turn, dict):
+                continue
+            role = turn.get("role")  # expecting "user" or "model"
+            content_text = turn.get("content")
+            if not role or not content_text:
+                continue
+            genai_role = "model" if role in ("model", "assistant") else "user"
+            turns.append({"role": genai_role, "content": str(content_text)})
+        return turns
+
+    def _matched_prefix(self, session_obj, fingerprints: List[str]) -> int:
+        """
+        可以复用的历史条数：上次注入的历史和这次的历史相同的前缀长度。
+        session 被外部改过、或者没有同步记录时返回 0（全部重建）。
+        """
+        state = self._sync_states.get(session_obj.id)
+        if state is None:
+            return 0
+        events = session_obj.events
+        if len(events) < state.synced_len:
+            return 0
+        if state.synced_len and events[state.synced_len - 1].id != state.last_event_id:
+            return 0
+        # 滚动哈希：从后往前找最长的相同前缀
+        matched = min(len(state.fingerprints), len(fingerprints))
+        while matched > 0 and state.fingerprints[matched - 1] != fingerprints[matched - 1]:
+            matched -= 1
+        # 追加过 search_result 的那条历史的文本和原文不一致，从这一条开始重新生成
+        if state.suffixed_turn is not None and state.suffixed_turn < matched:
+            matched = state.suffixed_turn
+        return matched
+
+    async def _truncate_events(self, session_obj, keep: int) -> bool:
+        """
+        把 session 的 events 截断到前 keep 个，本地对象和 session service 中存储的都要截断
+        （InMemorySessionService.get_session 返回的是深拷贝，只清空本地对象不会影响存储）。
+        不支持截断的 session service 返回 False。
+        """
+        session_service = self.runner.session_service
+        truncate = getattr(session_service, "truncate_events", None)
+        if truncate is not None:
+            await truncate(session=session_obj, keep=keep)
+        elif isinstance(session_service, InMemorySessionService):
+            storage = session_service.sessions.get(session_obj.app_name, {}).get(
+                session_obj.user_id, {}).get(session_obj.id)
+            if storage is not None:
+                del storage.events[keep:]
+            del session_obj.events[keep:]
+        else:
+            return False
+        return True
+
+    def _remember(self, session_id: str, state: HistorySyncState):
+        self._sync_states[session_id] = state
+        self._sync_states.move_to_end(session_id)
+        while len(self._sync_states) > HISTORY_SYNC_MAX_SESSIONS:
+            self._sync_states.popitem(last=False)
 
     async def inject_history_from_metadata(self, session_obj, metadata: Dict[str, Any]):
         """
         从 metadata 中读取 history 字段，并将其注入到当前 session 的 events 中。
+        以 metadata 中的 history 为准；和上一次注入的历史前缀相同时只追加新增的部分，
+        历史不一致时才清空重建。
         注意：这里直接操作 Session 对象。
         """
         if not metadata:
@@ -37,96 +146,82 @@ class MemoryController:
         if not history_data or not isinstance(history_data, list):
             return
 
-        logger.info(f"Session {session_obj.id}: 检测到 metadata 历史记录，准备注入 {len(history_data)} 条数据")
+        turns = self._normalize_history(history_data)
+        fingerprints = turn_fingerprints(turns)
 
-        # 【关键步骤 1】: 如果 metadata 里传了 history，通常意味着用户希望以这份历史为准。
-        # 因此我们需要清空 Session 中已有的 events，否则会变成 历史+历史+新问题。
-        # 如果你想做“追加”模式，请注释掉下面这行。
-        session_obj.events.clear()
+        # search_result 追加到最后一条 model 历史的文本末尾
+        search_text = None
+        suffixed_turn = None
+        if search_result:  # 非空才处理
+            try:
+                # 只注入精简后的表格（id、标题、年份、期刊、IF、截断的摘要），完整记录只给前端展示
+                search_text = format_records_for_prompt(search_result)
+            except Exception as e:
+                logger.warning(f"search_result 序列化失败，跳过追加: {e}")
+            if search_text:
+                suffixed_turn = next((i for i in range(len(turns) - 1, -1, -1) if turns[i]["role"] == "model"), None)
+                if suffixed_turn is None:
+                    logger.warning("未找到 role=model 的事件，search_result 未能追加")
+
+        matched = self._matched_prefix(session_obj, fingerprints)
+        if suffixed_turn is not None and suffixed_turn < matched:
+            # 这条历史要带上新的 search_result，从它开始重新生成
+            matched = suffixed_turn
+        state = self._sync_states.get(session_obj.id)
+        if matched:
+            positions = state.positions[:matched]
+            keep = state.positions[matched] if matched < len(state.positions) else state.synced_len
+        else:
+            positions = []
+            keep = 0
+
+        # 截断到可复用的前缀：丢掉上一轮运行产生的 events 和不一致的历史，它们由这次的 history 重新生成
+        if not await self._truncate_events(session_obj, keep):
+            # 不支持截断时退回到原来的做法：清空本地对象后全部重建
+            session_obj.events.clear()
+            matched, positions = 0, []
+        logger.info(
+            f"Session {session_obj.id}: 检测到 metadata 历史记录 {len(turns)} 条，复用 {matched} 条，追加 {len(turns) - matched} 条"
+        )
 
         # 获取 Session Service
         session_service = self.runner.session_service
 
-        for idx, turn in enumerate(history_data):
-            role = turn.get("role")  # expecting "user" or "model"
-            content_text = turn.get("content")
-
-            if role and content_text:
-                # 1. 转换 Role 和 Author
-                # ADK 中 Content.role 只能是 "user" 或 "model"
-                # ADK 中 Event.author 应该是 "user" 或者 Agent 的名字 (例如 "Navi_Agent")
-
-                genai_role = "user"
-                event_author = "user"
-
-                if role == "model" or role == "assistant":
-                    genai_role = "model"
-                    # 这里最好填入你的 Agent 名称，或者保持 "model"
-                    # 如果你的 Agent 有名字 (self.runner.agent.name)，最好用那个
-                    event_author = self.runner.agent.name
-
-                    # 2. 构建 Content 对象
-                new_message = types.Content(
-                    role=genai_role,
-                    parts=[types.Part(text=content_text)]
-                )
-
-                # 3. 构建 Event 对象
-                # Event 需要一个 invocation_id，我们这里生成一个假的 UUID 即可
-                dummy_invocation_id = str(uuid.uuid4())
-
-                event = Event(
-                    invocation_id=dummy_invocation_id,
-                    author=event_author,
-                    content=new_message
-                )
-
-                # 4. 插入到 Session 中
-                # 使用 session_service 的 append_event 方法
-                await session_service.append_event(
-                    session=session_obj,
-                    event=event
-                )
-
+        for turn_idx in range(matched, len(turns)):
+            turn = turns[turn_idx]
+            content_text = turn["content"]
+            if turn_idx == suffixed_turn:
+                content_text = f"{content_text}{SEARCH_RESULT_SEPARATOR}{search_text}"
+            # ADK 中 Event.author 应该是 "user" 或者 Agent 的名字 (例如 "Navi_Agent")
+            event_author = self.runner.agent.name if turn["role"] == "model" else "user"
+            new_message = types.Content(
+                role=turn["role"],
+                parts=[types.Part(text=content_text)]
+            )
+
+            # Event 需要一个 invocation_id，我们这里生成一个假的 UUID 即可
+            event = Event(
+                invocation_id=str(uuid.uuid4()),
+                author=event_author,
+                content=new_message
+            )
+
+            # 使用 session_service 的 append_event 方法插入到 Session 中
+            positions.append(len(session_obj.events))
+            await session_service.append_event(
+                session=session_obj,
+                event=event
+            )
+
+        if suffixed_turn is not None:
+            logger.info("search_result 已追加到最后一个 role=model 的文本末尾")
         logger.info(f"历史记录注入完成，当前 Session 共有 {len(session_obj.events)} 个事件")
 
-        # --------- 新增逻辑：把 search_result JSON 追加到最后一个 model 文本末尾 ----------
-        if search_result:  # 非空才处理
-            try:
-                search_json = json.dumps(search_result, ensure_ascii=False, indent=2)
-            except Exception as e:
-                logger.warning(f"search_result JSON 序列化失败，跳过追加: {e}")
-                search_json = None
-
-            if search_json:
-                appended = False
-                # 从后往前找最后一个 model 事件
-                for ev in reversed(session_obj.events):
-                    try:
-                        if not ev or not getattr(ev, "content", None):
-                            continue
-                        if getattr(ev.content, "role", None) != "model":
-                            continue
-
-                        parts = getattr(ev.content, "parts", None) or []
-                        if not parts:
-                            # 没有 parts 就补一个
-                            ev.content.parts = [types.Part(text="")]
-                            parts = ev.content.parts
-
-                        # 默认追加到第一个 part 的 text（你的代码本来就是单 part）
-                        last_text = getattr(parts[0], "text", "") or ""
-                        # 你也可以自定义分隔符
-                        separator = "\n\n[上次的搜索结果：]\n"
-                        parts[0].text = f"{last_text}{separator}{search_json}"
-
-                        appended = True
-                        break
-                    except Exception as e:
-                        logger.warning(f"追加 search_result 时发生异常，继续尝试前一个事件: {e}")
-                        continue
-
-                if appended:
-                    logger.info("search_result 已追加到最后一个 role=model 的文本末尾")
-                else:
-                    logger.warning("未找到 role=model 的事件，search_result 未能追加")
\ No newline at end of file
+        events = session_obj.events
+        self._remember(session_obj.id, HistorySyncState(
+            fingerprints=fingerprints,
+            positions=positions,
+            synced_len=len(events),
+            last_event_id=events[-1].id if events else None,
+            suffixed_turn=suffixed_turn,
+        ))
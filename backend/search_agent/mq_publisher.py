@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 10:12
+# @File  : mq_publisher.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 进程级 RabbitMQ 发布器：长连接 + 后台 IO 线程 + 异步 publisher confirm
+
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pika
+from pika.exceptions import AMQPError
+
+logger = logging.getLogger(__name__)
+
+# 发布失败时的最大重试次数（每次重试前都会重建连接）
+MQ_PUBLISH_RETRIES = int(os.getenv("MQ_PUBLISH_RETRIES", 3))
+# 重连退避的初始/最大等待秒数
+MQ_RECONNECT_DELAY = float(os.getenv("MQ_RECONNECT_DELAY", 0.5))
+MQ_RECONNECT_MAX_DELAY = float(os.getenv("MQ_RECONNECT_MAX_DELAY", 10))
+# 每个 channel 上一次最多连续发送的消息条数
+MQ_PUBLISH_BATCH = int(os.getenv("MQ_PUBLISH_BATCH", 100))
+# 空闲时处理心跳的间隔（秒）
+MQ_IDLE_INTERVAL = 1.0
+
+# (routing_key, body, properties, future)
+_PublishItem = Tuple[str, str, pika.BasicProperties, Future]
+
+
+class MQPublisher:
+    """
+    进程级的非阻塞 RabbitMQ 发布器。
+
+    - pika.BlockingConnection 不是线程安全的，所以连接只由一个后台 IO 线程持有，
+      调用方只需把消息放入内存队列，立即拿到一个 Future 返回，不会阻塞 event loop。
+    - 连接常驻复用，channel 开启 publisher confirm，按队列名缓存已声明的 channel。
+    - 连接断开时自动重连（指数退避），单条消息失败会按 MQ_PUBLISH_RETRIES 重试。
+    """
+
+    def __init__(self, connection_factory: Callable[[], pika.BlockingConnection]):
+        self._connection_factory = connection_factory
+        self._queue: "queue.Queue[Optional[_PublishItem]]" = queue.Queue()
+        self._connection: Optional[pika.BlockingConnection] = None
+        # queue_name -> 已声明并开启 confirm 的 channel
+        self._channels: Dict[str, pika.adapters.blocking_connection.BlockingChannel] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    # ------------------------------------------------------------------
+    # 调用方接口
+    # ------------------------------------------------------------------
+    def publish(self, body: str, routing_key: str, properties: Optional[pika.BasicProperties] = None) -> Future:
+        """
+        把消息交给后台线程发送，立即返回 concurrent.futures.Future，
+        broker 确认(ack)后 Future 结果为 True，失败则带有异常。
+        """
+        if properties is None:
+            properties = pika.BasicProperties(delivery_mode=2)  # make message persistent
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((routing_key, body, properties, future))
+        return future
+
+    async def publish_async(self, body: str, routing_key: str,
+                            properties: Optional[pika.BasicProperties] = None) -> bool:
+        """在协程中等待 publisher confirm"""
+        return await asyncio.wrap_future(self.publish(body, routing_key, properties))
+
+    def pending(self) -> int:
+        """尚未发送的消息条数"""
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 5.0):
+        """停止后台线程，尽量把队列里剩余的消息发完"""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # 后台 IO 线程
+    # ------------------------------------------------------------------
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="mq-publisher", daemon=True)
+            self._thread.start()
+            logger.info("MQ 发布线程已启动")
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=MQ_IDLE_INTERVAL)
+            except queue.Empty:
+                self._process_heartbeat()
+                if self._stopped.is_set():
+                    break
+                continue
+
+            batch: List[_PublishItem] = []
+            if item is not None:
+                batch.append(item)
+            # 一次尽量多取一些，减少线程切换
+            while len(batch) < MQ_PUBLISH_BATCH:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+
+            for routing_key, body, properties, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._publish_with_retry(routing_key, body, properties, future)
+
+            if self._stopped.is_set() and self._queue.empty():
+                break
+
+        self._reset_connection()
+        logger.info("MQ 发布线程已退出")
+
+    def _publish_with_retry(self, routing_key: str, body: str, properties: pika.BasicProperties, future: Future):
+        delay = MQ_RECONNECT_DELAY
+        last_error: Optional[BaseException] = None
+        for attempt in range(1, MQ_PUBLISH_RETRIES + 1):
+            try:
+                channel = self._get_channel(routing_key)
+                # confirm 模式下 basic_publish 会等待 broker 的 ack，nack/unroutable 会抛异常
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=routing_key,
+                    body=body,
+                    properties=properties,
+                )
+                future.set_result(True)
+                return
+            except (AMQPError, OSError) as e:
+                last_error = e
+                logger.warning(f"发送消息到队列 {routing_key} 失败(第{attempt}次): {e}")
+                self._reset_connection()
+                if attempt < MQ_PUBLISH_RETRIES:
+                    time.sleep(delay)
+                    delay = min(delay * 2, MQ_RECONNECT_MAX_DELAY)
+        future.set_exception(last_error)
+
+    def _get_channel(self, routing_key: str):
+        if self._connection is None or self._connection.is_closed:
+            self._channels.clear()
+            self._connection = self._connection_factory()
+            logger.info("MQ 发布连接已建立")
+        channel = self._channels.get(routing_key)
+        if channel is None or channel.is_closed:
+            channel = self._connection.channel()
+            channel.confirm_delivery()
+            channel.queue_declare(queue=routing_key, durable=True)
+            self._channels[routing_key] = channel
+        return channel
+
+    def _process_heartbeat(self):
+        """空闲时让 pika 处理心跳帧，避免长连接被 broker 判定超时"""
+        if self._connection is None or self._connection.is_closed:
+            return
+        try:
+            self._connection.process_data_events(time_limit=0)
+        except (AMQPError, OSError) as e:
+            logger.warning(f"MQ 发布连接心跳失败，下次发送时重连: {e}")
+            self._reset_connection()
+
+    def _reset_connection(self):
+        self._channels.clear()
+        connection, self._connection = self._connection, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.debug(f"关闭 MQ 发布连接时出错: {e}")
+
+
+_publisher: Optional[MQPublisher] = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher(connection_factory: Callable[[], pika.BlockingConnection]) -> MQPublisher:
+    """返回进程级单例发布器"""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = MQPublisher(connection_factory)
+                atexit.register(_publisher.close)
+    return _publisher
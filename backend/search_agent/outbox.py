@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 11:05
+# @File  : outbox.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 本地追加写 outbox：tool_request 先落盘，后台 drainer 再批量投递到 RabbitMQ
+
+import json
+import logging
+import os
+import re
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError, wait as wait_futures
+from typing import Dict, List, Optional, Tuple
+
+from shared_state import SHARED_STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+# outbox 目录（需要放在持久化的 volume 上），为空时不启用，tool_request 直接投递；配置了 SHARED_STATE_DIR 时默认放在共享目录下
+OUTBOX_DIR = os.getenv("OUTBOX_DIR", os.path.join(SHARED_STATE_DIR, "outbox") if SHARED_STATE_DIR else "")
+# 单个 segment 文件超过该大小后滚动到新文件
+OUTBOX_SEGMENT_BYTES = int(os.getenv("OUTBOX_SEGMENT_BYTES", 16 * 1024 * 1024))
+# 攒够多少条或者等待多久(毫秒)做一次 fsync，0 表示每次追加都 fsync
+OUTBOX_FSYNC_BATCH = int(os.getenv("OUTBOX_FSYNC_BATCH", 64))
+OUTBOX_FSYNC_INTERVAL_MS = int(os.getenv("OUTBOX_FSYNC_INTERVAL_MS", 20))
+# drainer 每批最多投递的消息条数，以及等待 broker confirm 的超时时间
+OUTBOX_DRAIN_BATCH = int(os.getenv("OUTBOX_DRAIN_BATCH", 200))
+OUTBOX_CONFIRM_TIMEOUT = float(os.getenv("OUTBOX_CONFIRM_TIMEOUT", 30))
+# 投递失败后的退避时间(秒)
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", 1))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv("OUTBOX_RETRY_MAX_DELAY", 30))
+
+_SEGMENT_PATTERN = re.compile(r"^segment_(\d{12})\.log$")
+_CURSOR_FILE = "cursor.json"
+
+
+def _segment_name(seq: int) -> str:
+    return f"segment_{seq:012d}.log"
+
+
+class Outbox:
+    """
+    追加写的磁盘 outbox。
+
+    - append() 只把一行 JSON 写进当前 segment 文件就返回，fsync 按批次/时间窗口合并执行；
+    - 后台 drainer 线程从 cursor 位置读取完整的行，交给 MQPublisher 批量投递，
+      broker confirm 之后再推进 cursor，已经投递完的旧 segment 会被删除；
+    - broker 不可用时消息留在磁盘上，按指数退避重试，进程重启后从 cursor 继续重放。
+    投递语义是至少一次(at-least-once)，重复消息由 task_id 幂等处理。
+    """
+
+    def __init__(self, publisher, directory: str = OUTBOX_DIR):
+        self.publisher = publisher
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+        segments = self._list_segments()
+        self._active_seq = segments[-1] if segments else 1
+        self._active_file = open(self._segment_path(self._active_seq), "ab")
+        self._active_size = self._active_file.tell()
+        self._unsynced = 0
+        self._seal_torn_tail()
+        self._last_sync = time.monotonic()
+
+        self._cursor_seq, self._cursor_offset = self._load_cursor(segments)
+        # 上一批中投递失败后仍在 MQPublisher 中重试（已经开始发送，无法取消）的消息
+        self._unsettled: List[Future] = []
+        self._thread = threading.Thread(target=self._run, name="outbox-drainer", daemon=True)
+        self._thread.start()
+        logger.info(f"Outbox 已启动，目录: {self.directory}, 从 segment {self._cursor_seq} offset {self._cursor_offset} 开始投递")
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def append(self, routing_key: str, body: str):
+        """追加一条待投递消息，写入 page cache 后立即返回"""
+        line = json.dumps({"routing_key": routing_key, "body": body}, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._active_size + len(line) > OUTBOX_SEGMENT_BYTES and self._active_size > 0:
+                self._rotate()
+            self._active_file.write(line)
+            self._active_file.flush()
+            self._active_size += len(line)
+            self._unsynced += 1
+            if OUTBOX_FSYNC_INTERVAL_MS <= 0 or self._unsynced >= OUTBOX_FSYNC_BATCH:
+                self._fsync()
+        self._wakeup.set()
+
+    def pending_bytes(self) -> int:
+        """还没有投递到 broker 的字节数（近似值）"""
+        with self._lock:
+            total = 0
+            for seq in self._list_segments():
+                if seq < self._cursor_seq:
+                    continue
+                size = self._active_size if seq == self._active_seq else os.path.getsize(self._segment_path(seq))
+                total += size - (self._cursor_offset if seq == self._cursor_seq else 0)
+            return total
+
+    def close(self, timeout: float = 5.0):
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join(timeout=timeout)
+        with self._lock:
+            self._fsync()
+            self._active_file.close()
+
+    def _seal_torn_tail(self):
+        """上次进程崩溃时可能留下半行，补一个换行符，避免和新追加的记录粘在一起"""
+        if self._active_size == 0:
+            return
+        with open(self._segment_path(self._active_seq), "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+        self._active_file.write(b"\n")
+        self._active_file.flush()
+        self._active_size += 1
+
+    def _rotate(self):
+        self._fsync()
+        self._active_file.close()
+        self._active_seq += 1
+        self._active_file = open(self._segment_path(self._active_seq), "ab")
+        self._active_size = 0
+
+    def _fsync(self):
+        if self._unsynced:
+            os.fsync(self._active_file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # 投递
+    # ------------------------------------------------------------------
+    def _run(self):
+        retry_delay = OUTBOX_RETRY_DELAY
+        while not self._stopped.is_set():
+            self._wakeup.wait(timeout=OUTBOX_FSYNC_INTERVAL_MS / 1000 if OUTBOX_FSYNC_INTERVAL_MS > 0 else 1.0)
+            self._wakeup.clear()
+            with self._lock:
+                if self._unsynced and (time.monotonic() - self._last_sync) * 1000 >= OUTBOX_FSYNC_INTERVAL_MS:
+                    self._fsync()
+            try:
+                while not self._stopped.is_set() and self._drain_once():
+                    pass
+                retry_delay = OUTBOX_RETRY_DELAY
+            except Exception as e:
+                logger.error(f"Outbox 投递失败，{retry_delay:.1f}秒后重试: {e}")
+                self._stopped.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, OUTBOX_RETRY_MAX_DELAY)
+                self._wakeup.set()
+
+    def _drain_once(self) -> bool:
+        """投递一批消息，返回是否还可能有剩余"""
+        self._wait_unsettled()
+        records, end_offsets = self._read_batch()
+        if not records:
+            return self._advance_segment()
+
+        futures = [self.publisher.publish(r["body"], routing_key=r["routing_key"]) for r in records]
+        confirmed = 0
+        error: Optional[BaseException] = None
+        for future in futures:
+            try:
+                future.result(timeout=OUTBOX_CONFIRM_TIMEOUT)
+            except (Exception, FutureTimeoutError) as e:
+                error = e
+                break
+            confirmed += 1
+
+        # 只推进到连续确认成功的前缀，后面的消息下次重放（可能重复，由 task_id 幂等保证）
+        if confirmed:
+            self._save_cursor(self._cursor_seq, end_offsets[confirmed - 1])
+            logger.info(f"Outbox 已投递 {confirmed} 条消息到 MQ")
+        if error is not None:
+            # 没有确认的消息下次会从磁盘重放，取消还在 MQPublisher 队列里的，避免 broker 故障期间队列无限增长、恢复后重复投递
+            for future in futures[confirmed:]:
+                future.cancel()
+            self._unsettled = [future for future in futures[confirmed:] if not future.done()]
+            raise error
+        return True
+
+    def _wait_unsettled(self):
+        """上一批还有消息在发送中时不重放，等它结束（成功或失败）后再读下一批"""
+        if not self._unsettled:
+            return
+        _, not_done = wait_futures(self._unsettled, timeout=OUTBOX_CONFIRM_TIMEOUT)
+        if not_done:
+            self._unsettled = list(not_done)
+            raise FutureTimeoutError(f"上一批还有 {len(not_done)} 条消息在投递中，暂不重放")
+        self._unsettled = []
+
+    def _read_batch(self) -> Tuple[List[Dict[str, str]], List[int]]:
+        records: List[Dict[str, str]] = []
+        end_offsets: List[int] = []
+        path = self._segment_path(self._cursor_seq)
+        if not os.path.exists(path):
+            return records, end_offsets
+        with open(path, "rb") as f:
+            f.seek(self._cursor_offset)
+            offset = self._cursor_offset
+            while len(records) < OUTBOX_DRAIN_BATCH:
+                line = f.readline()
+                # 没有换行符说明这一行还在写入中，下次再读
+                if not line or not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    if records:
+                        # 先把前面正常的消息投递掉，下一批再处理这一行
+                        break
+                    # 损坏的行（比如进程崩溃时写了一半）直接跳过
+                    logger.warning(f"Outbox segment {self._cursor_seq} 中存在损坏的记录，已跳过")
+                    offset += len(line)
+                    self._save_cursor(self._cursor_seq, offset)
+                    continue
+                offset += len(line)
+                records.append(record)
+                end_offsets.append(offset)
+        return records, end_offsets
+
+    def _advance_segment(self) -> bool:
+        """当前 segment 已读完：如果不是正在写的文件，删除它并移动到下一个"""
+        with self._lock:
+            if self._cursor_seq >= self._active_seq:
+                return False
+            finished = self._cursor_seq
+            next_seq = min(s for s in self._list_segments() + [self._active_seq] if s > finished)
+        self._save_cursor(next_seq, 0)
+        try:
+            os.remove(self._segment_path(finished))
+        except FileNotFoundError:
+            pass
+        return True
+
+    # ------------------------------------------------------------------
+    # cursor / segment 文件
+    # ------------------------------------------------------------------
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, _segment_name(seq))
+
+    def _list_segments(self) -> List[int]:
+        seqs = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_PATTERN.match(name)
+            if match:
+                seqs.append(int(match.group(1)))
+        return sorted(seqs)
+
+    def _load_cursor(self, segments: List[int]) -> Tuple[int, int]:
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        first = segments[0] if segments else self._active_seq
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cursor = json.load(f)
+            seq, offset = int(cursor["segment"]), int(cursor["offset"])
+        except (FileNotFoundError, ValueError, KeyError):
+            return first, 0
+        # cursor 指向的文件已经被删除时，从最早的 segment 开始
+        if seq < first:
+            return first, 0
+        return seq, offset
+
+    def _save_cursor(self, seq: int, offset: int):
+        self._cursor_seq, self._cursor_offset = seq, offset
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segment": seq, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def claim_directory(base: str = OUTBOX_DIR, max_slots: int = 64) -> str:
+    """
+    outbox 目录只能有一个写入进程。多个 worker 时每个 worker 用文件锁占用一个目录：
+    base、base-1、base-2...，进程退出后锁自动释放，重启后的 worker 接着重放同一个目录里的消息。
+    """
+    if fcntl is None:
+        return base
+    for slot in range(max_slots):
+        directory = base if slot == 0 else f"{base}-{slot}"
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, ".lock"), "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        # 锁在进程的整个生命周期内保持
+        _directory_locks.append(lock_file)
+        return directory
+    raise RuntimeError(f"outbox 目录 {base} 的 {max_slots} 个槽位都已被占用")
+
+
+_directory_locks = []
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox(publisher) -> Optional[Outbox]:
+    """返回进程级单例 outbox，首次调用时启动 drainer 并重放上次遗留的消息；没有配置 OUTBOX_DIR 时返回 None"""
+    global _outbox
+    if _outbox is None and OUTBOX_DIR:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = Outbox(publisher, claim_directory())
+    return _outbox
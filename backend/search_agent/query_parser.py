@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 17:10
+# @File  : query_parser.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 检索式解析：一次扫描的分词 + 递归下降解析，生成语法树，供校验、缓存、改写和本地检索共用
+
+import logging
+from typing import Iterator, List, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# 词法单元类型
+TOKEN_LPAREN = "LPAREN"
+TOKEN_RPAREN = "RPAREN"
+TOKEN_PHRASE = "PHRASE"  # "Lung Cancer"，值是去掉引号和转义后的内容
+TOKEN_WORD = "WORD"  # 没有引号的单词
+TOKEN_FIELD = "FIELD"  # [Title]，值是方括号里的字段名
+TOKEN_OPERATOR = "OPERATOR"  # AND / OR / NOT，和 PubMed 一样只认大写
+
+OPERATORS = ("AND", "OR", "NOT")
+# 括号嵌套的最大层数，避免递归过深
+MAX_QUERY_DEPTH = 64
+
+_WORD_STOP = set(' \t\r\n()"[]')
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+    pos: int  # 在原始检索式中的起始位置
+
+
+class QueryParseError(ValueError):
+    """检索式格式错误，position 为出错的字符位置(从 0 开始)"""
+
+    def __init__(self, message: str, position: int, code: str = "syntax"):
+        super().__init__(message)
+        self.message = message
+        self.position = position
+        self.code = code
+
+    def __str__(self):
+        return f"{self.message} (位置 {self.position})"
+
+
+# -----------------------------------------------------------------------------
+# 语法树
+# -----------------------------------------------------------------------------
+
+class Term:
+    """
+    检索词："Lung Cancer"[Title]
+    quoted 表示原文是否带引号（带引号是短语检索，PubMed 中和不带引号的含义不同）
+    """
+
+    __slots__ = ("text", "field", "quoted", "pos")
+
+    def __init__(self, text: str, field: Optional[str] = None, quoted: bool = True, pos: int = 0):
+        self.text = text
+        self.field = field
+        self.quoted = quoted
+        self.pos = pos
+
+    def __eq__(self, other):
+        return isinstance(other, Term) and (self.text, self.field, self.quoted) == (other.text, other.field, other.quoted)
+
+    def __hash__(self):
+        return hash((self.text, self.field, self.quoted))
+
+    def __repr__(self):
+        return f"Term({self.text!r}, field={self.field!r}, quoted={self.quoted})"
+
+
+class BoolOp:
+    """
+    逻辑运算，操作数可以有多个：
+    - AND / OR: 所有操作数的交集 / 并集；
+    - NOT: 第一个操作数去掉后面所有操作数，即 A NOT B NOT C。
+    """
+
+    __slots__ = ("op", "operands", "pos")
+
+    def __init__(self, op: str, operands: List["Node"], pos: int = 0):
+        self.op = op
+        self.operands = operands
+        self.pos = pos
+
+    def __eq__(self, other):
+        return isinstance(other, BoolOp) and self.op == other.op and self.operands == other.operands
+
+    def __hash__(self):
+        return hash((self.op, tuple(self.operands)))
+
+    def __repr__(self):
+        return f"BoolOp({self.op!r}, {self.operands!r})"
+
+
+Node = Union[Term, BoolOp]
+
+
+# -----------------------------------------------------------------------------
+# 分词
+# -----------------------------------------------------------------------------
+
+def tokenize(query_string: str) -> List[Token]:
+    """一次线性扫描切分检索式，引号或方括号未闭合时抛出 QueryParseError"""
+    tokens: List[Token] = []
+    i = 0
+    n = len(query_string)
+    while i < n:
+        ch = query_string[i]
+        if ch.isspace():
+            i += 1
+        elif ch == "(":
+            tokens.append(Token(TOKEN_LPAREN, ch, i))
+            i += 1
+        elif ch == ")":
+            tokens.append(Token(TOKEN_RPAREN, ch, i))
+            i += 1
+        elif ch == '"':
+            start = i
+            i += 1
+            chars = []
+            while i < n and query_string[i] != '"':
+                if query_string[i] == "\\" and i + 1 < n:
+                    i += 1
+                chars.append(query_string[i])
+                i += 1
+            if i >= n:
+                raise QueryParseError("引号没有闭合", start, "unterminated_quote")
+            tokens.append(Token(TOKEN_PHRASE, "".join(chars), start))
+            i += 1
+        elif ch == "[":
+            end = query_string.find("]", i + 1)
+            if end < 0:
+                raise QueryParseError("方括号没有闭合", i, "unterminated_field")
+            tokens.append(Token(TOKEN_FIELD, query_string[i + 1:end].strip(), i))
+            i = end + 1
+        elif ch == "]":
+            raise QueryParseError("多余的右方括号", i, "unexpected_token")
+        else:
+            start = i
+            while i < n and query_string[i] not in _WORD_STOP:
+                i += 1
+            word = query_string[start:i]
+            kind = TOKEN_OPERATOR if word in OPERATORS else TOKEN_WORD
+            tokens.append(Token(kind, word, start))
+    return tokens
+
+
+# -----------------------------------------------------------------------------
+# 解析
+# -----------------------------------------------------------------------------
+
+class QueryParser:
+    """
+    递归下降解析，文法：
+        expr    := operand (OPERATOR operand)*
+        operand := "(" expr ")" | term
+        term    := (PHRASE | WORD+) FIELD?
+    和 PubMed 一样，同一层的运算符没有优先级，按从左到右的顺序结合；
+    相同运算符的连续运算会合并成一个多操作数的 BoolOp。
+    """
+
+    def __init__(self, tokens: List[Token], length: int = 0):
+        self.tokens = tokens
+        self.length = length  # 原始检索式长度，用于报告结尾处的错误位置
+        self.index = 0
+        self.group_count = 0  # 解析到的括号分组数
+
+    def _peek(self) -> Optional[Token]:
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise QueryParseError("检索式为空", 0, "empty")
+        node = self._parse_expr(0)
+        token = self._peek()
+        if token is not None:
+            # 能走到这里只可能是多余的右括号
+            raise QueryParseError("多余的右括号", token.pos, "unbalanced_paren")
+        return node
+
+    def _parse_expr(self, depth: int) -> Node:
+        if depth > MAX_QUERY_DEPTH:
+            token = self._peek()
+            raise QueryParseError(f"括号嵌套超过 {MAX_QUERY_DEPTH} 层", token.pos if token else self.length, "too_deep")
+        node = self._parse_operand(depth)
+        while True:
+            token = self._peek()
+            if token is None or token.kind == TOKEN_RPAREN:
+                return node
+            if token.kind != TOKEN_OPERATOR:
+                raise QueryParseError("检索条件之间缺少逻辑运算符(AND/OR/NOT)", token.pos, "missing_operator")
+            self.index += 1
+            right = self._parse_operand(depth)
+            node = self._combine(token.value, node, right, token.pos)
+
+    @staticmethod
+    def _combine(op: str, left: Node, right: Node, pos: int) -> Node:
+        # (A op B) op C -> op(A, B, C)，NOT 也成立：(A NOT B) NOT C == A NOT B NOT C
+        if isinstance(left, BoolOp) and left.op == op:
+            operands = list(left.operands)
+            pos = left.pos
+        else:
+            operands = [left]
+        # A op (B op C) -> op(A, B, C)，只对满足结合律的 AND / OR 展开
+        if op != "NOT" and isinstance(right, BoolOp) and right.op == op:
+            operands.extend(right.operands)
+        else:
+            operands.append(right)
+        return BoolOp(op, operands, pos)
+
+    def _parse_operand(self, depth: int) -> Node:
+        token = self._peek()
+        if token is None:
+            raise QueryParseError("逻辑运算符后缺少检索条件", self.length, "dangling_operator")
+        if token.kind == TOKEN_LPAREN:
+            self.index += 1
+            if self._peek() is not None and self._peek().kind == TOKEN_RPAREN:
+                raise QueryParseError("括号内没有内容", token.pos, "empty_group")
+            node = self._parse_expr(depth + 1)
+            closing = self._peek()
+            if closing is None:
+                raise QueryParseError("左括号没有闭合", token.pos, "unbalanced_paren")
+            self.index += 1
+            self.group_count += 1
+            nxt = self._peek()
+            if nxt is not None and nxt.kind == TOKEN_FIELD:
+                raise QueryParseError("字段限定符只能跟在检索词后面，不能跟在括号后面", nxt.pos, "misplaced_field")
+            return node
+        if token.kind == TOKEN_OPERATOR:
+            raise QueryParseError(f"{token.value} 前缺少检索条件", token.pos, "dangling_operator")
+        if token.kind == TOKEN_RPAREN:
+            raise QueryParseError("多余的右括号", token.pos, "unbalanced_paren")
+        if token.kind == TOKEN_FIELD:
+            raise QueryParseError(f"字段限定符 [{token.value}] 前缺少检索词", token.pos, "missing_term")
+        return self._parse_term()
+
+    def _parse_term(self) -> Term:
+        token = self.tokens[self.index]
+        self.index += 1
+        if token.kind == TOKEN_PHRASE:
+            text, quoted = token.value.strip(), True
+            if not text:
+                raise QueryParseError("引号内没有内容", token.pos, "missing_term")
+        else:
+            # 连续的单词组成一个检索词：lung cancer[Title]
+            words = [token.value]
+            while self._peek() is not None and self._peek().kind == TOKEN_WORD:
+                words.append(self._peek().value)
+                self.index += 1
+            text, quoted = " ".join(words), False
+        field = None
+        nxt = self._peek()
+        if nxt is not None and nxt.kind == TOKEN_FIELD:
+            field = nxt.value
+            self.index += 1
+        return Term(text, field, quoted, token.pos)
+
+
+def parse_tokens(tokens: List[Token], length: int = 0) -> Node:
+    return QueryParser(tokens, length).parse()
+
+
+def parse_query(query_string: str) -> Node:
+    """解析检索式，返回语法树，格式错误时抛出 QueryParseError"""
+    return parse_tokens(tokenize(query_string), len(query_string))
+
+
+# -----------------------------------------------------------------------------
+# 遍历 & 序列化
+# -----------------------------------------------------------------------------
+
+def iter_terms(node: Node) -> Iterator[Term]:
+    """按出现顺序遍历所有检索词"""
+    if isinstance(node, Term):
+        yield node
+        return
+    for operand in node.operands:
+        yield from iter_terms(operand)
+
+
+def _serialize_term(term: Term) -> str:
+    # tokenize 把反斜杠当作转义符，先转义反斜杠再转义引号，重新解析时得到相同的检索词
+    text = '"' + term.text.replace("\\", "\\\\").replace('"', '\\"') + '"' if term.quoted else term.text
+    if term.field:
+        return f"{text}[{term.field}]"
+    return text
+
+
+def serialize(node: Node, sort_operands: bool = False) -> str:
+    """
+    把语法树还原成检索式，格式和 QueryBuilder.combine 一致：("A"[Title]) AND ("B"[Abstract])
+    sort_operands=True 时对顺序无关的操作数排序（AND/OR 的全部操作数，NOT 第一个之后的操作数），
+    得到的字符串可以作为等价检索式的规范形式。
+    """
+    if isinstance(node, Term):
+        return _serialize_term(node)
+    parts = [serialize(operand, sort_operands) for operand in node.operands]
+    if sort_operands:
+        if node.op == "NOT":
+            parts = parts[:1] + sorted(parts[1:])
+        else:
+            parts = sorted(parts)
+    return f" {node.op} ".join(f"({part})" for part in parts)
+
+
+def canonical_query(query_string: str) -> str:
+    """规范形式的检索式，无法解析时退化为只合并空白"""
+    if not query_string:
+        return ""
+    try:
+        return serialize(parse_query(query_string), sort_operands=True)
+    except QueryParseError:
+        return " ".join(query_string.split())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 19:40
+# @File  : result_projection.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 搜索结果给模型看的精简视图：只保留少数字段、截断摘要，完整记录另走 metadata 给前端
+
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# compact: 模型只看到精简表格；full: 和以前一样把完整记录交给模型
+SEARCH_LLM_VIEW = os.getenv("SEARCH_LLM_VIEW", "compact")
+# 精简视图中的列，可选 id,title,year,journal,impact_factor,abstract,authors,publication_type,link
+SEARCH_LLM_FIELDS = [f.strip() for f in os.getenv(
+    "SEARCH_LLM_FIELDS", "id,title,year,journal,impact_factor,abstract").split(",") if f.strip()]
+# 摘要截断长度(字符)，0 表示不要摘要
+SEARCH_LLM_ABSTRACT_CHARS = int(os.getenv("SEARCH_LLM_ABSTRACT_CHARS", 160))
+# 作者最多保留几个
+SEARCH_LLM_MAX_AUTHORS = 3
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = " ".join(str(text or "").split())
+    if limit <= 0:
+        return ""
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def _authors(record: Dict[str, Any]) -> str:
+    authors = record.get("authors") or ""
+    names = authors if isinstance(authors, list) else [a.strip() for a in str(authors).split(",") if a.strip()]
+    if len(names) > SEARCH_LLM_MAX_AUTHORS:
+        return ", ".join(names[:SEARCH_LLM_MAX_AUTHORS]) + " 等"
+    return ", ".join(names)
+
+
+# 列名 -> 从完整记录中取值的函数
+_EXTRACTORS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "id": lambda r: r.get("id"),
+    "title": lambda r: r.get("title", ""),
+    "year": lambda r: str(r.get("publish_date") or "")[:4],
+    "journal": lambda r: r.get("journal", ""),
+    "impact_factor": lambda r: r.get("impact_factor"),
+    "abstract": lambda r: _truncate(r.get("abstract", ""), SEARCH_LLM_ABSTRACT_CHARS),
+    "authors": _authors,
+    "publication_type": lambda r: r.get("publication_type", ""),
+    "link": lambda r: r.get("link", ""),
+}
+
+
+def _columns() -> List[str]:
+    columns = [f for f in SEARCH_LLM_FIELDS if f in _EXTRACTORS]
+    if not columns:
+        logger.warning(f"SEARCH_LLM_FIELDS={SEARCH_LLM_FIELDS} 中没有可用的列，使用 id,title")
+        columns = ["id", "title"]
+    return columns
+
+
+def project_rows(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """完整记录 -> {"columns": [...], "rows": [[...], ...]}，列名只出现一次"""
+    columns = _columns()
+    rows = [[_EXTRACTORS[column](record) for column in columns] for record in records if isinstance(record, dict)]
+    return {"columns": columns, "rows": rows}
+
+
+def project_search_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """search_advanced 返回给模型的结果"""
+    if SEARCH_LLM_VIEW == "full" or not isinstance(result, dict) or "records" not in result:
+        return result
+    projected = {key: value for key, value in result.items() if key != "records"}
+    projected.update(project_rows(result.get("records") or []))
+    return projected
+
+
+def format_records_for_prompt(records: List[Dict[str, Any]]) -> str:
+    """把上一次的搜索结果拼成紧凑的文本表格，注入到历史记录中"""
+    if SEARCH_LLM_VIEW == "full":
+        return json.dumps(records, ensure_ascii=False)
+    table = project_rows(records)
+    lines = [" | ".join(table["columns"])]
+    for row in table["rows"]:
+        lines.append(" | ".join("" if value is None else str(value).replace("|", "/") for value in row))
+    return "\n".join(lines)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 16:30
+# @File  : search_cache.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : search_advanced 的结果缓存：进程内 TTL + LRU，可选共享目录作为二级缓存
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from query_parser import canonical_query
+from shared_state import SHARED_STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 一级缓存：最多缓存的条数和每条的过期时间(秒)
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 1024))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 600))
+# 二级缓存：多个进程/副本共享的目录，为空时不启用；配置了 SHARED_STATE_DIR 时默认放在共享目录下
+SEARCH_CACHE_DIR = os.getenv("SEARCH_CACHE_DIR", os.path.join(SHARED_STATE_DIR, "search_cache") if SHARED_STATE_DIR else "")
+SEARCH_CACHE_L2_TTL = float(os.getenv("SEARCH_CACHE_L2_TTL", 3600))
+
+_MISSING = object()
+
+
+# -----------------------------------------------------------------------------
+# 查询规范化
+# -----------------------------------------------------------------------------
+
+def normalize_query(query_string: str) -> str:
+    """
+    规范化检索式，用于生成缓存 key：
+    解析成语法树后按统一格式输出，同一层 AND / OR 的操作数排序，
+    使空白、括号、子句顺序不同的等价检索式得到同一个 key。
+    运算符和 PubMed 一样只认大写，小写的 and / or / not 是检索词，不做大小写归一（否则会改变检索含义）。
+    """
+    return canonical_query(query_string)
+
+
+def normalize_filter(filter_string: str) -> str:
+    """规范化 filter：子条件排序，多选值排序"""
+    if not filter_string:
+        return ""
+    clauses = []
+    for clause in filter_string.split("@@AND$$"):
+        clause = clause.strip()
+        if not clause:
+            continue
+        key, _, value = clause.partition("$$")
+        if "$OR$" in value:
+            value = "$OR$".join(sorted(v.strip() for v in value.split("$OR$")))
+        clauses.append(f"{key.strip()}$${value}")
+    return "@@AND$$".join(sorted(clauses))
+
+
+def make_search_cache_key(query_string: str, filter_string: str, sort_field: str, page_num: int, page_size: int,
+                          search_after: str = "") -> str:
+    raw = json.dumps(
+        [normalize_query(query_string), normalize_filter(filter_string), sort_field, page_num, page_size, search_after],
+        ensure_ascii=False,
+    )
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+# -----------------------------------------------------------------------------
+# 缓存
+# -----------------------------------------------------------------------------
+
+class TTLLRUCache:
+    """
+    有容量上限的 LRU 缓存，每条记录有独立的过期时间，并统计命中情况。
+    返回的是缓存中的同一个对象，调用方不要修改它。
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, ttl: float = SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SharedDirCache:
+    """
+    二级缓存：以 pickle 文件的形式保存在共享目录中（和 cache_utils 的文件缓存同样的做法），
+    文件的修改时间超过 ttl 视为过期。
+    """
+
+    def __init__(self, directory: str, ttl: float = SEARCH_CACHE_L2_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}_search.pkl")
+
+    def get(self, key: str) -> Any:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self.misses += 1
+                return _MISSING
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return _MISSING
+        except Exception as e:
+            # 文件损坏、正在被替换，或者是旧版本代码写入的 pickle（AttributeError / ImportError 等），都当作未命中
+            logger.warning(f"读取搜索缓存文件 {path} 失败，当作未命中: {type(e).__name__}: {e}")
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "hits": self.hits, "misses": self.misses}
+
+
+class SearchResultCache:
+    """
+    search_advanced 的两级缓存，并合并同一时刻相同 key 的并发请求（只请求一次后端）
+    """
+
+    def __init__(self, l1: TTLLRUCache, l2: Optional[SharedDirCache] = None):
+        self.l1 = l1
+        self.l2 = l2
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]],
+                           cacheable: Callable[[Any], bool] = lambda _: True) -> Any:
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            # 请求放在单独的任务里执行，任何一个调用方被取消（比如客户端断开）都不影响其它等待同一个 key 的调用方
+            task = asyncio.create_task(self._fetch(key, fetch, cacheable))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有调用方都已取消时没有人读取异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[Any]], cacheable: Callable[[Any], bool]) -> Any:
+        value = _MISSING
+        if self.l2 is not None:
+            try:
+                value = await asyncio.to_thread(self.l2.get, key)
+            except Exception as e:
+                logger.warning(f"读取二级搜索缓存失败: {e}")
+        if value is _MISSING:
+            value = await fetch()
+            if cacheable(value) and self.l2 is not None:
+                try:
+                    await asyncio.to_thread(self.l2.set, key, value)
+                except Exception as e:
+                    logger.warning(f"写入二级搜索缓存失败: {e}")
+        if cacheable(value):
+            self.l1.set(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"l1": self.l1.stats(), "inflight": len(self._inflight)}
+        if self.l2 is not None:
+            stats["l2"] = self.l2.stats()
+        return stats
+
+
+search_cache = SearchResultCache(
+    TTLLRUCache(),
+    SharedDirCache(SEARCH_CACHE_DIR) if SEARCH_CACHE_DIR else None,
+)
@@ -0,0 +1,533 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 21:10
+# @File  : session_service.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 有上限的持久化 Session 服务：内存中只保留热会话（LRU + 空闲过期），全部写入 SQLite(WAL)，被淘汰的会话下次访问时再加载
+# search_agent 和 pptagent 中各有一份相同的 session_service.py（每个服务以自己的目录作为 Docker 构建上下文，不能跨目录共用模块），修改时两份保持一致
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+
+from shared_state import SHARED_STATE_DIR, is_shared
+
+logger = logging.getLogger(__name__)
+
+# SQLite 文件路径，为空时不持久化（被淘汰的会话直接丢弃）；默认不启用，配置了 SHARED_STATE_DIR 时默认放在共享目录下
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(SHARED_STATE_DIR, "sessions.db") if SHARED_STATE_DIR else "")
+# 磁盘上的会话超过多少秒没有更新就删除
+SESSION_DB_TTL = float(os.getenv("SESSION_DB_TTL", 7 * 24 * 3600))
+# 内存中最多保留多少个会话
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", 256))
+# 会话空闲多少秒后移出内存
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", 1800))
+
+SessionKey = Tuple[str, str, str]
+
+
+def extract_state_delta(state: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """把 state 按前缀拆成 app / user / session 三部分（去掉前缀），temp: 开头的不保存"""
+    deltas = {"app": {}, "user": {}, "session": {}}
+    for key, value in (state or {}).items():
+        if key.startswith(State.APP_PREFIX):
+            deltas["app"][key[len(State.APP_PREFIX):]] = value
+        elif key.startswith(State.USER_PREFIX):
+            deltas["user"][key[len(State.USER_PREFIX):]] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            deltas["session"][key] = value
+    return deltas
+
+
+class SessionStore:
+    """
+    会话的 SQLite 存储，所有方法都是同步的，由 BoundedSessionService 放到单线程执行器里调用，
+    写入按提交顺序执行（截断和追加不会乱序）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                app_name    TEXT NOT NULL,
+                user_id     TEXT NOT NULL,
+                session_id  TEXT NOT NULL,
+                state       TEXT NOT NULL,
+                last_update REAL NOT NULL,
+                version     INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (app_name, user_id, session_id)
+            );
+            CREATE TABLE IF NOT EXISTS session_events (
+                app_name    TEXT NOT NULL,
+                user_id     TEXT NOT NULL,
+                session_id  TEXT NOT NULL,
+                seq         INTEGER NOT NULL,
+                event       TEXT NOT NULL,
+                PRIMARY KEY (app_name, user_id, session_id, seq)
+            );
+            CREATE TABLE IF NOT EXISTS app_states (
+                app_name    TEXT PRIMARY KEY,
+                state       TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS user_states (
+                app_name    TEXT NOT NULL,
+                user_id     TEXT NOT NULL,
+                state       TEXT NOT NULL,
+                PRIMARY KEY (app_name, user_id)
+            );
+            """
+        )
+        # 旧版本的表没有 version 列
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+        if "version" not in columns:
+            conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _dumps(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    # 每次写入都把 version 加 1，多个 worker 共享数据库时用来判断内存中的会话是否过期
+
+    def get_version(self, key: SessionKey) -> Optional[int]:
+        row = self._conn().execute(
+            "SELECT version FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_session(self, key: SessionKey, state: Dict[str, Any], last_update: float) -> Optional[int]:
+        self._conn().execute(
+            """
+            INSERT INTO sessions (app_name, user_id, session_id, state, last_update, version) VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT(app_name, user_id, session_id) DO UPDATE SET
+                state = excluded.state, last_update = excluded.last_update, version = version + 1
+            """,
+            (*key, self._dumps(state), last_update),
+        )
+        return self.get_version(key)
+
+    def append_event(self, key: SessionKey, seq: int, event_json: str, state: Dict[str, Any],
+                     last_update: float) -> Optional[int]:
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_events (app_name, user_id, session_id, seq, event) VALUES (?, ?, ?, ?, ?)",
+                (*key, seq, event_json),
+            )
+            conn.execute(
+                "UPDATE sessions SET state = ?, last_update = ?, version = version + 1 "
+                "WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                (self._dumps(state), last_update, *key),
+            )
+            version = self.get_version(key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def restore_session(self, key: SessionKey, state: Dict[str, Any], events_json: List[str],
+                        last_update: float) -> Optional[int]:
+        """整体写入一个会话（状态和全部事件），会话已被删除或清理、但还有调用在使用它时放回"""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                """
+                INSERT INTO sessions (app_name, user_id, session_id, state, last_update, version) VALUES (?, ?, ?, ?, ?, 1)
+                ON CONFLICT(app_name, user_id, session_id) DO UPDATE SET
+                    state = excluded.state, last_update = excluded.last_update, version = version + 1
+                """,
+                (*key, self._dumps(state), last_update),
+            )
+            conn.execute("DELETE FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            conn.executemany(
+                "INSERT INTO session_events (app_name, user_id, session_id, seq, event) VALUES (?, ?, ?, ?, ?)",
+                [(*key, seq, event_json) for seq, event_json in enumerate(events_json)],
+            )
+            version = self.get_version(key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def truncate_events(self, key: SessionKey, keep: int) -> Optional[int]:
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                "DELETE FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ? AND seq >= ?",
+                (*key, keep),
+            )
+            conn.execute(
+                "UPDATE sessions SET version = version + 1 WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+            )
+            version = self.get_version(key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def load_session(self, key: SessionKey) -> Optional[Tuple[Session, int]]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT state, last_update, version FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        events = [
+            Event.model_validate_json(event_json)
+            for (event_json,) in conn.execute(
+                "SELECT event FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ? ORDER BY seq",
+                key,
+            )
+        ]
+        app_name, user_id, session_id = key
+        session = Session(app_name=app_name, user_id=user_id, id=session_id, state=json.loads(row[0]),
+                          events=events, last_update_time=row[1])
+        return session, row[2]
+
+    def list_sessions(self, app_name: str, user_id: Optional[str]) -> List[Tuple[str, str, Dict[str, Any], float]]:
+        if user_id is None:
+            rows = self._conn().execute(
+                "SELECT user_id, session_id, state, last_update FROM sessions WHERE app_name = ?", (app_name,))
+        else:
+            rows = self._conn().execute(
+                "SELECT user_id, session_id, state, last_update FROM sessions WHERE app_name = ? AND user_id = ?",
+                (app_name, user_id))
+        return [(uid, sid, json.loads(state), last_update) for uid, sid, state, last_update in rows]
+
+    def delete_session(self, key: SessionKey):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM session_events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            conn.execute("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge(self) -> int:
+        """删除超过 SESSION_DB_TTL 秒没有更新的会话和它们的事件，返回删除的会话数"""
+        cutoff = time.time() - SESSION_DB_TTL
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                """
+                DELETE FROM session_events WHERE (app_name, user_id, session_id) IN
+                    (SELECT app_name, user_id, session_id FROM sessions WHERE last_update < ?)
+                """,
+                (cutoff,),
+            )
+            deleted = conn.execute("DELETE FROM sessions WHERE last_update < ?", (cutoff,)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def save_app_state(self, app_name: str, state: Dict[str, Any]):
+        self._conn().execute("INSERT OR REPLACE INTO app_states (app_name, state) VALUES (?, ?)",
+                             (app_name, self._dumps(state)))
+
+    def save_user_state(self, app_name: str, user_id: str, state: Dict[str, Any]):
+        self._conn().execute("INSERT OR REPLACE INTO user_states (app_name, user_id, state) VALUES (?, ?, ?)",
+                             (app_name, user_id, self._dumps(state)))
+
+    def load_shared_states(self) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Dict[str, Any]]]]:
+        conn = self._conn()
+        app_state = {app_name: json.loads(state) for app_name, state in conn.execute("SELECT app_name, state FROM app_states")}
+        user_state: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for app_name, user_id, state in conn.execute("SELECT app_name, user_id, state FROM user_states"):
+            user_state.setdefault(app_name, {})[user_id] = json.loads(state)
+        return app_state, user_state
+
+
+class BoundedSessionService(BaseSessionService):
+    """
+    替代 InMemorySessionService：
+    - 内存中按 LRU 保留最多 max_sessions 个会话，空闲超过 ttl 秒的会话移出内存；
+    - 创建会话、追加事件、截断事件都同步写入 SQLite（写穿透），淘汰时不需要再落盘；
+    - 不在内存中的会话在下次 get_session / append_event 时从 SQLite 重新加载，进程重启后会话也不会丢失。
+    和 InMemorySessionService 一样，get_session 返回副本，append_event 同时更新传入的会话和内存中的会话。
+    shared=True 时（多个 worker 共用数据库），每次使用内存中的会话前先比较数据库中的 version，
+    被其它 worker 改过就重新加载。uvicorn 多 worker 没有粘性路由，同一个会话的请求串行到达时是安全的，
+    同一个会话的并发请求需要落到同一个 worker（在前面加按 contextId 路由的代理，见 main_api.main）。
+    """
+
+    def __init__(self, db_path: str = SESSION_DB_PATH, max_sessions: int = SESSION_CACHE_MAX,
+                 ttl: float = SESSION_CACHE_TTL, shared: bool = None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.shared = is_shared() if shared is None else shared
+        self._sessions: "OrderedDict[SessionKey, Session]" = OrderedDict()
+        self._touched: Dict[SessionKey, float] = {}
+        self._versions: Dict[SessionKey, int] = {}
+        self.app_state: Dict[str, Dict[str, Any]] = {}
+        self.user_state: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.hits = 0
+        self.rehydrated = 0
+        self.stale = 0
+        self.evicted = 0
+        self.purged = 0
+        self._last_purge = 0.0
+        self.store: Optional[SessionStore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if db_path:
+            self.store = SessionStore(db_path)
+            self.app_state, self.user_state = self.store.load_shared_states()
+            # 单线程执行器：数据库操作不阻塞事件循环，并且按提交顺序执行
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        logger.info(f"Session 服务: 内存上限 {max_sessions} 个，空闲 {ttl} 秒淘汰，持久化到 {db_path or '(不持久化)'}")
+
+    async def _run(self, method: str, *args):
+        """在执行器中调用 SessionStore 的方法，不持久化时什么都不做"""
+        if self.store is None:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(self._executor, getattr(self.store, method), *args)
+
+    async def _maybe_purge(self):
+        """每小时清理一次磁盘上过期的会话"""
+        now = time.time()
+        if self.store is None or now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        try:
+            self.purged += await self._run("purge")
+        except Exception as e:
+            logger.error(f"清理过期会话失败: {e}")
+
+    # -------------------------------------------------------------------------
+    # 内存中的热会话
+    # -------------------------------------------------------------------------
+
+    def _evict(self, now: float):
+        # 先淘汰空闲过期的（最久没访问的在最前面），再按数量淘汰
+        while self._sessions:
+            key = next(iter(self._sessions))
+            if len(self._sessions) <= self.max_sessions and now - self._touched[key] < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._touched.pop(key, None)
+            self._versions.pop(key, None)
+            self.evicted += 1
+
+    def _put(self, key: SessionKey, session: Session, version: Optional[int] = None):
+        now = time.time()
+        self._sessions[key] = session
+        if version is not None:
+            self._versions[key] = version
+        self._sessions.move_to_end(key)
+        self._touched[key] = now
+        self._evict(now)
+
+    def _drop(self, key: SessionKey):
+        self._sessions.pop(key, None)
+        self._touched.pop(key, None)
+        self._versions.pop(key, None)
+
+    def _set_version(self, key: SessionKey, version: Optional[int]):
+        if version is not None and key in self._sessions:
+            self._versions[key] = version
+
+    async def _load(self, key: SessionKey) -> Optional[Session]:
+        """返回内存中的会话，不在内存时（或者已被其它 worker 修改时）从 SQLite 加载"""
+        session = self._sessions.get(key)
+        if session is not None and self.shared and self.store is not None:
+            version = await self._run("get_version", key)
+            if version != self._versions.get(key):
+                self.stale += 1
+                self._drop(key)
+                session = None
+                if version is None:
+                    return None
+        if session is not None:
+            self.hits += 1
+            self._sessions.move_to_end(key)
+            self._touched[key] = time.time()
+            return session
+        loaded = await self._run("load_session", key)
+        if loaded is None:
+            return None
+        session, version = loaded
+        # 加载期间可能有其它协程已经放进内存了，以内存中的为准
+        existing = self._sessions.get(key)
+        if existing is not None:
+            return existing
+        self.rehydrated += 1
+        logger.debug(f"从 SQLite 加载会话 {key[2]}，{len(session.events)} 个事件")
+        self._put(key, session, version)
+        return session
+
+    def _merge_state(self, app_name: str, user_id: str, copied_session: Session) -> Session:
+        """把 app: / user: 前缀的共享状态合并进会话副本"""
+        for key, value in self.app_state.get(app_name, {}).items():
+            copied_session.state[State.APP_PREFIX + key] = value
+        for key, value in self.user_state.get(app_name, {}).get(user_id, {}).items():
+            copied_session.state[State.USER_PREFIX + key] = value
+        return copied_session
+
+    async def _save_shared_states(self, app_name: str, user_id: str, app_delta: Dict[str, Any],
+                                  user_delta: Dict[str, Any]):
+        if app_delta:
+            self.app_state.setdefault(app_name, {}).update(app_delta)
+            await self._run("save_app_state", app_name, dict(self.app_state[app_name]))
+        if user_delta:
+            self.user_state.setdefault(app_name, {}).setdefault(user_id, {}).update(user_delta)
+            await self._run("save_user_state", app_name, user_id, dict(self.user_state[app_name][user_id]))
+
+    # -------------------------------------------------------------------------
+    # BaseSessionService
+    # -------------------------------------------------------------------------
+
+    async def create_session(self, *, app_name: str, user_id: str, state: Optional[Dict[str, Any]] = None,
+                             session_id: Optional[str] = None) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        key = (app_name, user_id, session_id)
+        if await self._load(key) is not None:
+            raise AlreadyExistsError(f"Session with id {session_id} already exists.")
+        state_deltas = extract_state_delta(state)
+        await self._save_shared_states(app_name, user_id, state_deltas["app"], state_deltas["user"])
+        session = Session(app_name=app_name, user_id=user_id, id=session_id,
+                          state=state_deltas["session"] or {}, last_update_time=time.time())
+        self._put(key, session)
+        self._set_version(key, await self._run("save_session", key, dict(session.state), session.last_update_time))
+        await self._maybe_purge()
+        return self._merge_state(app_name, user_id, copy.deepcopy(session))
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str,
+                          config: Optional[GetSessionConfig] = None) -> Optional[Session]:
+        session = await self._load((app_name, user_id, session_id))
+        if session is None:
+            return None
+        copied_session = copy.deepcopy(session)
+        if config:
+            if config.num_recent_events:
+                copied_session.events = copied_session.events[-config.num_recent_events:]
+            if config.after_timestamp:
+                copied_session.events = [e for e in copied_session.events if e.timestamp >= config.after_timestamp]
+        return self._merge_state(app_name, user_id, copied_session)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        sessions = []
+        if self.store is not None:
+            for uid, sid, state, last_update in await self._run("list_sessions", app_name, user_id):
+                session = Session(app_name=app_name, user_id=uid, id=sid, state=state, last_update_time=last_update)
+                sessions.append(self._merge_state(app_name, uid, session))
+        else:
+            for (app, uid, sid), session in self._sessions.items():
+                if app == app_name and (user_id is None or uid == user_id):
+                    copied_session = copy.deepcopy(session)
+                    copied_session.events = []
+                    sessions.append(self._merge_state(app_name, uid, copied_session))
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        self._drop(key)
+        await self._run("delete_session", key)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        # 先更新传入的会话：内存中的会话被淘汰了，正在运行的调用也不能丢事件
+        await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+
+        key = (session.app_name, session.user_id, session.id)
+        storage_session = await self._load(key)
+        state_deltas = extract_state_delta(event.actions.state_delta if event.actions else None)
+        await self._save_shared_states(session.app_name, session.user_id, state_deltas["app"], state_deltas["user"])
+        if storage_session is None:
+            # 被 SESSION_CACHE_MAX / TTL 淘汰了（没有磁盘层），或者磁盘上的会话已被清理：用传入的会话放回去
+            logger.warning(f"会话 {session.id} 已不在存储中，用当前调用的会话重新放回")
+            storage_session = copy.deepcopy(session)
+            storage_session.state = extract_state_delta(storage_session.state)["session"]
+            self._put(key, storage_session)
+            self._set_version(key, await self._run(
+                "restore_session", key, dict(storage_session.state),
+                [e.model_dump_json(exclude_none=True) for e in storage_session.events],
+                storage_session.last_update_time))
+            return event
+
+        # 更新内存中的会话
+        storage_session.events.append(event)
+        storage_session.last_update_time = event.timestamp
+        if state_deltas["session"]:
+            storage_session.state.update(state_deltas["session"])
+
+        self._set_version(key, await self._run("append_event", key, len(storage_session.events) - 1,
+                                               event.model_dump_json(exclude_none=True), dict(storage_session.state),
+                                               storage_session.last_update_time))
+        return event
+
+    async def truncate_events(self, *, session: Session, keep: int):
+        """把会话的 events 截断到前 keep 个（传入的会话、内存中的会话和 SQLite 都截断），MemoryController 注入历史时使用"""
+        key = (session.app_name, session.user_id, session.id)
+        storage_session = await self._load(key)
+        if storage_session is not None:
+            del storage_session.events[keep:]
+        del session.events[keep:]
+        self._set_version(key, await self._run("truncate_events", key, keep))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "rehydrated": self.rehydrated,
+            "stale": self.stale,
+            "evicted": self.evicted,
+            "purged": self.purged,
+            "db_path": self.store.path if self.store else None,
+            "shared": self.shared,
+        }
+
+
+_session_service: Optional[BoundedSessionService] = None
+_session_service_lock = threading.Lock()
+
+
+def get_session_service() -> BoundedSessionService:
+    """返回进程级单例"""
+    global _session_service
+    if _session_service is None:
+        with _session_service_lock:
+            if _session_service is None:
+                _session_service = BoundedSessionService()
+    return _session_service
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 22:30
+# @File  : shared_state.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 多 worker / 多副本共享的状态：会话和任务放在共享目录的 SQLite 中，流式事件通过 StreamBus 分发到其它 worker
+# search_agent 和 pptagent 中各有一份相同的 shared_state.py（每个服务以自己的目录作为 Docker 构建上下文，不能跨目录共用模块），修改时两份保持一致
+
+import abc
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from a2a.server.events import EventConsumer, EventQueue, InMemoryQueueManager
+from a2a.types import Message, Task, TaskArtifactUpdateEvent, TaskStatusUpdateEvent
+
+logger = logging.getLogger(__name__)
+
+# 共享目录，配置后 session/task 的 SQLite 和流式事件都放在这里，多个 worker（或挂载同一个 volume 的副本）可以同时服务
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "")
+# 订阅其它 worker 的流时轮询文件的间隔(毫秒)
+STREAM_BUS_POLL_MS = int(os.getenv("STREAM_BUS_POLL_MS", 50))
+# 流文件保留的秒数，订阅方超过该时间没有读走事件也会停止
+STREAM_BUS_TTL = float(os.getenv("STREAM_BUS_TTL", 3600))
+
+_STREAM_END = "__end__"
+
+# A2A 事件的 kind -> 类型
+_EVENT_TYPES = {
+    "message": Message,
+    "task": Task,
+    "status-update": TaskStatusUpdateEvent,
+    "artifact-update": TaskArtifactUpdateEvent,
+}
+
+
+def is_shared() -> bool:
+    return bool(SHARED_STATE_DIR)
+
+
+def shared_path(name: str) -> str:
+    """共享目录下的文件路径"""
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    return os.path.join(SHARED_STATE_DIR, name)
+
+
+def dump_event(event) -> str:
+    return event.model_dump_json(exclude_none=True)
+
+
+def load_event(data: str):
+    raw = json.loads(data)
+    return _EVENT_TYPES[raw["kind"]].model_validate(raw)
+
+
+class StreamBus(abc.ABC):
+    """
+    任务事件流的分发接口：运行任务的 worker publish，其它 worker subscribe。
+    LocalDirStreamBus 是基于共享目录的实现，换成 RabbitMQ/Redis 等只需要实现这几个方法。
+    """
+
+    @abc.abstractmethod
+    def open(self, task_id: str):
+        """任务开始运行时调用，之后其它 worker 的 is_open 返回 True"""
+
+    @abc.abstractmethod
+    def publish(self, task_id: str, data: str):
+        """追加一个事件"""
+
+    @abc.abstractmethod
+    def close(self, task_id: str):
+        """任务结束，订阅方读到结束标记后停止"""
+
+    @abc.abstractmethod
+    def is_open(self, task_id: str) -> bool:
+        """任务的流是否还在进行（其它 worker 上有任务正在运行）"""
+
+    @abc.abstractmethod
+    def subscribe(self, task_id: str) -> AsyncIterator[str]:
+        """从当前位置开始订阅之后的事件，流结束时迭代结束"""
+
+
+class LocalDirStreamBus(StreamBus):
+    """
+    每个任务一个追加写的 jsonl 文件：<dir>/<task_id>.jsonl，一行一个事件，结束时写入结束标记。
+    订阅方从文件末尾开始轮询读取新增的行。适用于同一台机器上的多个 worker 或者挂载同一个 volume 的副本。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._files: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    def _path(self, task_id: str) -> str:
+        return os.path.join(self.directory, f"{task_id}.jsonl")
+
+    def _file(self, task_id: str):
+        f = self._files.get(task_id)
+        if f is None:
+            f = self._files[task_id] = open(self._path(task_id), "a", encoding="utf-8")
+        return f
+
+    def open(self, task_id: str):
+        with self._lock:
+            self._file(task_id)
+
+    def _write(self, task_id: str, line: str):
+        with self._lock:
+            f = self._file(task_id)
+            # 一次 write 写入完整的一行，订阅方不会读到半行（读到时也会等下一次轮询补全）
+            f.write(line + "\n")
+            f.flush()
+
+    def publish(self, task_id: str, data: str):
+        self._write(task_id, data)
+
+    def close(self, task_id: str):
+        self._write(task_id, json.dumps({_STREAM_END: True}))
+        with self._lock:
+            f = self._files.pop(task_id, None)
+        if f is not None:
+            f.close()
+        self._cleanup()
+
+    def _cleanup(self):
+        """删除过期的流文件，最多每分钟一次"""
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > STREAM_BUS_TTL:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def is_open(self, task_id: str) -> bool:
+        path = self._path(task_id)
+        try:
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - 64))
+                tail = f.read().decode("utf-8", errors="ignore")
+            if time.time() - os.path.getmtime(path) > STREAM_BUS_TTL:
+                return False
+        except OSError:
+            return False
+        return _STREAM_END not in tail
+
+    async def subscribe(self, task_id: str) -> AsyncIterator[str]:
+        interval = STREAM_BUS_POLL_MS / 1000
+        with open(self._path(task_id), "r", encoding="utf-8") as f:
+            f.seek(0, os.SEEK_END)
+            pending = ""
+            idle_since = time.monotonic()
+            while True:
+                chunk = f.read()
+                if not chunk:
+                    if time.monotonic() - idle_since > STREAM_BUS_TTL:
+                        logger.warning(f"任务 {task_id} 的流超过 {STREAM_BUS_TTL} 秒没有新事件，停止订阅")
+                        return
+                    await asyncio.sleep(interval)
+                    continue
+                idle_since = time.monotonic()
+                pending += chunk
+                *lines, pending = pending.split("\n")
+                for line in lines:
+                    if not line:
+                        continue
+                    if _STREAM_END in line and json.loads(line).get(_STREAM_END):
+                        return
+                    yield line
+
+
+class SharedQueueManager(InMemoryQueueManager):
+    """
+    在 InMemoryQueueManager 的基础上把本 worker 上运行的任务事件转发到 StreamBus，
+    tasks/resubscribe 落到没有运行该任务的 worker 上时，从 StreamBus 订阅事件，而不是返回任务不存在。
+    """
+
+    def __init__(self, bus: StreamBus):
+        super().__init__()
+        self.bus = bus
+        self._background = set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _forward(self, task_id: str, child: EventQueue):
+        """把本地队列的事件转发到 StreamBus"""
+        try:
+            async for event in EventConsumer(child).consume_all():
+                await asyncio.to_thread(self.bus.publish, task_id, dump_event(event))
+        except Exception as e:
+            logger.warning(f"转发任务 {task_id} 的事件失败: {e}")
+        finally:
+            # 最终事件之后如果还有事件，取出来，避免队列关闭时一直等待 task_done
+            while True:
+                try:
+                    await child.dequeue_event(no_wait=True)
+                    child.task_done()
+                except (asyncio.QueueEmpty, Exception):
+                    break
+            await asyncio.to_thread(self.bus.close, task_id)
+
+    async def _feed(self, task_id: str, queue: EventQueue):
+        """把 StreamBus 上其它 worker 的事件放进本地队列"""
+        try:
+            async for data in self.bus.subscribe(task_id):
+                # 订阅方断开后没有人取事件，队列满时超时退出
+                await asyncio.wait_for(queue.enqueue_event(load_event(data)), timeout=STREAM_BUS_TTL)
+        except Exception as e:
+            logger.warning(f"订阅任务 {task_id} 的事件流失败: {e}")
+        finally:
+            # python 3.12 及以下 close 会等待队列中的事件都被取走，订阅方已经断开时不再等待
+            try:
+                await asyncio.wait_for(queue.close(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_forwarding(self, task_id: str, queue: EventQueue):
+        self.bus.open(task_id)
+        self._spawn(self._forward(task_id, queue.tap()))
+
+    async def add(self, task_id: str, queue: EventQueue) -> None:
+        await super().add(task_id, queue)
+        self._start_forwarding(task_id, queue)
+
+    async def create_or_tap(self, task_id: str) -> EventQueue:
+        async with self._lock:
+            if task_id in self._task_queue:
+                return self._task_queue[task_id].tap()
+            queue = EventQueue()
+            self._task_queue[task_id] = queue
+        self._start_forwarding(task_id, queue)
+        return queue
+
+    async def tap(self, task_id: str) -> Optional[EventQueue]:
+        queue = await super().tap(task_id)
+        if queue is not None:
+            return queue
+        if not await asyncio.to_thread(self.bus.is_open, task_id):
+            return None
+        logger.info(f"任务 {task_id} 在其它 worker 上运行，从 StreamBus 订阅事件")
+        queue = EventQueue()
+        self._spawn(self._feed(task_id, queue))
+        return queue
+
+
+def get_queue_manager() -> Optional[SharedQueueManager]:
+    """配置了 SHARED_STATE_DIR 时返回跨 worker 的 QueueManager，否则返回 None（使用 A2A 默认的 InMemoryQueueManager）"""
+    if not is_shared():
+        return None
+    return SharedQueueManager(LocalDirStreamBus(shared_path("streams")))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 19:10
+# @File  : sort_orders.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 本地索引的排序：按 SortType 预先算好的名次数组 + top-k 选择 + search_after 游标翻页
+
+import base64
+import json
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 相关性排序
+SORT_RELEVANT = "relevant"
+
+# SortType 的取值 -> filter_engine 中的列名
+SORT_COLUMNS = {
+    "docIf": "impact_factor",
+    "docPublishTime": "publish_days",
+    "citedBy": "cited_by",
+}
+
+
+def build_sort_orders(index_dir: str):
+    """
+    建索引时调用：对每个排序字段预先排好全部文档（降序，缺失值排最后，相同值按文档编号升序），
+    保存名次数组 sort/<排序字段>_rank.npy，rank[文档编号] = 该文档在排序中的位置（即排序置换的逆置换）。
+    查询时只需要比较候选文档的名次，不用再对字段值排序。
+    """
+    sort_dir = os.path.join(index_dir, "sort")
+    os.makedirs(sort_dir, exist_ok=True)
+    for sort_field, column in SORT_COLUMNS.items():
+        values = np.load(os.path.join(index_dir, "columns", f"{column}.npy")).astype(np.float64)
+        if column == "impact_factor":
+            values[np.isnan(values)] = -np.inf
+        else:
+            values[values == np.iinfo(np.int32).min] = -np.inf
+        order = np.argsort(-values, kind="stable")
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        np.save(os.path.join(sort_dir, f"{sort_field}_rank.npy"), rank)
+
+
+# -----------------------------------------------------------------------------
+# 游标
+# -----------------------------------------------------------------------------
+
+def encode_cursor(query_key: str, sort_field: str, value: float, doc_id: int) -> str:
+    """游标：本页最后一条结果的排序值和文档编号，以及检索条件的指纹，防止换了条件还用旧游标"""
+    raw = json.dumps([query_key, sort_field, value, doc_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, query_key: str, sort_field: str) -> Tuple[float, int]:
+    try:
+        cursor_key, cursor_sort, value, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"search_after 游标无效: {e}")
+    if cursor_key != query_key or cursor_sort != sort_field:
+        raise ValueError("search_after 游标和当前的检索条件或排序方式不一致，请从第一页重新检索")
+    return float(value), int(doc_id)
+
+
+# -----------------------------------------------------------------------------
+# top-k
+# -----------------------------------------------------------------------------
+
+def _smallest_k(keys: np.ndarray, k: int) -> np.ndarray:
+    """keys 中最小的 k 个的下标(按 keys 升序)，argpartition 线性时间选出 k 个，只对这 k 个排序"""
+    if k <= 0 or not len(keys):
+        return np.zeros(0, dtype=np.int64)
+    if len(keys) > k:
+        candidates = np.argpartition(keys, k - 1)[:k]
+        return candidates[np.argsort(keys[candidates], kind="stable")]
+    return np.argsort(keys, kind="stable")
+
+
+class SortOrders:
+    """按排序字段从候选文档中取一页，耗时 O(n + k log k)，n 为候选文档数，k 为需要的条数"""
+
+    def __init__(self, index_dir: str):
+        sort_dir = os.path.join(index_dir, "sort")
+        self.ranks: Dict[str, np.ndarray] = {
+            sort_field: np.load(os.path.join(sort_dir, f"{sort_field}_rank.npy"), mmap_mode="r")
+            for sort_field in SORT_COLUMNS
+        }
+
+    def top_k(self, docs: np.ndarray, scores: np.ndarray, sort_field: str, offset: int, limit: int,
+              query_key: str = "", search_after: str = "") -> Tuple[np.ndarray, Optional[str]]:
+        """
+        返回 (本页的文档编号, 下一页的游标)。
+        - 传了 search_after 时忽略 offset，从游标之后开始取，深翻页不需要重新选出前面的所有结果；
+        - 没有更多结果时游标为 None。
+        """
+        sort_field = sort_field or SORT_RELEVANT
+        if sort_field == SORT_RELEVANT:
+            # 相关性：分数降序，分数相同按文档编号升序
+            if search_after:
+                after_score, after_doc = decode_cursor(search_after, query_key, sort_field)
+                keep = (scores < after_score) | ((scores == after_score) & (docs > after_doc))
+                docs, scores = docs[keep], scores[keep]
+                offset = 0
+            # 先用 np.partition 线性时间找到第 k 大的分数，只对不低于它的文档排序
+            k = offset + limit
+            if len(docs) > k:
+                threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+                candidates = np.nonzero(scores >= threshold)[0]
+            else:
+                candidates = np.arange(len(docs))
+            order = candidates[np.lexsort((docs[candidates], -scores[candidates]))][:k]
+            page = order[offset:]
+            has_more = len(docs) > k
+            if not len(page) or not has_more:
+                return docs[page], None
+            last = page[-1]
+            return docs[page], encode_cursor(query_key, sort_field, float(scores[last]), int(docs[last]))
+
+        rank_array = self.ranks.get(sort_field)
+        if rank_array is None:
+            raise ValueError(f"不支持的排序方式: {sort_field}，可用的有 {SORT_RELEVANT}, {', '.join(SORT_COLUMNS)}")
+        ranks = rank_array[docs]
+        if search_after:
+            after_rank, _ = decode_cursor(search_after, query_key, sort_field)
+            keep = ranks > after_rank
+            docs, ranks = docs[keep], ranks[keep]
+            offset = 0
+        k = offset + limit
+        page = _smallest_k(ranks, k)[offset:]
+        if not len(page) or len(docs) <= k:
+            return docs[page], None
+        last = page[-1]
+        return docs[page], encode_cursor(query_key, sort_field, int(ranks[last]), int(docs[last]))
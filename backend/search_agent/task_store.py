@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 21:50
+# @File  : task_store.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 有上限的 A2A TaskStore：运行中的任务放内存，结束的任务只保留最终状态和产物并压缩保存，按数量和时间淘汰，可选 SQLite 磁盘层
+# search_agent 和 pptagent 中各有一份相同的 task_store.py（每个服务以自己的目录作为 Docker 构建上下文，不能跨目录共用模块），修改时两份保持一致
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from a2a.server.tasks import TaskStore
+from a2a.types import Task, TaskState
+
+from shared_state import SHARED_STATE_DIR, is_shared
+
+logger = logging.getLogger(__name__)
+
+# 内存中最多保留多少个已结束的任务
+TASK_STORE_MAX_FINISHED = int(os.getenv("TASK_STORE_MAX_FINISHED", 1000))
+# 已结束的任务保留多少秒
+TASK_STORE_FINISHED_TTL = float(os.getenv("TASK_STORE_FINISHED_TTL", 3600))
+# 运行中的任务超过多少秒没有更新，认为已经丢失
+TASK_STORE_ACTIVE_TTL = float(os.getenv("TASK_STORE_ACTIVE_TTL", 3 * 3600))
+# 已结束任务的磁盘层(SQLite)，为空时不启用；磁盘上的任务保留 TASK_STORE_DISK_TTL 秒
+# 配置了 SHARED_STATE_DIR 时默认放在共享目录下，运行中的任务也会写入，其它 worker 可以查到
+TASK_STORE_DB_PATH = os.getenv("TASK_STORE_DB_PATH", os.path.join(SHARED_STATE_DIR, "tasks.db") if SHARED_STATE_DIR else "")
+TASK_STORE_DISK_TTL = float(os.getenv("TASK_STORE_DISK_TTL", 7 * 24 * 3600))
+
+TERMINAL_STATES = {TaskState.completed, TaskState.canceled, TaskState.failed, TaskState.rejected}
+
+
+def compact_task(task: Task) -> bytes:
+    """结束的任务只保留 id、contextId、最终状态、产物和 metadata（去掉过程中的 history），序列化后压缩"""
+    compact = task.model_copy(update={"history": None})
+    return zlib.compress(compact.model_dump_json(exclude_none=True).encode("utf-8"))
+
+
+def restore_task(data: bytes) -> Task:
+    return Task.model_validate_json(zlib.decompress(data))
+
+
+class TaskDiskTier:
+    """已结束任务（共享模式下还有运行中的任务）的 SQLite(WAL) 存储"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS finished_tasks (
+                task_id     TEXT PRIMARY KEY,
+                data        BLOB NOT NULL,
+                finished_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS active_tasks (
+                task_id     TEXT PRIMARY KEY,
+                data        BLOB NOT NULL,
+                updated_at  REAL NOT NULL
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, task_id: str, data: bytes, finished_at: float):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO finished_tasks (task_id, data, finished_at) VALUES (?, ?, ?)",
+                     (task_id, data, finished_at))
+        conn.execute("DELETE FROM active_tasks WHERE task_id = ?", (task_id,))
+
+    def put_active(self, task_id: str, data: bytes, updated_at: float):
+        self._conn().execute("INSERT OR REPLACE INTO active_tasks (task_id, data, updated_at) VALUES (?, ?, ?)",
+                             (task_id, data, updated_at))
+
+    def get_active(self, task_id: str, known_updated_at: Optional[float]) -> Tuple[Optional[bytes], Optional[float]]:
+        """返回 (数据, 更新时间)；和 known_updated_at 相同时不返回数据（内存中的已经是最新的）"""
+        row = self._conn().execute("SELECT updated_at FROM active_tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None, None
+        if row[0] == known_updated_at:
+            return None, row[0]
+        row = self._conn().execute("SELECT data, updated_at FROM active_tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def get(self, task_id: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT data FROM finished_tasks WHERE task_id = ? AND finished_at >= ?",
+            (task_id, time.time() - TASK_STORE_DISK_TTL),
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, task_id: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM finished_tasks WHERE task_id = ?", (task_id,))
+        conn.execute("DELETE FROM active_tasks WHERE task_id = ?", (task_id,))
+
+    def purge(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM finished_tasks WHERE finished_at < ?", (time.time() - TASK_STORE_DISK_TTL,))
+        conn.execute("DELETE FROM active_tasks WHERE updated_at < ?", (time.time() - TASK_STORE_ACTIVE_TTL,))
+
+
+class BoundedTaskStore(TaskStore):
+    """
+    替代 InMemoryTaskStore：
+    - 运行中的任务原样保存在内存中（执行过程中会反复读写），超过 active_ttl 没有更新的丢弃；
+    - 任务进入结束状态（completed/canceled/failed/rejected）时压缩成 bytes，只保留最终状态和产物，
+      按 LRU 最多保留 max_finished 个，超过 finished_ttl 秒淘汰；
+    - 配置了 db_path 时，结束的任务同时写入 SQLite，内存中淘汰后仍然可以通过 tasks/get 查到；
+    - shared=True 时（多个 worker 共用数据库）运行中的任务每次保存也写入 SQLite，读取时比较更新时间，
+      其它 worker 上运行的任务或者被其它 worker 更新过的任务从 SQLite 读取。
+    """
+
+    def __init__(self, max_finished: int = TASK_STORE_MAX_FINISHED, finished_ttl: float = TASK_STORE_FINISHED_TTL,
+                 active_ttl: float = TASK_STORE_ACTIVE_TTL, db_path: str = TASK_STORE_DB_PATH, shared: bool = None):
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self.active_ttl = active_ttl
+        self.shared = (is_shared() if shared is None else shared) and bool(db_path)
+        self._active: "OrderedDict[str, Tuple[Task, float]]" = OrderedDict()
+        self._finished: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.lock = asyncio.Lock()
+        self.disk = TaskDiskTier(db_path) if db_path else None
+        self.disk_hits = 0
+        self.evicted = 0
+        self._last_purge = 0.0
+
+    def _evict(self, now: float):
+        while self._active:
+            task_id, (_, updated_at) = next(iter(self._active.items()))
+            if now - updated_at < self.active_ttl:
+                break
+            logger.warning(f"任务 {task_id} 超过 {self.active_ttl} 秒没有更新，从 TaskStore 中移除")
+            self._active.popitem(last=False)
+            self.evicted += 1
+        while self._finished:
+            _, finished_at = next(iter(self._finished.values()))
+            if len(self._finished) <= self.max_finished and now - finished_at < self.finished_ttl:
+                break
+            self._finished.popitem(last=False)
+            self.evicted += 1
+
+    async def save(self, task: Task) -> None:
+        now = time.time()
+        data = None
+        async with self.lock:
+            if task.status.state in TERMINAL_STATES:
+                self._active.pop(task.id, None)
+                data = compact_task(task)
+                self._finished[task.id] = (data, now)
+                self._finished.move_to_end(task.id)
+            else:
+                self._finished.pop(task.id, None)
+                self._active[task.id] = (task, now)
+                self._active.move_to_end(task.id)
+            self._evict(now)
+        if self.shared and data is None:
+            await asyncio.to_thread(self.disk.put_active, task.id, zlib.compress(
+                task.model_dump_json(exclude_none=True).encode("utf-8")), now)
+        if data is not None and self.disk is not None:
+            await asyncio.to_thread(self.disk.put, task.id, data, now)
+            # 每小时清理一次磁盘上过期的任务
+            if now - self._last_purge > 3600:
+                self._last_purge = now
+                await asyncio.to_thread(self.disk.purge)
+
+    async def get(self, task_id: str) -> Optional[Task]:
+        if self.shared:
+            entry = self._active.get(task_id)
+            data, updated_at = await asyncio.to_thread(self.disk.get_active, task_id, entry[1] if entry else None)
+            if data is not None:
+                task = restore_task(data)
+                async with self.lock:
+                    self._finished.pop(task_id, None)
+                    self._active[task_id] = (task, updated_at)
+                return task
+            if updated_at is None and entry is not None:
+                # 其它 worker 已经把任务结束了，下面从已结束的任务中读取
+                async with self.lock:
+                    self._active.pop(task_id, None)
+        async with self.lock:
+            entry = self._active.get(task_id)
+            if entry is not None:
+                return entry[0]
+            entry = self._finished.get(task_id)
+            if entry is not None:
+                self._finished.move_to_end(task_id)
+                return restore_task(entry[0])
+        if self.disk is None:
+            return None
+        data = await asyncio.to_thread(self.disk.get, task_id)
+        if data is None:
+            return None
+        self.disk_hits += 1
+        return restore_task(data)
+
+    async def delete(self, task_id: str) -> None:
+        async with self.lock:
+            found = self._active.pop(task_id, None) is not None
+            found = self._finished.pop(task_id, None) is not None or found
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, task_id)
+        elif not found:
+            logger.warning(f"Attempted to delete nonexistent task with id: {task_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._active),
+            "finished": len(self._finished),
+            "finished_bytes": sum(len(data) for data, _ in self._finished.values()),
+            "max_finished": self.max_finished,
+            "evicted": self.evicted,
+            "disk_hits": self.disk_hits,
+            "db_path": self.disk.path if self.disk else None,
+            "shared": self.shared,
+        }
+
+
+_task_store: Optional[BoundedTaskStore] = None
+_task_store_lock = threading.Lock()
+
+
+def get_task_store() -> BoundedTaskStore:
+    """返回进程级单例"""
+    global _task_store
+    if _task_store is None:
+        with _task_store_lock:
+            if _task_store is None:
+                _task_store = BoundedTaskStore()
+                logger.info(f"TaskStore: 内存中最多保留 {_task_store.max_finished} 个已结束任务，磁盘层 {TASK_STORE_DB_PATH or '(不启用)'}")
+    return _task_store
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/19 10:30
+# @File  : test_query_parser.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : query_parser 的单元测试：解析、规范形式的往返一致性，以及 validate_search_params 的校验
+
+import unittest
+
+from query_parser import BoolOp, QueryParseError, Term, canonical_query, parse_query, serialize
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_phrase_and_words(self):
+        self.assertEqual(parse_query('"Lung Cancer"[Title]'), Term("Lung Cancer", "Title", True))
+        self.assertEqual(parse_query("lung cancer[Title]"), Term("lung cancer", "Title", False))
+
+    def test_same_operator_is_flattened(self):
+        tree = parse_query('("A"[Title]) AND ("B"[Title] AND "C"[Title])')
+        self.assertEqual(tree, BoolOp("AND", [Term("A", "Title"), Term("B", "Title"), Term("C", "Title")]))
+
+    def test_not_is_not_flattened_on_the_right(self):
+        tree = parse_query('"A"[Title] NOT ("B"[Title] NOT "C"[Title])')
+        self.assertEqual(tree.op, "NOT")
+        self.assertEqual(tree.operands[1], BoolOp("NOT", [Term("B", "Title"), Term("C", "Title")]))
+
+    def test_lowercase_operators_are_words(self):
+        self.assertEqual(parse_query("a and b[Title]"), Term("a and b", "Title", False))
+
+    def test_errors(self):
+        cases = {
+            '"A"[Title] "B"[Title]': "missing_operator",
+            '"A"[Title] AND': "dangling_operator",
+            '("A"[Title]': "unbalanced_paren",
+            '"A"[Title])': "unbalanced_paren",
+            '"A[Title]': "unterminated_quote",
+            '"A"[Title': "unterminated_field",
+            "()": "empty_group",
+            "": "empty",
+        }
+        for query, code in cases.items():
+            with self.subTest(query=query):
+                with self.assertRaises(QueryParseError) as ctx:
+                    parse_query(query)
+                self.assertEqual(ctx.exception.code, code)
+
+
+class CanonicalQueryTest(unittest.TestCase):
+
+    def test_equivalent_queries_share_a_key(self):
+        a = canonical_query('("B"[Abstract])  AND ("A"[Title])')
+        b = canonical_query('"A"[Title] AND "B"[Abstract]')
+        self.assertEqual(a, b)
+
+    def test_not_keeps_its_first_operand(self):
+        self.assertNotEqual(canonical_query('"A"[Title] NOT "B"[Title]'),
+                            canonical_query('"B"[Title] NOT "A"[Title]'))
+
+    def test_round_trip_is_idempotent(self):
+        queries = [
+            '("Lung Cancer"[Title]) AND ("Immunotherapy"[Abstract] OR "PD-1"[Abstract])',
+            '"say \\"hi\\""[Title]',
+            '"a\\\\b"[Title]',
+            '"trailing\\\\"[Title] NOT "x"[Title]',
+        ]
+        for query in queries:
+            with self.subTest(query=query):
+                canonical = canonical_query(query)
+                self.assertEqual(canonical_query(canonical), canonical)
+                self.assertEqual(parse_query(canonical), parse_query(query))
+
+    def test_backslash_is_escaped(self):
+        tree = parse_query('"a\\\\b"[Title]')
+        self.assertEqual(tree, Term("a\\b", "Title"))
+        self.assertEqual(serialize(tree), '"a\\\\b"[Title]')
+
+    def test_unparsable_query_only_collapses_whitespace(self):
+        self.assertEqual(canonical_query('"A"[Title]   "B"[Title]'), '"A"[Title] "B"[Title]')
+
+
+class ValidateSearchParamsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from tools import validate_search_params
+        cls.validate = staticmethod(validate_search_params)
+
+    def test_valid_query(self):
+        self.assertIsNone(self.validate('("Lung Cancer"[Title]) AND ("Review"[Abstract])', "@@AND$$doc_if$$5$$30"))
+
+    def test_invalid_queries(self):
+        for query in ["", '"A"[Title] "B"[Title]', '"A"[Lung Cancer]', '"A"', '"A"[Title] AND "B"[Title]',
+                      '("A"[Title]) AND (B)']:
+            with self.subTest(query=query):
+                self.assertIsNotNone(self.validate(query))
+
+    def test_invalid_filter(self):
+        self.assertIsNotNone(self.validate('"A"[Title]', "doc_if=5"))
+
+
+if __name__ == "__main__":
+    unittest.main()
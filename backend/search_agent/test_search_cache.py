@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/19 10:00
+# @File  : test_search_cache.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : search_cache 的单元测试：L1/L2 缓存和并发请求合并
+
+import asyncio
+import tempfile
+import unittest
+
+from search_cache import SearchResultCache, SharedDirCache, TTLLRUCache, _MISSING
+
+
+class SearchResultCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.cache = SearchResultCache(TTLLRUCache(max_entries=8, ttl=60))
+        self.calls = 0
+
+    async def slow_fetch(self):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return {"hits": self.calls}
+
+    async def test_concurrent_requests_are_coalesced(self):
+        results = await asyncio.gather(*[self.cache.get_or_fetch("k", self.slow_fetch) for _ in range(5)])
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(r == {"hits": 1} for r in results))
+        # 之后的请求走一级缓存
+        self.assertEqual(await self.cache.get_or_fetch("k", self.slow_fetch), {"hits": 1})
+        self.assertEqual(self.calls, 1)
+
+    async def test_cancelling_first_caller_does_not_cancel_others(self):
+        leader = asyncio.create_task(self.cache.get_or_fetch("k", self.slow_fetch))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(self.cache.get_or_fetch("k", self.slow_fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        self.assertEqual(await follower, {"hits": 1})
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.assertEqual(self.calls, 1)
+
+    async def test_errors_reach_every_waiter_and_are_not_cached(self):
+        async def failing_fetch():
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("backend down")
+
+        results = await asyncio.gather(*[self.cache.get_or_fetch("k", failing_fetch) for _ in range(3)],
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(await self.cache.get_or_fetch("k", self.slow_fetch), {"hits": 2})
+        self.assertEqual(self.cache.stats()["inflight"], 0)
+
+    async def test_uncacheable_results_are_not_stored(self):
+        await self.cache.get_or_fetch("k", self.slow_fetch, cacheable=lambda _: False)
+        await self.cache.get_or_fetch("k", self.slow_fetch, cacheable=lambda _: False)
+        self.assertEqual(self.calls, 2)
+
+
+class SharedDirCacheTest(unittest.TestCase):
+
+    def test_unreadable_file_is_a_miss(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SharedDirCache(directory)
+            cache.set("ok", [1, 2])
+            with open(cache._path("bad"), "wb") as f:
+                f.write(b"not a pickle")
+            self.assertEqual(cache.get("ok"), [1, 2])
+            self.assertIs(cache.get("bad"), _MISSING)
+            self.assertIs(cache.get("missing"), _MISSING)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
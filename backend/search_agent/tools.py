@@ -21,6 +21,15 @@ from datetime import datetime, timezone, timedelta
 from typing import List, Union, Dict, Any, Tuple, Optional
 import pika
 from pika.exceptions import AMQPConnectionError
+from mq_publisher import get_publisher
+from outbox import get_outbox
+from task_index import get_task_index, make_task_key
+from search_cache import make_search_cache_key, search_cache
+from local_index import get_local_index
+from result_projection import project_search_result
+from google.adk.tools.tool_context import ToolContext
+from query_parser import (BoolOp, QueryParseError, QueryParser, TOKEN_FIELD, TOKEN_LPAREN, TOKEN_RPAREN,
+                          iter_terms, tokenize)
 dotenv.load_dotenv()
 
 # 配置日志
@@ -37,6 +46,13 @@ RABBITMQ_VIRTUAL_HOST = os.getenv("RABBITMQ_VIRTUAL_HOST", "/")
 # 从哪个队列中读取数据,写入到问题，从答案读取
 QUEUE_NAME_WRITER = os.getenv("QUEUE_NAME_WRITER", "question_queue")
 QUEUE_NAME_READ = os.getenv("QUEUE_NAME_READ", "answer_queue")
+# 优先级通道：interactive 写入 QUEUE_NAME_WRITER，bulk 写入 <QUEUE_NAME_WRITER>.bulk，由 subagent_main 加权公平消费
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+# 工具默认的优先级，例如 "ppt_generator:bulk"，未配置的工具默认 interactive
+TOOL_PRIORITIES = dict(
+    item.strip().split(":", 1) for item in os.getenv("TOOL_PRIORITIES", "").split(",") if ":" in item
+)
 logger.info(f"连接 RabbitMQ at {RABBITMQ_HOST}:{RABBITMQ_PORT}, user: {RABBITMQ_USERNAME}")
 
 def get_rabbitmq_connection():
@@ -55,42 +71,56 @@ def get_rabbitmq_connection():
         logger.error(f"Failed to connect to RabbitMQ: {e}")
         raise
 
-def publish_to_question_queue(final_body: str):
-    """发送消息"""
-    try:
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        channel.queue_declare(queue=QUEUE_NAME_WRITER, durable=True)
-        channel.basic_publish(
-            exchange='',
-            routing_key=QUEUE_NAME_WRITER,
-            body=final_body,
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # make message persistent
-            )
-        )
-        connection.close()
-        logger.info(f"发送消息成功到队列 {QUEUE_NAME_WRITER} 发送消息为: {final_body}")
-    except AMQPConnectionError as e:
-        # Re-raise to be caught in the endpoint
-        raise e
+def get_question_outbox():
+    """进程级 outbox，首次调用时启动后台 drainer（同时重放上次未投递完的消息），没有配置 OUTBOX_DIR 时为 None"""
+    return get_outbox(get_publisher(get_rabbitmq_connection))
+
+
+def lane_queue(priority: Optional[str]) -> str:
+    """优先级对应的队列名，与 subagent_main/mq_lanes.py 保持一致"""
+    if priority == PRIORITY_BULK:
+        return f"{QUEUE_NAME_WRITER}.{PRIORITY_BULK}"
+    return QUEUE_NAME_WRITER
+
+
+def publish_to_question_queue(final_body: str, priority: str = PRIORITY_INTERACTIVE):
+    """
+    发送消息：先追加写入本地 outbox 立即返回，由后台 drainer 批量投递到 RabbitMQ。
+    broker 变慢或者不可用时不会阻塞工具调用，消息保存在磁盘上等待重放。
+    没有配置 OUTBOX_DIR 时直接交给发布线程投递，投递失败只记录日志。
+    """
+    queue_name = lane_queue(priority)
+    outbox = get_question_outbox()
+    if outbox is None:
+        def log_failure(future):
+            if future.exception() is not None:
+                logger.error(f"消息投递到队列 {queue_name} 失败: {future.exception()}")
+
+        get_publisher(get_rabbitmq_connection).publish(final_body, queue_name).add_done_callback(log_failure)
+        logger.info(f"消息已提交投递到队列 {queue_name}: {final_body}")
+        return
+    outbox.append(queue_name, final_body)
+    logger.info(f"消息已写入 outbox，等待投递到队列 {queue_name}: {final_body}")
 
 def build_simple_tool_request(
     tool_name: str,
     args: Dict[str, Any],
     trace_id: Optional[str] = None,
+    priority: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     构造你定义的极简 MQ 消息：
     {
-      type, version, task_id, trace_id, timestamp, tool:{name,args}
+      type, version, task_id, trace_id, timestamp, priority, tool:{name,args}
     }
+    priority: interactive | bulk，不传时使用 TOOL_PRIORITIES 中该工具的配置
     """
     task_id = f"task_{uuid.uuid4().hex}"
     trace_id = trace_id or task_id
 
     tz = timezone(timedelta(hours=8))  # +08:00
     timestamp = datetime.now(tz).isoformat()
+    priority = priority or TOOL_PRIORITIES.get(tool_name, PRIORITY_INTERACTIVE)
 
     return {
         "type": "tool_request",
@@ -98,6 +128,7 @@ def build_simple_tool_request(
         "task_id": task_id,
         "trace_id": trace_id,
         "timestamp": timestamp,
+        "priority": priority,
         "tool": {
             "name": tool_name,
             "args": args
@@ -105,6 +136,31 @@ def build_simple_tool_request(
     }
 
 
+async def submit_tool_request(tool_name: str, args: Dict[str, Any], priority: Optional[str] = None) -> Tuple[str, bool]:
+    """
+    提交长任务：相同 (工具名, 规范化参数) 的任务正在处理时，直接复用已有的 task_id，不再重复发送。
+    已完成的相同任务仍然发送新的请求，由 subagent_main 检查结果是否还在（在就直接复用，不会重新执行）。
+    返回 (task_id, 是否为新提交的任务)
+    """
+    req_msg = build_simple_tool_request(
+        tool_name=tool_name,
+        args=args,
+        priority=priority,
+    )
+    task_id, created = req_msg["task_id"], True
+    task_index = get_task_index()
+    if task_index is not None:
+        # SQLite 写事务可能等待锁，不能阻塞 event loop
+        task_id, created = await asyncio.to_thread(
+            task_index.claim, make_task_key(tool_name, args), req_msg["task_id"], tool_name, False
+        )
+    if created:
+        publish_to_question_queue(json.dumps(req_msg, ensure_ascii=False), priority=req_msg["priority"])
+    else:
+        logger.info(f"相同的 {tool_name} 任务已存在，复用 task_id: {task_id}, args: {args}")
+    return task_id, created
+
+
 async def translate_paper_tool(
     paper_id: Optional[str] = None,
     target_lang: str = "zh-CN",
@@ -129,13 +185,7 @@ async def translate_paper_tool(
         "target_lang": target_lang
     }
 
-    req_msg = build_simple_tool_request(
-        tool_name="translator",
-        args=args,
-    )
-
-    publish_to_question_queue(json.dumps(req_msg, ensure_ascii=False))
-    task_id = req_msg["task_id"]
+    task_id, created = await submit_tool_request("translator", args)
 
     accepted_card = [
         {
@@ -146,7 +196,7 @@ async def translate_paper_tool(
                 "tool": "translator",
                 "status": "accepted",
                 "progress": 0.0,
-                "message": "翻译任务已提交，正在排队处理中。",
+                "message": "翻译任务已提交，正在排队处理中。" if created else "相同的翻译任务已提交过，复用已有任务。",
             }
         }
     ]
@@ -175,13 +225,7 @@ async def generate_ppt_tool(
     args = {
         "paper_id": paper_id,
     }
-    req_msg = build_simple_tool_request(
-        tool_name="ppt_generator",
-        args=args,
-    )
-
-    publish_to_question_queue(json.dumps(req_msg, ensure_ascii=False))
-    task_id = req_msg["task_id"]
+    task_id, created = await submit_tool_request("ppt_generator", args)
 
     accepted_card = [
         {
@@ -192,7 +236,7 @@ async def generate_ppt_tool(
                 "tool": "ppt_generator",
                 "status": "accepted",
                 "progress": 0.0,
-                "message": "PPT 生成任务已提交，正在排队处理中。",
+                "message": "PPT 生成任务已提交，正在排队处理中。" if created else "相同的 PPT 生成任务已提交过，复用已有任务。",
             }
         }
     ]
@@ -360,17 +404,25 @@ def validate_search_params(query_string: str, filter_string: str="") -> str:
     if not query_string or not query_string.strip():
         return "Error: query_string 不能为空。"
 
+    # 一次扫描完成分词，后面的检查都基于 token，不再反复扫描字符串
+    try:
+        tokens = tokenize(query_string)
+    except QueryParseError as e:
+        return f"Error: query_string 格式错误：{e}。"
+
     # A. 括号平衡检查
-    if query_string.count('(') != query_string.count(')'):
-        return f"Error: query_string 中的括号不匹配 (左括号 {query_string.count('(')} 个, 右括号 {query_string.count(')')} 个)。请确保每个左括号都有对应的右括号。"
+    left_count = sum(1 for token in tokens if token.kind == TOKEN_LPAREN)
+    right_count = sum(1 for token in tokens if token.kind == TOKEN_RPAREN)
+    if left_count != right_count:
+        return f"Error: query_string 中的括号不匹配 (左括号 {left_count} 个, 右括号 {right_count} 个)。请确保每个左括号都有对应的右括号。"
 
     valid_tags = {
         "Title", "Abstract", "Title/Abstract", "MeSH Terms",
         "Author", "Affiliation", "Journal", "First Author", "Last Author"
     }
 
-    # 提取所有 [] 中的内容
-    tags_in_query = re.findall(r'\[(.*?)\]', query_string)
+    # B. 字段限定符检查 ([Title], [Abstract] 等)
+    tags_in_query = [token.value for token in tokens if token.kind == TOKEN_FIELD]
     if not tags_in_query:
         return "缺少字段限定符，例如 [Title]"
 
@@ -379,26 +431,22 @@ def validate_search_params(query_string: str, filter_string: str="") -> str:
             # 这是一个非常强的纠正信号：模型常把关键词放在括号里 [Lung Cancer]
             return f"检测到无效的字段限定符 '[{tag}]'。请注意：关键词不要放在方括号里！方括号里只能放字段名，如 'Lung Cancer'[Title]。"
 
-    # B. 字段限定符检查 ([Title], [Abstract] 等)
-    # 正则匹配 [...] 结构
-    if not re.search(r'\[.*?\]', query_string):
-        return "Error: 搜索词缺少字段限定符。严禁直接搜索单词，必须指定字段。例如: \"Lung Cancer\"[Title] 或 \"Immunotherapy\"[Abstract]。"
-
-    if re.search(r'\]\s+["\(]', query_string):
-        # 例子: [Title] "Immunotherapy" -> 缺 AND
-        # 例子: [Title] ( -> 缺 AND
-        if " AND " not in query_string and " OR " not in query_string and " NOT " not in query_string:
-            return "多个搜索条件之间缺少逻辑运算符(AND/OR)。例如: (\"A\"[Title]) AND (\"B\"[Abstract])"
-
-    # C. 逻辑连接符与括号包裹检查 (针对你的需求：每个搜索词应该用括号分割)
-    # 检查是否存在 AND/OR/NOT 但周围没有括号的情况 (简单的启发式检查)
-    # 如果包含逻辑运算符，建议整体结构清晰
-    logic_ops = [' AND ', ' OR ', ' NOT ']
-    has_logic = any(op in query_string for op in logic_ops)
-
-    # 如果有逻辑运算，检查是否有括号。
-    # 这是一个比较宽松的检查，只要有括号就行，避免过于严格误杀正确格式
-    if has_logic and '(' not in query_string:
+    # C. 语法检查：缺少逻辑运算符、运算符两侧缺少检索条件等
+    parser = QueryParser(tokens, len(query_string))
+    try:
+        tree = parser.parse()
+    except QueryParseError as e:
+        if e.code == "missing_operator":
+            # 例子: "A"[Title] "B"[Abstract] -> 缺 AND
+            return f"多个搜索条件之间缺少逻辑运算符(AND/OR)，位置 {e.position}。例如: (\"A\"[Title]) AND (\"B\"[Abstract])"
+        return f"Error: query_string 格式错误：{e}。"
+
+    for term in iter_terms(tree):
+        if not term.field:
+            return f"Error: 搜索词 '{term.text}' 缺少字段限定符。严禁直接搜索单词，必须指定字段。例如: \"Lung Cancer\"[Title] 或 \"Immunotherapy\"[Abstract]。"
+
+    # D. 逻辑连接符与括号包裹检查：有逻辑运算时要求用括号明确优先级
+    if isinstance(tree, BoolOp) and parser.group_count == 0:
         return "Error: 使用逻辑运算符 (AND/OR/NOT) 时，建议使用括号明确优先级。例如: ((\"Lung Cancer\"[Title]) AND (\"Review\"[doc_publish_type]))。"
 
     # --- 2. Filter String 校验 ---
@@ -427,11 +475,50 @@ async def search_advanced(
         filter_string: str = "",
         sort_field: str = "relevant",
         page_num: int = 1,
-        page_size: int = 5
+        page_size: int = 5,
+        search_after: str = "",
+        tool_context: Optional[ToolContext] = None
 ) -> Dict[str, Any]:
     """
     """
     logger.info(f"MCP搜索请求: query_string='{query_string}', filter_string='{filter_string}'")
+    # 相同(规范化后)的检索条件直接命中缓存，不再请求后端
+    cache_key = make_search_cache_key(query_string, filter_string, sort_field, page_num, page_size, search_after)
+    result = await search_cache.get_or_fetch(
+        cache_key,
+        lambda: _search_backend(query_string, filter_string, sort_field, page_num, page_size, search_after),
+        cacheable=lambda result: isinstance(result, dict) and result.get("code") == 200,
+    )
+    # 完整记录放到 state 中，由 executor 通过消息 metadata 发给前端展示；模型只看到精简后的结果
+    if tool_context is not None and isinstance(result, dict):
+        tool_context.state["search_dbs"] = result.get("records") or []
+    return project_search_result(result)
+
+
+async def _search_backend(
+        query_string: str,
+        filter_string: str = "",
+        sort_field: str = "relevant",
+        page_num: int = 1,
+        page_size: int = 5,
+        search_after: str = ""
+) -> Dict[str, Any]:
+    """
+    请求搜索后端：配置了 LOCAL_INDEX_DIR 时查询本地索引，否则返回模拟数据
+    search_after 是上一页返回的游标，只有本地索引支持
+    """
+    local_index = get_local_index()
+    if local_index is not None:
+        try:
+            result = await asyncio.to_thread(
+                local_index.search, query_string, filter_string, sort_field, page_num, page_size, search_after
+            )
+        except ValueError as e:
+            # QueryParseError 也是 ValueError，检索式有误时把原因返回给模型修正
+            logger.warning(f"本地索引检索失败: {e}")
+            return {'code': 400, 'msg': f"检索式错误: {e}", 'records': [], 'total': 0}
+        logger.info(f"本地索引检索完成: total={result['total']}")
+        return result
 
     result = {
     'code': 200,
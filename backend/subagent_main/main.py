@@ -1,4 +1,5 @@
 import asyncio
+import concurrent.futures
 import json
 import os
 import re
@@ -7,7 +8,9 @@ import uuid
 import threading
 import time
 import datetime
-from typing import Dict, Optional, Any
+import functools
+from collections import deque
+from typing import Dict, List, Optional, Any
 from uuid import uuid4
 import httpx
 import dotenv
@@ -19,6 +22,10 @@ from fastapi.middleware.cors import CORSMiddleware
 
 # 导入本地翻译工具
 from tools import translate_tool
+from mq_lanes import PRIORITIES, ToolSlots, WeightedLaneScheduler, lane_queue, parse_lane_weights, parse_tool_concurrency
+from task_index import get_task_index, make_task_key, STATUS_DONE, STATUS_FAILED, STATUS_PENDING
+from task_completion import SubscriptionHub
+from result_store import ResultStore
 
 dotenv.load_dotenv()
 
@@ -59,36 +66,106 @@ RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD", "welcome")
 RABBITMQ_VIRTUAL_HOST = os.getenv("RABBITMQ_VIRTUAL_HOST", "/")
 QUEUE_NAME_WRITER = os.getenv("QUEUE_NAME_WRITER", "question_queue")
 QUEUE_NAME_READ = os.getenv("QUEUE_NAME_READ", "answer_queue")
+# 每个通道的预取数量（消息在任务完成后才确认，执行中的任务和缓冲中等待槽位的消息也占预取数，
+# 需要大于 MQ_MAX_INFLIGHT 加上 MQ_TOOL_CONCURRENCY 的槽位数之和），以及同时执行的工具请求上限
+MQ_LANE_PREFETCH = int(os.getenv("MQ_LANE_PREFETCH", 16))
+MQ_MAX_INFLIGHT = int(os.getenv("MQ_MAX_INFLIGHT", 8))
+# 多路复用的 WebSocket(/ws) 每个连接最多同时订阅多少个任务
+WS_MAX_SUBSCRIPTIONS = int(os.getenv("WS_MAX_SUBSCRIPTIONS", 100))
+# 重复任务等待复用结果的最长时间(秒)，超时后消息重新发布到队列（先提交的任务可能在其它进程中执行）
+DUPLICATE_WAIT_TIMEOUT = float(os.getenv("DUPLICATE_WAIT_TIMEOUT", 600))
 
 logger.info(f"连接 RabbitMQ at {RABBITMQ_HOST}:{RABBITMQ_PORT}, user: {RABBITMQ_USERNAME}")
 
-# 缓存所有Agent的任务结果：task_id -> result
-task_results: Dict[str, Any] = {}
+# 缓存所有Agent的任务结果：task_id -> result（按字节预算/过期时间淘汰，可选磁盘层，见 result_store.py）
+task_results = ResultStore(on_evict=lambda task_id: forget_task_result(task_id))
+# 重复提交的任务：先提交的 task_id -> 等待复用其结果的重复 task_id 列表
+duplicate_followers: Dict[str, List[str]] = {}
+# 等待复用结果的重复任务：task_id -> 结果复制给它之后完成的 future（完成后才确认它的 MQ 消息）
+follower_waiters: Dict[str, asyncio.Future] = {}
+# 每个工具的执行槽位（MQ_TOOL_CONCURRENCY）
+tool_slots = ToolSlots(parse_tool_concurrency())
+# 等待任务结果的 WebSocket 订阅者，任务完成时把结果推送给所有订阅者（见 build_task_message）
+subscriptions = SubscriptionHub(lambda task_id: build_task_message(task_id))
+
+
+def is_error_result(result_data: Any) -> bool:
+    """判断任务结果是否为错误卡片"""
+    if isinstance(result_data, dict):
+        return result_data.get("type") == "error"
+    if isinstance(result_data, list):
+        return any(isinstance(item, dict) and item.get("type") == "error" for item in result_data)
+    return False
 
-# WebSocket连接管理
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
 
-    async def connect(self, websocket: WebSocket, task_id: str):
-        await websocket.accept()
-        self.active_connections[task_id] = websocket
-        logger.info(f"WebSocket连接建立，task_id: {task_id}")
+def persist_task_result(task_id: str, result_data: Any):
+    """保存任务结果并更新幂等索引的状态（会读写磁盘，不在 event loop 中调用）"""
+    task_results[task_id] = result_data
+    task_index = get_task_index()
+    if task_index is None:
+        return
+    try:
+        task_index.mark(task_id, STATUS_FAILED if is_error_result(result_data) else STATUS_DONE)
+    except Exception as e:
+        logger.error(f"更新任务幂等索引失败，task_id: {task_id}, 错误: {e}")
 
-    def disconnect(self, task_id: str):
-        if task_id in self.active_connections:
-            del self.active_connections[task_id]
-            logger.info(f"WebSocket连接断开，task_id: {task_id}")
 
-    async def send_personal_message(self, message: str, task_id: str):
-        if task_id in self.active_connections:
-            try:
-                await self.active_connections[task_id].send_text(message)
-            except Exception as e:
-                logger.error(f"发送消息给task_id {task_id}失败: {e}")
-                self.disconnect(task_id)
+def forget_task_result(task_id: str):
+    """任务结果被淘汰或过期后，幂等索引中的记录作废，之后相同的任务会重新执行而不是复用一个查不到结果的 task_id"""
+    task_index = get_task_index()
+    if task_index is None:
+        return
+    try:
+        task_index.invalidate(task_id)
+    except Exception as e:
+        logger.error(f"更新任务幂等索引失败，task_id: {task_id}, 错误: {e}")
+
+
+def store_task_result(task_id: str, result_data: Any):
+    """
+    保存任务结果，同时更新幂等索引的状态，并把结果复制给等待中的重复任务，推送给订阅这些任务的 WebSocket
+    （在 MQ 监听线程中调用，唤醒会转到主 event loop 中执行；协程中使用 store_task_result_async）
+    """
+    persist_task_result(task_id, result_data)
+    for follower_id in duplicate_followers.get(task_id, []):
+        task_results[follower_id] = result_data
+        subscriptions.resolve(follower_id)
+        if main_loop and main_loop.is_running():
+            main_loop.call_soon_threadsafe(settle_follower, follower_id, True)
+    subscriptions.resolve(task_id)
+
+
+async def store_task_result_async(task_id: str, result_data: Any):
+    """
+    在主 event loop 中保存任务结果：序列化、写磁盘和更新索引在线程池中执行。
+    返回时结果已经在内存中，之后的 attach_duplicate_task 能直接看到，不会再加入 duplicate_followers
+    """
+    await asyncio.to_thread(persist_task_result, task_id, result_data)
+    for follower_id in duplicate_followers.get(task_id, []):
+        await task_results.put_async(follower_id, result_data)
+        subscriptions.resolve(follower_id)
+        settle_follower(follower_id, True)
+    subscriptions.resolve(task_id)
+
+
+def settle_follower(task_id: str, stored: bool):
+    """重复任务的结果已经保存（stored=True）或者等待超时，完成它的 waiter（在主 event loop 中调用）"""
+    waiter = follower_waiters.pop(task_id, None)
+    if waiter is not None and not waiter.done():
+        waiter.set_result(stored)
+
+
+async def find_task_result(task_id: str) -> Any:
+    """
+    读取任务结果，没有时返回 None。
+    最后一次检查只看内存、没有 await，调用方拿到 None 后立即订阅（或加入 duplicate_followers），
+    不会漏掉读取磁盘期间刚好完成的任务
+    """
+    result = await task_results.get_async(task_id)
+    if result is None and task_results.in_memory(task_id):
+        result = await task_results.get_async(task_id)
+    return result
 
-manager = ConnectionManager()
 
 # 全局 event loop 引用，用于从后台线程安全地调度异步任务
 main_loop: asyncio.AbstractEventLoop = None
@@ -120,9 +197,10 @@ def get_rabbitmq_connection():
         raise
 
 
-def process_tool_request(tool_request: Dict[str, Any]):
+def process_tool_request(tool_request: Dict[str, Any]) -> Optional[concurrent.futures.Future]:
     """
     处理工具请求，调用对应的Agent或本地工具
+    返回调度到主 event loop 上的任务 Future；没有调度异步任务时返回 None
     """
     try:
         tool_name = tool_request.get("tool", {}).get("name")
@@ -130,11 +208,30 @@ def process_tool_request(tool_request: Dict[str, Any]):
         args = tool_request.get("tool", {}).get("args", {})
         
         logger.info(f"处理工具请求: {tool_name}, task_id: {task_id}")
-        
+
+        # 同一条消息被重复投递（outbox 至少一次投递），结果已经有了就不再执行
+        if task_id in task_results:
+            logger.info(f"任务 {task_id} 已有结果，忽略重复消息")
+            return
+
+        # 幂等：相同 (工具名, 参数) 的任务正在处理或者结果还在缓存中时，不再重复调用子 Agent（没有配置 TASK_INDEX_PATH 时不去重）
+        task_index = get_task_index()
+        if task_index is not None:
+            task_key = make_task_key(tool_name, args)
+            canonical_id, created = task_index.claim(task_key, task_id, tool_name)
+            if not created:
+                entry = task_index.lookup(task_key) or {}
+                if canonical_id in task_results or entry.get("status") == STATUS_PENDING:
+                    logger.info(f"任务 {task_id} 与 {canonical_id} 重复，复用其结果，不再调用 {tool_name}")
+                    if main_loop and main_loop.is_running():
+                        return asyncio.run_coroutine_threadsafe(attach_duplicate_task(task_id, canonical_id), main_loop)
+                # 索引中是已完成状态，但结果不在本进程中（例如服务重启过），重新执行并接管该 key
+                task_index.takeover(task_key, task_id, tool_name)
+
         # 翻译工具使用本地函数处理（直接查询 MongoDB）
         if tool_name == "translator":
             if main_loop and main_loop.is_running():
-                asyncio.run_coroutine_threadsafe(
+                return asyncio.run_coroutine_threadsafe(
                     call_translate_tool_async(task_id, args),
                     main_loop
                 )
@@ -146,7 +243,7 @@ def process_tool_request(tool_request: Dict[str, Any]):
                     "id": f"error_{uuid.uuid4().hex}",
                     "payload": {"message": "服务未完全启动，无法处理翻译任务"}
                 }
-                task_results[task_id] = error_result
+                store_task_result(task_id, error_result)
             return
         
         # 其他工具使用远程 Agent 处理
@@ -157,12 +254,12 @@ def process_tool_request(tool_request: Dict[str, Any]):
                 "id": f"error_{uuid.uuid4().hex}",
                 "payload": {"message": f"未知的工具类型: {tool_name}"}
             }
-            task_results[task_id] = error_result
+            store_task_result(task_id, error_result)
             return
         
         # 从后台线程安全地调度异步任务到主 event loop
         if main_loop and main_loop.is_running():
-            asyncio.run_coroutine_threadsafe(
+            return asyncio.run_coroutine_threadsafe(
                 call_agent_async(tool_name, task_id, args),
                 main_loop
             )
@@ -174,7 +271,7 @@ def process_tool_request(tool_request: Dict[str, Any]):
                 "id": f"error_{uuid.uuid4().hex}",
                 "payload": {"message": "服务未完全启动，无法处理任务"}
             }
-            task_results[task_id] = error_result
+            store_task_result(task_id, error_result)
         
     except Exception as e:
         logger.error(f"处理工具请求失败: {e}")
@@ -184,7 +281,47 @@ def process_tool_request(tool_request: Dict[str, Any]):
             "id": f"error_{uuid.uuid4().hex}", 
             "payload": {"message": f"处理请求失败: {str(e)}"}
         }
-        task_results[task_id] = error_result
+        store_task_result(task_id, error_result)
+
+
+async def notify_task_result(task_id: str):
+    """
+    任务结束后把结果推送给订阅的 WebSocket（包括等待复用该结果的重复任务）
+    """
+    for notify_id in [task_id] + duplicate_followers.pop(task_id, []):
+        subscriptions.resolve(notify_id)
+
+
+async def attach_duplicate_task(task_id: str, canonical_id: str) -> Optional[asyncio.Future]:
+    """
+    重复任务不再执行，直接复用 canonical_id 的结果（在主 event loop 中运行，避免和任务完成产生竞争）。
+    结果已经有了时复制后返回 None；否则加入 duplicate_followers，返回一个 future，
+    canonical 的结果复制给它之后结果为 True，等待超过 DUPLICATE_WAIT_TIMEOUT 秒结果为 False。
+    调用方（MQ 分发）记录后立即释放执行槽位并确认消息，future 结果为 False 时把消息重新发布到队列。
+    """
+    result = await find_task_result(canonical_id)
+    if result is not None:
+        await task_results.put_async(task_id, result)
+        await notify_task_result(task_id)
+        return None
+
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+    follower_waiters[task_id] = waiter
+    duplicate_followers.setdefault(canonical_id, []).append(task_id)
+
+    def on_timeout():
+        followers = duplicate_followers.get(canonical_id)
+        if followers and task_id in followers:
+            followers.remove(task_id)
+            if not followers:
+                del duplicate_followers[canonical_id]
+        logger.warning(f"重复任务 {task_id} 等待 {canonical_id} 的结果超时，消息重新发布到队列")
+        settle_follower(task_id, False)
+
+    timer = loop.call_later(DUPLICATE_WAIT_TIMEOUT, on_timeout)
+    waiter.add_done_callback(lambda _: timer.cancel())
+    return waiter
 
 
 async def call_translate_tool_async(task_id: str, args: Dict[str, Any]):
@@ -210,7 +347,7 @@ async def call_translate_tool_async(task_id: str, args: Dict[str, Any]):
             "paper_id": paper_id,
         }]
         
-        task_results[task_id] = result
+        await store_task_result_async(task_id, result)
         logger.info(f"翻译工具执行成功，paper_id: {paper_id}, 结果长度: {len(translation_text)}")
         
     except Exception as e:
@@ -221,18 +358,11 @@ async def call_translate_tool_async(task_id: str, args: Dict[str, Any]):
             "id": f"error_{uuid.uuid4().hex}",
             "payload": {"message": f"翻译失败: {str(e)}"}
         }
-        task_results[task_id] = error_result
+        await store_task_result_async(task_id, error_result)
     
     finally:
-        # 如果有 WebSocket 连接，通知结果已准备好
-        if task_id in manager.active_connections:
-            try:
-                result_data = task_results.get(task_id)
-                ws_message = build_ws_message(task_id, result_data)
-                logger.info(f"发送翻译结果 WebSocket 消息: {ws_message}")
-                await manager.send_personal_message(json.dumps(ws_message), task_id)
-            except Exception as e:
-                logger.error(f"通知 WebSocket 翻译结果失败: {e}")
+        # 如果有 WebSocket 连接，通知结果已准备好（包括复用该结果的重复任务）
+        await notify_task_result(task_id)
 
 
 def build_ws_message(task_id: str, result_data: Any) -> Dict[str, Any]:
@@ -297,6 +427,11 @@ def build_ws_message(task_id: str, result_data: Any) -> Dict[str, Any]:
     return ws_message
 
 
+async def build_task_message(task_id: str) -> str:
+    """任务结果的 WebSocket 消息文本，推送给多个订阅者时只序列化一次"""
+    return json.dumps(build_ws_message(task_id, await task_results.get_async(task_id)))
+
+
 async def call_agent_async(tool_name: str, task_id: str, args: Dict[str, Any]):
     """
     异步调用Agent
@@ -331,7 +466,7 @@ async def call_agent_async(tool_name: str, task_id: str, args: Dict[str, Any]):
             if jsoncard_match:
                 jsoncard_content = jsoncard_match.group(1)
                 parsed_result = json.loads(jsoncard_content)
-                task_results[task_id] = parsed_result
+                await store_task_result_async(task_id, parsed_result)
                 logger.info(f"Agent {tool_name} 执行成功，已缓存结果: {str(parsed_result)[:200]}...")
             else:
                 # 如果没有JSONCARD格式，包装成error
@@ -341,7 +476,7 @@ async def call_agent_async(tool_name: str, task_id: str, args: Dict[str, Any]):
                     "id": f"error_{uuid.uuid4().hex}",
                     "payload": {"message": f"Agent返回格式错误: {full_result[:200]}..."}
                 }
-                task_results[task_id] = error_result
+                await store_task_result_async(task_id, error_result)
         except json.JSONDecodeError as e:
             error_result = {
                 "type": "error", 
@@ -349,7 +484,7 @@ async def call_agent_async(tool_name: str, task_id: str, args: Dict[str, Any]):
                 "id": f"error_{uuid.uuid4().hex}",
                 "payload": {"message": f"解析Agent返回结果失败: {str(e)}"}
             }
-            task_results[task_id] = error_result
+            await store_task_result_async(task_id, error_result)
             
     except Exception as e:
         logger.error(f"调用Agent {tool_name} 失败: {e}")
@@ -359,49 +494,198 @@ async def call_agent_async(tool_name: str, task_id: str, args: Dict[str, Any]):
             "id": f"error_{uuid.uuid4().hex}",
             "payload": {"message": f"Agent调用失败: {str(e)}"}
         }
-        task_results[task_id] = error_result
+        await store_task_result_async(task_id, error_result)
     
     finally:
-        # 如果有WebSocket连接，通知结果已准备好
-        if task_id in manager.active_connections:
-            try:
-                result_data = task_results.get(task_id)
-                ws_message = build_ws_message(task_id, result_data)
-                
-                logger.info(f"发送WebSocket消息: {ws_message}")
-                await manager.send_personal_message(json.dumps(ws_message), task_id)
-            except Exception as e:
-                logger.error(f"通知WebSocket结果失败: {e}")
+        # 如果有 WebSocket 连接，通知结果已准备好（包括复用该结果的重复任务）
+        await notify_task_result(task_id)
+
+
+def decode_message(body: bytes) -> Optional[Dict[str, Any]]:
+    """解析 MQ 消息，不是合法的 JSON 对象时返回 None"""
+    try:
+        message = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def message_tool(message: Optional[Dict[str, Any]]) -> Optional[str]:
+    """tool_request 消息对应的工具名，用于按工具限制并发"""
+    if message and message.get("type") == "tool_request":
+        return (message.get("tool") or {}).get("name")
+    return None
+
+
+def settle_message(channel, delivery_tag: int, ok: bool):
+    """
+    确认或退回一条消息（只能在 MQ 监听线程中调用）。
+    任务执行完并保存结果后才确认；任务没有完成（例如服务退出时被取消）时重新入队，交给其它消费者执行。
+    连接已经断开时 broker 会重新投递，这里不需要处理。
+    """
+    if not channel.is_open:
+        return
+    if ok:
+        channel.basic_ack(delivery_tag)
+    else:
+        channel.basic_nack(delivery_tag, requeue=True)
+
+
+def republish_message(channel, routing_key: str, message: Dict[str, Any]):
+    """把消息重新发布到队列末尾（只能在 MQ 监听线程中调用）"""
+    if not channel.is_open:
+        logger.warning(f"MQ 通道已关闭，无法重新发布消息 {message.get('task_id')}")
+        return
+    channel.basic_publish(
+        exchange='',
+        routing_key=routing_key,
+        body=json.dumps(message, ensure_ascii=False),
+        properties=pika.BasicProperties(delivery_mode=2),
+    )
+
+
+def requeue_blocked_messages(channel, buffers: Dict[str, deque]):
+    """
+    槽位用完的工具在缓冲中最多保留与槽位数相同的消息，多出来的重新发布到队列末尾后确认。
+    缓冲中的消息没有确认，会占用 MQ_LANE_PREFETCH，全部留下时一批 ppt 任务就能占满预取窗口，同一通道中其它工具的消息收不到。
+    不用 basic_nack(requeue=True)：退回的消息回到队首，会立即重新投递回来，排在后面的其它工具的消息仍然收不到。
+    """
+    for lane, buf in buffers.items():
+        waiting: Dict[str, int] = {}
+        kept = deque()
+        for method_frame, message in buf:
+            tool = message_tool(message)
+            limit = tool_slots.limits.get(tool)
+            if limit is not None and not tool_slots.available(tool):
+                waiting[tool] = waiting.get(tool, 0) + 1
+                if waiting[tool] > limit:
+                    republish_message(channel, method_frame.routing_key, message)
+                    channel.basic_ack(method_frame.delivery_tag)
+                    continue
+            kept.append((method_frame, message))
+        if len(kept) != len(buf):
+            logger.info(f"通道 {lane} 中 {len(buf) - len(kept)} 条消息的工具没有空闲槽位，重新发布到队列末尾")
+            # 消费回调持有的是这个 deque 对象，原地替换内容
+            buf.clear()
+            buf.extend(kept)
+
+
+def dispatch_buffered_messages(connection, channel, buffers: Dict[str, deque], scheduler: WeightedLaneScheduler,
+                               inflight: threading.BoundedSemaphore) -> bool:
+    """
+    有空闲执行槽位时，按通道权重从本地缓冲中取消息分发执行，返回本轮是否分发了消息。
+    每个通道取第一条所属工具还有槽位的消息，工具槽位用完的消息留在缓冲中（超出槽位数的部分重新发布到队列），不阻塞其它工具。
+    """
+    dispatched = False
+    while any(buffers.values()):
+        ready: Dict[str, int] = {}
+        for priority, buf in buffers.items():
+            for index, (_, message) in enumerate(buf):
+                if tool_slots.available(message_tool(message)):
+                    ready[priority] = index
+                    break
+        if not ready or not inflight.acquire(blocking=False):
+            break
+        lane = scheduler.pick(list(ready))
+        method_frame, message = buffers[lane][ready[lane]]
+        del buffers[lane][ready[lane]]
+        tool = message_tool(message)
+        tool_slots.acquire(tool)
+        dispatched = True
+        future = None
+        try:
+            if message is None:
+                raise ValueError("消息不是合法的 JSON 对象")
+
+            # 检查是否是工具请求
+            if message.get("type") == "tool_request":
+                future = process_tool_request(message)
+
+            # 没有异步任务时结果已经保存（或者不需要处理），直接确认
+            if future is None:
+                channel.basic_ack(method_frame.delivery_tag)
+
+        except Exception as e:
+            logger.error(f"处理 MQ 消息时发生错误: {e}")
+            # 避免毒消息反复重试，不重新入队
+            channel.basic_nack(method_frame.delivery_tag, requeue=False)
+        finally:
+            if future is None:
+                tool_slots.release(tool)
+                inflight.release()
+            else:
+                future.add_done_callback(
+                    lambda f, frame=method_frame, msg=message, tool=tool: on_task_done(connection, channel, frame, msg, tool, inflight, f)
+                )
+    requeue_blocked_messages(channel, buffers)
+    return dispatched
+
+
+def on_task_done(connection, channel, method_frame, message: Dict[str, Any], tool: Optional[str],
+                 inflight: threading.BoundedSemaphore, future: concurrent.futures.Future):
+    """
+    异步任务结束（结果已经保存）后释放槽位，并转到 MQ 监听线程中确认消息（在主 event loop 中调用）。
+    重复任务（attach_duplicate_task 返回了 waiter）不占用 Agent，也不占用预取窗口：记录后立即释放槽位并确认，
+    等待超时（结果为 False）时把消息重新发布到队列
+    """
+    tool_slots.release(tool)
+    inflight.release()
+    ok = not future.cancelled() and future.exception() is None
+    waiter = future.result() if ok else None
+    settle_message_threadsafe(connection, channel, method_frame.delivery_tag, ok)
+    if isinstance(waiter, asyncio.Future):
+        def on_follower_settled(w: asyncio.Future):
+            if not w.cancelled() and not w.result():
+                run_in_mq_thread(connection, republish_message, channel, method_frame.routing_key, message)
+
+        waiter.add_done_callback(on_follower_settled)
+
+
+def settle_message_threadsafe(connection, channel, delivery_tag: int, ok: bool):
+    try:
+        connection.add_callback_threadsafe(functools.partial(settle_message, channel, delivery_tag, ok))
+    except Exception as e:
+        # 连接已经断开，未确认的消息会被 broker 重新投递（已有结果的任务会被忽略）
+        logger.warning(f"确认 MQ 消息失败，等待 broker 重新投递: {e}")
+
+
+def run_in_mq_thread(connection, func, *args):
+    try:
+        connection.add_callback_threadsafe(functools.partial(func, *args))
+    except Exception as e:
+        logger.warning(f"MQ 连接已断开，无法执行 {func.__name__}: {e}")
 
 
 def listen_to_question_queue():
     """
-    后台线程：持续监听 MQ 的工具请求
-    收到消息后，调用对应的Agent处理
+    后台线程：持续监听 MQ 的工具请求（interactive / bulk 两个通道）
+    收到的消息先放入各通道的本地缓冲，再按权重公平地分发给对应的Agent处理，
+    同时执行的任务数达到 MQ_MAX_INFLIGHT（或者某个工具达到 MQ_TOOL_CONCURRENCY）后暂停分发，让 interactive 的消息可以插队。
+    消息在任务结果保存之后才确认，服务崩溃时未完成的任务会被 broker 重新投递（至少一次）。
     """
+    scheduler = WeightedLaneScheduler(parse_lane_weights())
+    inflight = threading.BoundedSemaphore(MQ_MAX_INFLIGHT)
     while True:
         try:
             connection = get_rabbitmq_connection()
             channel = connection.channel()
-            channel.queue_declare(queue=QUEUE_NAME_WRITER, durable=True)
-
-            logger.info(f"开始监听 RabbitMQ 队列： {QUEUE_NAME_WRITER}")
-
-            for method_frame, properties, body in channel.consume(QUEUE_NAME_WRITER):
-                try:
-                    message = json.loads(body.decode('utf-8'))
-                    
-                    # 检查是否是工具请求
-                    if message.get("type") == "tool_request":
-                        process_tool_request(message)
-                    
-                    # 确认消费
-                    channel.basic_ack(method_frame.delivery_tag)
-                    
-                except Exception as e:
-                    logger.error(f"处理 MQ 消息时发生错误: {e}")
-                    # 避免毒消息反复重试，不重新入队
-                    channel.basic_nack(method_frame.delivery_tag, requeue=False)
+            # 每个消费者最多预取的未确认消息数（包括执行中的任务），避免 broker 把整个队列推到本地
+            channel.basic_qos(prefetch_count=MQ_LANE_PREFETCH)
+
+            buffers: Dict[str, deque] = {priority: deque() for priority in PRIORITIES}
+            for priority in PRIORITIES:
+                queue_name = lane_queue(QUEUE_NAME_WRITER, priority)
+                channel.queue_declare(queue=queue_name, durable=True)
+                channel.basic_consume(
+                    queue=queue_name,
+                    on_message_callback=lambda ch, method, properties, body, buf=buffers[priority]: buf.append((method, decode_message(body))),
+                )
+                logger.info(f"开始监听 RabbitMQ 队列： {queue_name}")
+
+            while True:
+                dispatched = dispatch_buffered_messages(connection, channel, buffers, scheduler, inflight)
+                # 刚分发过消息时不等待，尽快收取下一批；空闲时等待新消息或者执行槽位释放
+                connection.process_data_events(time_limit=0 if dispatched else 0.1)
 
         except (AMQPConnectionError, pika.exceptions.StreamLostError) as e:
             logger.error(f"RabbitMQ 连接错误: {e}. 5秒后尝试重连...")
@@ -500,6 +784,7 @@ async def startup_event():
     """启动时初始化 event loop 引用并开启 RabbitMQ 监听线程"""
     global main_loop
     main_loop = asyncio.get_running_loop()
+    subscriptions.bind(main_loop)
     logger.info(f"主 event loop 已初始化: {main_loop}")
     listener_thread = threading.Thread(target=listen_to_question_queue, daemon=True)
     listener_thread.start()
@@ -512,48 +797,134 @@ async def websocket_endpoint(websocket: WebSocket, task_id: str):
     WebSocket 主入口。
     前端通过task_id连接，获取任务状态和结果
     """
-    await manager.connect(websocket, task_id)
-    
+    await websocket.accept()
+    subscriber = None
+    receiver = None
+
     try:
         logger.info(f"WebSocket连接建立，task_id: {task_id}")
         
         # 如果任务已完成，立即发送结果并退出
-        if task_id in task_results:
-            result = task_results[task_id]
+        result = await find_task_result(task_id)
+        if result is not None:
             logger.info(f"任务已完成，立即发送结果: task_id={task_id}")
             
             ws_message = build_ws_message(task_id, result)
             await websocket.send_json(ws_message)
             return  # 发送后直接退出
-        
-        # 保持连接直到任务完成或连接断开
-        while task_id in manager.active_connections:
+
+        # 订阅任务结果（同一个任务可以有多个连接），find_task_result 的最后一次检查和订阅之间没有 await，不会漏掉结果
+        subscriber = subscriptions.subscribe(task_id, websocket.send_text)
+
+        # 保持连接直到结果推送完成或连接断开，期间没有消息时不会被唤醒
+        receiver = asyncio.ensure_future(websocket.receive_text())
+        while True:
+            await asyncio.wait({subscriber.delivered, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if subscriber.delivered.done():
+                logger.info(f"任务结果已推送: task_id={task_id}, 成功: {subscriber.delivered.result()}")
+                break
             try:
-                # 等待消息或超时
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=1.0)
-                
-                # 处理前端消息（可选）
-                if data == "ping":
-                    await websocket.send_text("pong")
-                    
-            except asyncio.TimeoutError:
-                # 检查任务是否完成
-                if task_id in task_results:
-                    result = task_results[task_id]
-                    ws_message = build_ws_message(task_id, result)
-                    await websocket.send_json(ws_message)
-                    break
-                continue
+                data = receiver.result()
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 logger.error(f"WebSocket接收消息错误: {e}")
                 break
+            # 处理前端消息（可选）
+            if data == "ping":
+                await websocket.send_text("pong")
+            receiver = asyncio.ensure_future(websocket.receive_text())
                 
     except WebSocketDisconnect:
         logger.info(f"WebSocket连接断开，task_id: {task_id}")
     except Exception as e:
         logger.error(f"WebSocket发生异常: {e}")
     finally:
-        manager.disconnect(task_id)
+        if receiver is not None and not receiver.done():
+            receiver.cancel()
+        if subscriber is not None:
+            subscriptions.unsubscribe(task_id, subscriber)
+        logger.info(f"WebSocket连接关闭，task_id: {task_id}")
+
+
+@app.websocket("/ws")
+async def multiplexed_websocket_endpoint(websocket: WebSocket):
+    """
+    多路复用的 WebSocket：一个连接订阅多个任务，结果消息中带 task_id。
+    前端发送的控制消息：
+      {"action": "subscribe", "task_ids": [...]}    已经完成的任务立即返回结果，其余任务完成时推送
+      {"action": "unsubscribe", "task_ids": [...]}
+      "ping"                                        返回 "pong"
+    """
+    await websocket.accept()
+    subscribed: Dict[str, Any] = {}
+    send_lock = asyncio.Lock()
+    closing = False
+
+    async def send(text: str):
+        # 多个任务的结果可能同时推送，同一个连接上按顺序发送
+        async with send_lock:
+            await websocket.send_text(text)
+
+    def on_delivered(task_id: str, subscriber):
+        def callback(future: asyncio.Future):
+            nonlocal closing
+            if subscribed.get(task_id) is subscriber:
+                del subscribed[task_id]
+            if not future.result() and not closing:
+                # 推送超时或失败，说明连接已经不可用，关闭连接（前端重连后重新订阅）
+                closing = True
+                asyncio.ensure_future(websocket.close(code=1011))
+        return callback
+
+    async def subscribe(task_ids: List[str]):
+        for task_id in task_ids:
+            if task_id in subscribed:
+                continue
+            result = await find_task_result(task_id)
+            if result is not None:
+                await send(json.dumps(build_ws_message(task_id, result)))
+                continue
+            if len(subscribed) >= WS_MAX_SUBSCRIPTIONS:
+                await send(json.dumps({"task_id": task_id, "error": f"每个连接最多订阅 {WS_MAX_SUBSCRIPTIONS} 个任务"}))
+                continue
+            # find_task_result 的最后一次检查和订阅之间没有 await，不会漏掉结果
+            subscriber = subscriptions.subscribe(task_id, send)
+            subscriber.delivered.add_done_callback(on_delivered(task_id, subscriber))
+            subscribed[task_id] = subscriber
+
+    try:
+        logger.info("多路复用 WebSocket 连接建立")
+        while True:
+            data = await websocket.receive_text()
+            if data == "ping":
+                await send("pong")
+                continue
+            try:
+                frame = json.loads(data)
+                action = frame.get("action")
+                task_ids = [str(task_id) for task_id in frame.get("task_ids", [])]
+            except (ValueError, AttributeError, TypeError):
+                await send(json.dumps({"error": f"无法解析的消息: {data[:100]}"}))
+                continue
+            if action == "subscribe":
+                await subscribe(task_ids)
+            elif action == "unsubscribe":
+                for task_id in task_ids:
+                    subscriber = subscribed.pop(task_id, None)
+                    if subscriber is not None:
+                        subscriptions.unsubscribe(task_id, subscriber)
+            else:
+                await send(json.dumps({"error": f"未知的 action: {action}"}))
+
+    except WebSocketDisconnect:
+        logger.info(f"多路复用 WebSocket 连接断开，订阅中的任务: {len(subscribed)}")
+    except Exception as e:
+        logger.error(f"多路复用 WebSocket 发生异常: {e}")
+    finally:
+        for task_id, subscriber in list(subscribed.items()):
+            subscriptions.unsubscribe(task_id, subscriber)
+        subscribed.clear()
 
 
 @app.get("/task/{task_id}")
@@ -561,11 +932,12 @@ async def get_task_status(task_id: str):
     """
     HTTP接口：获取任务状态和结果
     """
-    if task_id in task_results:
+    result = await task_results.get_async(task_id)
+    if result is not None:
         return {
             "task_id": task_id,
             "status": "done",
-            "result": task_results[task_id]
+            "result": result
         }
     else:
         return {
@@ -581,7 +953,11 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.datetime.now().isoformat(),
-        "active_tasks": len(task_results)
+        "active_tasks": len(task_results),
+        "results": task_results.stats(),
+        "waiting_duplicates": len(follower_waiters),
+        "tool_slots": tool_slots.stats(),
+        "subscriptions": subscriptions.stats(),
     }
 
 
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 15:20
+# @File  : mq_lanes.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : tool_request 优先级通道：interactive / bulk 两条队列 + 加权公平调度，以及每个工具的并发上限
+
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 优先级：用户对话中触发的任务走 interactive，批量任务走 bulk
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+# 各通道的调度权重，两个通道都有消息时按权重比例取消息，bulk 不会被饿死
+MQ_LANE_WEIGHTS = os.getenv("MQ_LANE_WEIGHTS", "interactive:4,bulk:1")
+# 每个工具同时执行的任务数上限，未列出的工具只受 MQ_MAX_INFLIGHT 限制
+MQ_TOOL_CONCURRENCY = os.getenv("MQ_TOOL_CONCURRENCY", "translator:4,ppt_generator:2")
+
+
+def lane_queue(base_queue: str, priority: Optional[str]) -> str:
+    """
+    通道对应的队列名：interactive 沿用原来的队列（兼容旧的生产者），bulk 使用 <队列名>.bulk
+    """
+    if priority == PRIORITY_BULK:
+        return f"{base_queue}.{PRIORITY_BULK}"
+    return base_queue
+
+
+def parse_lane_weights(spec: str = MQ_LANE_WEIGHTS) -> Dict[str, int]:
+    """解析 "interactive:4,bulk:1" 形式的权重配置，非法或缺失的通道权重为 1"""
+    weights = {priority: 1 for priority in PRIORITIES}
+    for item in spec.split(","):
+        name, _, value = item.partition(":")
+        name = name.strip()
+        if name not in weights:
+            continue
+        try:
+            weights[name] = max(1, int(value))
+        except ValueError:
+            logger.warning(f"MQ_LANE_WEIGHTS 中 {item} 的权重不是整数，使用默认值 1")
+    return weights
+
+
+class WeightedLaneScheduler:
+    """
+    平滑加权轮询(smooth weighted round-robin)：
+    每次只在有待处理消息的通道之间选择，权重高的通道被选中的次数多，
+    但只要 bulk 有消息，每一轮都至少会轮到一次。
+    """
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = dict(weights)
+        self._current = {lane: 0 for lane in self.weights}
+
+    def pick(self, ready_lanes: Iterable[str]) -> Optional[str]:
+        ready = [lane for lane in ready_lanes if lane in self.weights]
+        if not ready:
+            return None
+        total = 0
+        best = None
+        for lane in ready:
+            self._current[lane] += self.weights[lane]
+            total += self.weights[lane]
+            if best is None or self._current[lane] > self._current[best]:
+                best = lane
+        self._current[best] -= total
+        return best
+
+
+def parse_tool_concurrency(spec: str = MQ_TOOL_CONCURRENCY) -> Dict[str, int]:
+    """解析 "translator:4,ppt_generator:2" 形式的并发配置"""
+    limits = {}
+    for item in spec.split(","):
+        name, _, value = item.partition(":")
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            limits[name] = max(1, int(value))
+        except ValueError:
+            logger.warning(f"MQ_TOOL_CONCURRENCY 中 {item} 的并发数不是整数，忽略")
+    return limits
+
+
+class ToolSlots:
+    """
+    每个工具的执行槽位：MQ 监听线程分发消息前检查并占用槽位，任务结束时（在主 event loop 中）释放。
+    某个工具的槽位用完时，该工具最多有槽位数条消息留在本地缓冲（未确认），多出来的重新发布到队列，其它工具的消息照常分发。
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = dict(limits)
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def available(self, tool: Optional[str]) -> bool:
+        limit = self.limits.get(tool)
+        if limit is None:
+            return True
+        with self._lock:
+            return self._active.get(tool, 0) < limit
+
+    def acquire(self, tool: Optional[str]):
+        with self._lock:
+            self._active[tool] = self._active.get(tool, 0) + 1
+
+    def release(self, tool: Optional[str]):
+        with self._lock:
+            self._active[tool] = max(0, self._active.get(tool, 0) - 1)
+
+    def stats(self) -> Dict[str, Dict[str, Optional[int]]]:
+        with self._lock:
+            return {str(tool): {"active": active, "limit": self.limits.get(tool)}
+                    for tool, active in self._active.items() if tool is not None}
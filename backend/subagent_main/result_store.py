@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 03:00
+# @File  : result_store.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 任务结果存储：按总字节数预算 + 过期时间 + LRU 淘汰，大结果在内存中压缩保存，可选 SQLite 磁盘层（重启后仍可查询）
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 内存中所有结果的字节数上限（序列化/压缩后的大小）
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", 256 * 1024 * 1024))
+# 结果保存多少秒（内存和磁盘都按这个时间过期）
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", 24 * 3600))
+# 序列化后超过多少字节的结果压缩保存
+RESULT_STORE_COMPRESS_MIN = int(os.getenv("RESULT_STORE_COMPRESS_MIN", 4096))
+# 磁盘层(SQLite)文件路径，为空时不启用（重启后结果丢失）
+RESULT_STORE_DB_PATH = os.getenv("RESULT_STORE_DB_PATH", "")
+
+# 内存中的条目：(数据, 是否压缩, 过期时间)
+Entry = Tuple[bytes, bool, float]
+
+
+def encode_result(result: Any) -> Tuple[bytes, bool]:
+    data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+    if len(data) >= RESULT_STORE_COMPRESS_MIN:
+        return zlib.compress(data), True
+    return data, False
+
+
+def decode_result(data: bytes, compressed: bool) -> Any:
+    return json.loads(zlib.decompress(data) if compressed else data)
+
+
+class ResultDiskTier:
+    """任务结果的 SQLite(WAL) 存储"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS task_results (
+                task_id     TEXT PRIMARY KEY,
+                data        BLOB NOT NULL,
+                compressed  INTEGER NOT NULL,
+                expires_at  REAL NOT NULL
+            )
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, task_id: str, entry: Entry):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO task_results (task_id, data, compressed, expires_at) VALUES (?, ?, ?, ?)",
+            (task_id, entry[0], int(entry[1]), entry[2]),
+        )
+
+    def get(self, task_id: str) -> Optional[Entry]:
+        row = self._conn().execute(
+            "SELECT data, compressed, expires_at FROM task_results WHERE task_id = ? AND expires_at > ?",
+            (task_id, time.time()),
+        ).fetchone()
+        return (row[0], bool(row[1]), row[2]) if row else None
+
+    def purge(self) -> List[str]:
+        """删除过期的结果，返回被删除的 task_id"""
+        conn = self._conn()
+        now = time.time()
+        task_ids = [row[0] for row in conn.execute("SELECT task_id FROM task_results WHERE expires_at <= ?", (now,))]
+        conn.execute("DELETE FROM task_results WHERE expires_at <= ?", (now,))
+        return task_ids
+
+
+class ResultStore:
+    """
+    替代原来只增不减的 task_results 字典，用法和字典相同（in / [] / get / len）：
+    - 结果序列化成 JSON 保存，超过 compress_min 字节的压缩保存，读取时再解析；
+    - 内存中的结果总字节数超过 max_bytes 时按 LRU 淘汰，超过 ttl 秒的结果过期；
+    - 配置了 db_path 时同时写入 SQLite，内存中淘汰的结果（以及重启之前的结果）从磁盘读取后放回内存；
+    - 结果彻底丢失（没有磁盘层时被淘汰，或者过期）时调用 on_evict(task_id)；
+    - MQ 监听线程和主 event loop 都会访问，用锁保护。
+    同步接口可能读写磁盘、压缩/解压，只在后台线程中使用；event loop 中使用 get_async / put_async。
+    """
+
+    def __init__(self, max_bytes: int = RESULT_STORE_MAX_BYTES, ttl: float = RESULT_STORE_TTL,
+                 db_path: str = RESULT_STORE_DB_PATH, on_evict: Optional[Callable[[str], None]] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.disk = ResultDiskTier(db_path) if db_path else None
+        self.evicted = 0
+        self.expired = 0
+        self.disk_hits = 0
+        self._last_purge = 0.0
+
+    def _pop(self, task_id: str) -> Optional[Entry]:
+        entry = self._entries.pop(task_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+        return entry
+
+    def _insert(self, task_id: str, entry: Entry) -> List[str]:
+        """放入内存，返回被 LRU 淘汰的 task_id"""
+        self._pop(task_id)
+        self._entries[task_id] = entry
+        self._bytes += len(entry[0])
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            evicted_id = next(iter(self._entries))
+            self._pop(evicted_id)
+            evicted.append(evicted_id)
+            self.evicted += 1
+        return evicted
+
+    def _forget(self, task_ids: List[str]):
+        """结果已经不在任何一层中，通知调用方（在锁外调用）"""
+        if self.on_evict is None:
+            return
+        for task_id in task_ids:
+            try:
+                self.on_evict(task_id)
+            except Exception as e:
+                logger.error(f"处理被淘汰的任务结果失败，task_id: {task_id}, 错误: {e}")
+
+    def _lookup(self, task_id: str) -> Optional[Entry]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(task_id)
+                    return entry
+                self._pop(task_id)
+                self.expired += 1
+        if entry is not None:
+            # 磁盘上的过期时间相同，也已经过期
+            self._forget([task_id])
+        if self.disk is None:
+            return None
+        entry = self.disk.get(task_id)
+        if entry is None:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            # 从磁盘放回内存时挤出去的结果仍然在磁盘上
+            self._insert(task_id, entry)
+        return entry
+
+    def put(self, task_id: str, result: Any):
+        data, compressed = encode_result(result)
+        now = time.time()
+        entry = (data, compressed, now + self.ttl)
+        with self._lock:
+            evicted = self._insert(task_id, entry)
+        if self.disk is None:
+            self._forget(evicted)
+            return
+        try:
+            self.disk.put(task_id, entry)
+            # 每小时清理一次磁盘上过期的结果
+            if now - self._last_purge > 3600:
+                self._last_purge = now
+                self._forget(self.disk.purge())
+        except Exception as e:
+            logger.error(f"任务结果写入磁盘失败，task_id: {task_id}, 错误: {e}")
+
+    __setitem__ = put
+
+    def __getitem__(self, task_id: str) -> Any:
+        entry = self._lookup(task_id)
+        if entry is None:
+            raise KeyError(task_id)
+        return decode_result(entry[0], entry[1])
+
+    def __contains__(self, task_id: str) -> bool:
+        return self._lookup(task_id) is not None
+
+    def get(self, task_id: str, default: Any = None) -> Any:
+        entry = self._lookup(task_id)
+        return default if entry is None else decode_result(entry[0], entry[1])
+
+    def in_memory(self, task_id: str) -> bool:
+        """只检查内存（不读磁盘、不解压），可以在 event loop 中调用"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            return entry is not None and entry[2] > time.time()
+
+    async def get_async(self, task_id: str, default: Any = None) -> Any:
+        """内存中未压缩的结果直接返回，否则在线程池中读取（可能读磁盘、解压）"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and not entry[1] and entry[2] > time.time():
+                self._entries.move_to_end(task_id)
+            else:
+                entry = None
+        if entry is not None:
+            return decode_result(entry[0], entry[1])
+        return await asyncio.to_thread(self.get, task_id, default)
+
+    async def put_async(self, task_id: str, result: Any):
+        """序列化、压缩和写磁盘在线程池中执行，返回时结果已经在内存中"""
+        await asyncio.to_thread(self.put, task_id, result)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "results": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "disk_hits": self.disk_hits,
+            "db_path": self.disk.path if self.disk else None,
+        }
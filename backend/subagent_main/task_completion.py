@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/18 02:10
+# @File  : task_completion.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 任务完成通知：一个任务可以有多个订阅者（多个标签页/设备），任务完成时结果只序列化一次，并发推送给所有订阅者
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 推送给单个订阅者的超时时间(秒)，超时的订阅者不会拖慢其它订阅者
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 5))
+
+
+class Subscriber:
+    """
+    一个等待任务结果的连接：send 发送文本消息，delivered 在结果推送完成后被设置（True 成功，False 失败或超时）
+    """
+    __slots__ = ("send", "delivered")
+
+    def __init__(self, send: Callable[[str], Awaitable[None]]):
+        self.send = send
+        self.delivered: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class SubscriptionHub:
+    """
+    task_id -> 订阅者集合。
+    - subscribe(task_id, send): 在主 event loop 中调用；调用方在订阅之前检查 task_results，已经完成的任务直接发送；
+    - resolve(task_id): 任务结果保存后调用，可以在后台线程（MQ 监听线程）中调用，会转到主 event loop 中执行；
+      取出该任务的所有订阅者，await build_message(task_id) 只调用一次，并发推送，每个订阅者最多等待 send_timeout 秒；
+    - unsubscribe(task_id, subscriber): 订阅者退出（连接断开）时移除。
+    """
+
+    def __init__(self, build_message: Callable[[str], Awaitable[str]], send_timeout: float = WS_SEND_TIMEOUT):
+        self.build_message = build_message
+        self.send_timeout = send_timeout
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._background = set()
+        self.broadcasts = 0
+        self.send_failures = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self, task_id: str, send: Callable[[str], Awaitable[None]]) -> Subscriber:
+        subscriber = Subscriber(send)
+        self._subscribers.setdefault(task_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, task_id: str, subscriber: Subscriber):
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[task_id]
+
+    def resolve(self, task_id: str):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self._loop:
+            self._resolve(task_id)
+        elif self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._resolve, task_id)
+
+    def _resolve(self, task_id: str):
+        subscribers = self._subscribers.pop(task_id, None)
+        if not subscribers:
+            return
+        task = asyncio.create_task(self._broadcast(task_id, subscribers))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _broadcast(self, task_id: str, subscribers: Set[Subscriber]):
+        self.broadcasts += 1
+        try:
+            message = await self.build_message(task_id)
+        except Exception as e:
+            logger.error(f"构建任务 {task_id} 的结果消息失败: {e}")
+            for subscriber in subscribers:
+                if not subscriber.delivered.done():
+                    subscriber.delivered.set_result(False)
+            return
+        logger.info(f"推送任务 {task_id} 的结果给 {len(subscribers)} 个订阅者")
+        await asyncio.gather(*(self._send(task_id, subscriber, message) for subscriber in subscribers))
+
+    async def _send(self, task_id: str, subscriber: Subscriber, message: str):
+        ok = False
+        try:
+            await asyncio.wait_for(subscriber.send(message), timeout=self.send_timeout)
+            ok = True
+        except asyncio.TimeoutError:
+            self.send_failures += 1
+            logger.warning(f"推送任务 {task_id} 的结果超时({self.send_timeout}s)，断开该订阅者")
+        except Exception as e:
+            self.send_failures += 1
+            logger.error(f"推送任务 {task_id} 的结果失败: {e}")
+        if not subscriber.delivered.done():
+            subscriber.delivered.set_result(ok)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribed_tasks": len(self._subscribers),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "broadcasts": self.broadcasts,
+            "send_failures": self.send_failures,
+        }
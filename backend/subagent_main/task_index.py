@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/17 13:40
+# @File  : task_index.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : 长任务幂等索引：(工具名, 规范化参数) -> task_id，search_agent 和 subagent_main 共用
+# search_agent 和 subagent_main 中各有一份相同的 task_index.py（每个服务以自己的目录作为 Docker 构建上下文，不能跨目录共用模块），修改时两份保持一致
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 两个服务需要指向同一个文件（docker 部署时挂载同一个 volume），为空时不做任务去重（各自一份索引会互相不一致）
+TASK_INDEX_PATH = os.getenv("TASK_INDEX_PATH", "")
+# 处理中的任务超过该时间(秒)仍未完成，认为已经丢失，允许重新提交
+TASK_INDEX_PENDING_TTL = int(os.getenv("TASK_INDEX_PENDING_TTL", 3600))
+# 已完成任务的复用时间(秒)
+TASK_INDEX_DONE_TTL = int(os.getenv("TASK_INDEX_DONE_TTL", 24 * 3600))
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def canonical_args(args: Dict[str, Any]) -> str:
+    """把参数规范化成稳定的字符串：去掉空值、统一成字符串并去掉首尾空白、按 key 排序"""
+    normalized = {}
+    for key, value in (args or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, (int, float, str)):
+            value = str(value).strip()
+            if not value:
+                continue
+        normalized[key] = value
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def make_task_key(tool_name: str, args: Dict[str, Any]) -> str:
+    """幂等键：sha1(工具名 + 规范化参数)"""
+    raw = f"{tool_name}|{canonical_args(args)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class TaskIndex:
+    """
+    基于 SQLite(WAL) 的共享幂等索引，多进程可同时读写。
+    - claim(): 提交任务前调用，已有处理中/已完成的相同任务时返回已有的 task_id；
+    - mark(): 任务结束后更新状态，失败的任务允许重新提交。
+    """
+
+    def __init__(self, path: str = TASK_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS task_index (
+                task_key   TEXT PRIMARY KEY,
+                task_id    TEXT NOT NULL,
+                tool_name  TEXT NOT NULL,
+                status     TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_task_index_task_id ON task_index(task_id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程一个连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _is_reusable(self, status: str, updated_at: float, now: float) -> bool:
+        if status == STATUS_PENDING:
+            return now - updated_at < TASK_INDEX_PENDING_TTL
+        if status == STATUS_DONE:
+            return now - updated_at < TASK_INDEX_DONE_TTL
+        return False
+
+    def claim(self, task_key: str, task_id: str, tool_name: str, reuse_done: bool = True) -> Tuple[str, bool]:
+        """
+        尝试用 task_id 占用 task_key。
+        返回 (生效的 task_id, 是否为新任务)：已有可复用的任务时返回已有的 task_id 和 False。
+        reuse_done=False 时只复用处理中的任务：生产者无法确认已完成任务的结果是否还在（可能已被淘汰或者服务重启过），
+        这时返回 (task_id, True) 并保留原记录，由消费者(subagent_main) 检查结果后决定复用还是接管。
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT task_id, status, updated_at FROM task_index WHERE task_key = ?", (task_key,)
+            ).fetchone()
+            if row is not None:
+                existing_id, status, updated_at = row
+                if existing_id == task_id:
+                    conn.execute("COMMIT")
+                    return task_id, True
+                if self._is_reusable(status, updated_at, now):
+                    conn.execute("COMMIT")
+                    if status == STATUS_DONE and not reuse_done:
+                        return task_id, True
+                    return existing_id, False
+            self._upsert(conn, task_key, task_id, tool_name, now)
+            conn.execute("COMMIT")
+            return task_id, True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def takeover(self, task_key: str, task_id: str, tool_name: str):
+        """无条件让 task_id 占用 task_key（已有记录的结果不可用时重新执行）"""
+        self._upsert(self._conn(), task_key, task_id, tool_name, time.time())
+
+    @staticmethod
+    def _upsert(conn: sqlite3.Connection, task_key: str, task_id: str, tool_name: str, now: float):
+        conn.execute(
+            """
+            INSERT INTO task_index (task_key, task_id, tool_name, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_key) DO UPDATE SET
+                task_id = excluded.task_id, tool_name = excluded.tool_name, status = excluded.status,
+                created_at = excluded.created_at, updated_at = excluded.updated_at
+            """,
+            (task_key, task_id, tool_name, STATUS_PENDING, now, now),
+        )
+
+    def lookup(self, task_key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT task_id, tool_name, status, created_at, updated_at FROM task_index WHERE task_key = ?",
+            (task_key,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("task_id", "tool_name", "status", "created_at", "updated_at"), row))
+
+    def mark(self, task_id: str, status: str):
+        """更新任务状态（按 task_id），其它 task_id 占用了同一个 key 时不受影响"""
+        self._conn().execute(
+            "UPDATE task_index SET status = ?, updated_at = ? WHERE task_id = ?",
+            (status, time.time(), task_id),
+        )
+
+    def invalidate(self, task_id: str):
+        """task_id 的结果已经不存在（被淘汰或过期），删除它的已完成记录，相同的任务会重新执行"""
+        self._conn().execute(
+            "DELETE FROM task_index WHERE task_id = ? AND status = ?", (task_id, STATUS_DONE)
+        )
+
+    def purge(self):
+        """删除过期记录"""
+        now = time.time()
+        self._conn().execute(
+            "DELETE FROM task_index WHERE (status = ? AND updated_at < ?) OR (status = ? AND updated_at < ?) OR status = ?",
+            (STATUS_PENDING, now - TASK_INDEX_PENDING_TTL, STATUS_DONE, now - TASK_INDEX_DONE_TTL, STATUS_FAILED),
+        )
+
+
+_task_index: Optional[TaskIndex] = None
+_task_index_lock = threading.Lock()
+_task_index_checked = False
+
+
+def get_task_index() -> Optional[TaskIndex]:
+    """返回进程级单例，没有配置 TASK_INDEX_PATH 时返回 None（不做任务去重）"""
+    global _task_index, _task_index_checked
+    if not _task_index_checked:
+        with _task_index_lock:
+            if not _task_index_checked:
+                if TASK_INDEX_PATH:
+                    _task_index = TaskIndex(TASK_INDEX_PATH)
+                    logger.info(f"任务幂等索引: {_task_index.path}")
+                else:
+                    logger.warning("未配置 TASK_INDEX_PATH，长任务不做去重")
+                _task_index_checked = True
+    return _task_index
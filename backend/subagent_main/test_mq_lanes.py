@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Date  : 2026/10/19 11:40
+# @File  : test_mq_lanes.py
+# @Author: johnson
+# @Contact : github: johnson7788
+# @Desc  : mq_lanes 的单元测试：通道权重调度、配置解析和工具槽位
+
+import unittest
+from collections import Counter
+
+from mq_lanes import (PRIORITY_BULK, PRIORITY_INTERACTIVE, ToolSlots, WeightedLaneScheduler, lane_queue,
+                      parse_lane_weights, parse_tool_concurrency)
+
+
+class LaneSchedulerTest(unittest.TestCase):
+
+    def test_picks_follow_weights(self):
+        scheduler = WeightedLaneScheduler({PRIORITY_INTERACTIVE: 4, PRIORITY_BULK: 1})
+        picks = [scheduler.pick([PRIORITY_INTERACTIVE, PRIORITY_BULK]) for _ in range(50)]
+        self.assertEqual(Counter(picks), {PRIORITY_INTERACTIVE: 40, PRIORITY_BULK: 10})
+        # 每一轮(5 次)内 bulk 至少出现一次，不会被饿死
+        for start in range(0, 50, 5):
+            self.assertIn(PRIORITY_BULK, picks[start:start + 5])
+
+    def test_only_ready_lanes_are_picked(self):
+        scheduler = WeightedLaneScheduler({PRIORITY_INTERACTIVE: 4, PRIORITY_BULK: 1})
+        self.assertEqual({scheduler.pick([PRIORITY_BULK]) for _ in range(5)}, {PRIORITY_BULK})
+        self.assertIsNone(scheduler.pick([]))
+        self.assertIsNone(scheduler.pick(["unknown"]))
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_lane_weights(self):
+        self.assertEqual(parse_lane_weights("interactive:3,bulk:x,other:5"),
+                         {PRIORITY_INTERACTIVE: 3, PRIORITY_BULK: 1})
+        self.assertEqual(parse_lane_weights("bulk:0"), {PRIORITY_INTERACTIVE: 1, PRIORITY_BULK: 1})
+
+    def test_tool_concurrency(self):
+        self.assertEqual(parse_tool_concurrency("translator:4, ppt_generator:2,bad:x,"),
+                         {"translator": 4, "ppt_generator": 2})
+
+    def test_lane_queue(self):
+        self.assertEqual(lane_queue("q", PRIORITY_BULK), "q.bulk")
+        self.assertEqual(lane_queue("q", PRIORITY_INTERACTIVE), "q")
+        self.assertEqual(lane_queue("q", None), "q")
+
+
+class ToolSlotsTest(unittest.TestCase):
+
+    def test_limit_per_tool(self):
+        slots = ToolSlots({"ppt_generator": 2})
+        for _ in range(2):
+            self.assertTrue(slots.available("ppt_generator"))
+            slots.acquire("ppt_generator")
+        self.assertFalse(slots.available("ppt_generator"))
+        # 没有配置上限的工具不受限制
+        self.assertTrue(slots.available("translator"))
+        slots.release("ppt_generator")
+        self.assertTrue(slots.available("ppt_generator"))
+        self.assertEqual(slots.stats()["ppt_generator"], {"active": 1, "limit": 2})
+
+    def test_release_never_goes_negative(self):
+        slots = ToolSlots({"ppt_generator": 1})
+        slots.release("ppt_generator")
+        slots.acquire("ppt_generator")
+        self.assertFalse(slots.available("ppt_generator"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,7 +22,7 @@ export async function POST(req: Request) {
   try {
     console.log('开始发送请求进行搜索');
     const body = await req.json();
-    const { message, history = [], search_result = [] } = body;
+    const { message, history = [], search_result = [], session_id = '', history_len } = body;
 
     const backendUrl = process.env.NEXT_PUBLIC_API_URL;
     if (!backendUrl) {
@@ -34,19 +34,31 @@ export async function POST(req: Request) {
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ message, history, search_result }),
+      body: JSON.stringify({ message, history, search_result, session_id, history_len }),
+      // 浏览器断开时同时断开到后端的请求，后端会取消 search agent 上的任务
+      signal: req.signal,
     });
 
+    // 后端没有保存这个对话，由前端重新发送完整历史
+    if (response.status === 409) {
+      return NextResponse.json(await response.json(), { status: 409 });
+    }
+
     if (!response.body) {
       return NextResponse.json({ error: 'Backend response has no body' }, { status: 500 });
     }
 
     const readableStream = new ReadableStream({
       async start(controller) {
-        for await (const chunk of streamToIterator(response.body!)) {
-          controller.enqueue(new TextEncoder().encode(chunk));
+        try {
+          for await (const chunk of streamToIterator(response.body!)) {
+            controller.enqueue(new TextEncoder().encode(chunk));
+          }
+          controller.close();
+        } catch (error) {
+          // 客户端已断开（请求被 abort），不需要再输出
+          console.log('Search stream aborted:', (error as Error).message);
         }
-        controller.close();
       },
     });
 
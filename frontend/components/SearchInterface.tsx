@@ -17,6 +17,8 @@ export const SearchInterface: React.FC = () => {
     return false;
   });
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // 会话 id：同一个对话保持不变，后端用它把请求路由到同一个 search agent 节点并复用会话
+  const sessionIdRef = useRef<string>(`${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`);
 
   const toggleDebugMode = () => {
     const newValue = !isDebugMode;
@@ -62,16 +64,27 @@ export const SearchInterface: React.FC = () => {
           content: msg.content
         }));
 
-      const response = await fetch('/api/search/stream', {
+      // 后端保存了对话时只发送新消息和本地历史条数；后端没有这个对话（返回 409）时再发送完整的历史和搜索结果
+      const sendSearch = (fullHistory: boolean) => fetch('/api/search/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ 
+        body: JSON.stringify(fullHistory ? {
           message: userMessage.content,
           history: historyMessages,
-          search_result: searchResult
+          search_result: searchResult,
+          session_id: sessionIdRef.current
+        } : {
+          message: userMessage.content,
+          history_len: historyMessages.length,
+          session_id: sessionIdRef.current
         }),
       });
 
+      let response = await sendSearch(false);
+      if (response.status === 409) {
+        response = await sendSearch(true);
+      }
+
       if (!response.ok) throw new Error('Network response was not ok');
       if (!response.body) throw new Error('No body in response');
 
@@ -208,6 +221,7 @@ export const SearchInterface: React.FC = () => {
                                 totalRecords: searchResponse?.total || 0
                             });
                         }
+                        // 精简视图下 response 里没有 records，完整记录随后通过 search_records 到达
                         if (searchResponse && searchResponse.records) {
                             // 查找对应的搜索查询
                             const searchCall = functionCalls.find(call => call.name === data.function_response.name);
@@ -267,6 +281,28 @@ export const SearchInterface: React.FC = () => {
                             : msg
                         )
                     );
+                } else if (data.search_records) {
+                    // 搜索结果的完整记录（模型只看到精简视图），用于展示卡片和下一轮的 search_result
+                    const records = data.search_records;
+                    const searchCall = [...functionCalls].reverse().find(call => call.name && call.name.startsWith('search_'));
+                    const query = searchCall?.args?.query_string || searchCall?.arguments?.query_string || '';
+                    const searchCards: any[] = [{
+                        type: 'search_result',
+                        version: '1.0',
+                        id: `search_${Date.now()}`,
+                        payload: {
+                            query: query,
+                            records: records
+                        }
+                    }];
+                    setSearchResult(records);
+                    setMessages((prev) =>
+                        prev.map((msg) =>
+                            msg.id === assistantId
+                            ? { ...msg, search_cards: searchCards }
+                            : msg
+                        )
+                    );
                 } else if (data.error) {
                     fullText += `\n\n*[Error: ${data.error}]*`;
                     console.error('[SSE] Error in stream:', data.error);
@@ -1,10 +1,11 @@
-import React, { useEffect, useState, useRef, useCallback } from 'react';
+import React, { useEffect, useState } from 'react';
 import ReactMarkdown from 'react-markdown';
 import remarkMath from 'remark-math';
 import rehypeKatex from 'rehype-katex';
 import 'katex/dist/katex.min.css';
 import { TaskPayload } from '../../types';
 import { Loader2, CheckCircle2, XCircle, FileBarChart, Languages, ArrowRight, X, FileText, Copy, Check } from 'lucide-react';
+import { subscribeTask, TaskSocketStatus } from '../../lib/taskSocket';
 
 interface TaskCardProps {
   id: string;
@@ -22,133 +23,29 @@ interface WebSocketMessage {
 
 export const TaskCard: React.FC<TaskCardProps> = ({ id, initialData }) => {
   const [data, setData] = useState<TaskPayload>(initialData);
-  const dataRef = useRef(data); // 用于在闭包中获取最新状态
-  const [isConnected, setIsConnected] = useState(false);
-  const [connectionStatus, setConnectionStatus] = useState<'connecting' | 'connected' | 'disconnected' | 'error'>('disconnected');
+  const [connectionStatus, setConnectionStatus] = useState<TaskSocketStatus>('disconnected');
   const [showTranslationModal, setShowTranslationModal] = useState(false);
   const [copied, setCopied] = useState(false);
-  const ws = useRef<WebSocket | null>(null);
-  const reconnectTimeout = useRef<NodeJS.Timeout | null>(null);
-  const maxReconnectAttempts = 5;
-  const reconnectAttempts = useRef(0);
+  const isFinished = data.status === 'done' || data.status === 'failed';
 
-  // 保持 dataRef 与 data 同步
+  // 通过共用的多路复用 WebSocket 订阅任务结果，任务结束或组件卸载时取消订阅
   useEffect(() => {
-    dataRef.current = data;
-  }, [data]);
-
-  // WebSocket连接函数
-  const connectWebSocket = useCallback(() => {
-    const taskApiUrl = process.env.NEXT_PUBLIC_API_TASK;
-    if (!taskApiUrl) {
-      console.error("NEXT_PUBLIC_API_TASK environment variable not found");
+    if (isFinished) {
       return;
     }
 
-    // 构建WebSocket URL (将http://改为ws://)
-    const wsUrl = taskApiUrl.replace('http://', 'ws://').replace('https://', 'wss://');
-    const fullWsUrl = `${wsUrl}/ws/${id}`;
-
-    setConnectionStatus('connecting');
-    console.log(`Connecting to WebSocket: ${fullWsUrl}`);
-
-    try {
-      ws.current = new WebSocket(fullWsUrl);
-
-      ws.current.onopen = () => {
-        console.log(`WebSocket connected for task ${id}`);
-        setIsConnected(true);
-        setConnectionStatus('connected');
-        reconnectAttempts.current = 0;
-      };
-
-      ws.current.onmessage = (event) => {
-        try {
-          const message: WebSocketMessage = JSON.parse(event.data);
-          console.log('WebSocket message received:', message);
-
-          if (message.task_id === id) {
-            setData(prev => ({
-              ...prev,
-              status: message.status as TaskPayload['status'],
-              ...(message.result && { result: message.result }),
-              ...(message.message && { message: message.message }),
-              ...(message.result_url && { result_url: message.result_url }),
-              ...(message.translation_text && { translation_text: message.translation_text })
-            }));
-          }
-        } catch (error) {
-          console.error('Failed to parse WebSocket message:', error);
-        }
-      };
-
-      ws.current.onclose = (event) => {
-        console.log(`WebSocket disconnected for task ${id}`, event.code, event.reason);
-        setIsConnected(false);
-        setConnectionStatus('disconnected');
-
-        // 清理重连定时器
-        if (reconnectTimeout.current) {
-          clearTimeout(reconnectTimeout.current);
-          reconnectTimeout.current = null;
-        }
-
-        // 使用 ref 获取最新状态，避免闭包中的 stale data
-        if (dataRef.current.status === 'done' || dataRef.current.status === 'failed') {
-          console.log(`Task ${id} already ${dataRef.current.status}, not attempting reconnect`);
-          return;
-        }
-
-        // 任务未完成，尝试重连
-        if (reconnectAttempts.current < maxReconnectAttempts) {
-          reconnectAttempts.current++;
-          console.log(`Attempting to reconnect (${reconnectAttempts.current}/${maxReconnectAttempts})...`);
-
-          reconnectTimeout.current = setTimeout(() => {
-            connectWebSocket();
-          }, 2000 * reconnectAttempts.current);
-        } else {
-          // 重连次数用完，设置任务状态为 failed
-          console.log(`Max reconnect attempts reached for task ${id}`);
-          setData(prev => ({
-            ...prev,
-            status: 'failed',
-            message: prev.message || '连接超时，请刷新页面重试'
-          }));
-        }
-      };
-
-      ws.current.onerror = (error) => {
-        console.error('WebSocket error:', error);
-        setConnectionStatus('error');
-        // 注意：WebSocket 错误不应该直接改变任务状态
-        // 任务状态应该由服务器通过 onmessage 发送的消息来更新
-        // onclose 会在连接真正关闭后处理重连逻辑
-      };
-
-    } catch (error) {
-      console.error('Failed to create WebSocket connection:', error);
-      setConnectionStatus('error');
-    }
-  }, [id, data.status]);
-
-  // 初始化WebSocket连接
-  useEffect(() => {
-    if (data.status === 'done' || data.status === 'failed') {
-      return;
-    }
-
-    connectWebSocket();
-
-    return () => {
-      if (reconnectTimeout.current) {
-        clearTimeout(reconnectTimeout.current);
-      }
-      if (ws.current) {
-        ws.current.close();
-      }
-    };
-  }, [id, data.status, connectWebSocket]);
+    return subscribeTask(id, (message: WebSocketMessage) => {
+      console.log('WebSocket message received:', message);
+      setData(prev => ({
+        ...prev,
+        status: (message.status || prev.status) as TaskPayload['status'],
+        ...(message.result && { result: message.result }),
+        ...(message.message && { message: message.message }),
+        ...(message.result_url && { result_url: message.result_url }),
+        ...(message.translation_text && { translation_text: message.translation_text })
+      }));
+    }, setConnectionStatus);
+  }, [id, isFinished]);
 
   const getStatusColor = (status: string) => {
     switch (status) {
@@ -0,0 +1,205 @@
+// 所有任务卡片共用一个多路复用的 WebSocket（/ws）：按 task_id 订阅/取消订阅，结果消息中带 task_id
+// 订阅数达到服务端上限（WS_MAX_SUBSCRIPTIONS）时，被拒绝的任务改用单独的连接（/ws/{task_id}）
+
+export type TaskSocketStatus = 'connecting' | 'connected' | 'disconnected' | 'error';
+
+type MessageHandler = (message: any) => void;
+type StatusHandler = (status: TaskSocketStatus) => void;
+
+const maxReconnectAttempts = 5;
+
+const handlers = new Map<string, Set<MessageHandler>>();
+const statusHandlers = new Set<StatusHandler>();
+let socket: WebSocket | null = null;
+let status: TaskSocketStatus = 'disconnected';
+let reconnectAttempts = 0;
+let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+const fallbackSockets = new Map<string, WebSocket>();
+
+function setStatus(next: TaskSocketStatus) {
+  status = next;
+  statusHandlers.forEach(handler => handler(next));
+}
+
+function sendControl(action: 'subscribe' | 'unsubscribe', taskIds: string[]) {
+  if (socket && socket.readyState === WebSocket.OPEN && taskIds.length > 0) {
+    socket.send(JSON.stringify({ action, task_ids: taskIds }));
+  }
+}
+
+function wsBaseUrl(): string | null {
+  const taskApiUrl = process.env.NEXT_PUBLIC_API_TASK;
+  if (!taskApiUrl) {
+    console.error("NEXT_PUBLIC_API_TASK environment variable not found");
+    return null;
+  }
+  // 构建WebSocket URL (将http://改为ws://)
+  return taskApiUrl.replace('http://', 'ws://').replace('https://', 'wss://');
+}
+
+function dispatch(taskId: string, message: any) {
+  handlers.get(taskId)?.forEach(handler => handler(message));
+}
+
+// 多路复用连接拒绝了这个任务的订阅，单独建立一个只订阅该任务的连接，收到结果后服务端会关闭连接
+function openFallbackSocket(taskId: string) {
+  if (fallbackSockets.has(taskId) || !handlers.has(taskId)) return;
+  const baseUrl = wsBaseUrl();
+  if (!baseUrl) return;
+
+  let ws: WebSocket;
+  try {
+    ws = new WebSocket(`${baseUrl}/ws/${encodeURIComponent(taskId)}`);
+  } catch (error) {
+    console.error('Failed to create WebSocket connection:', error);
+    dispatch(taskId, { task_id: taskId, status: 'failed', message: '连接失败，请刷新页面重试' });
+    return;
+  }
+  fallbackSockets.set(taskId, ws);
+  let received = false;
+
+  ws.onmessage = (event) => {
+    if (event.data === 'pong') return;
+    try {
+      const message = JSON.parse(event.data);
+      if (message.status) {
+        received = true;
+        dispatch(taskId, message);
+      }
+    } catch (error) {
+      console.error('Failed to parse WebSocket message:', error);
+    }
+  };
+
+  ws.onclose = () => {
+    if (fallbackSockets.get(taskId) !== ws) return;
+    fallbackSockets.delete(taskId);
+    if (!received) {
+      dispatch(taskId, { task_id: taskId, status: 'failed', message: '连接断开，请刷新页面重试' });
+    }
+  };
+
+  ws.onerror = (error) => {
+    console.error(`WebSocket error (task ${taskId}):`, error);
+  };
+}
+
+function connect() {
+  const baseUrl = wsBaseUrl();
+  if (!baseUrl) return;
+  const wsUrl = `${baseUrl}/ws`;
+  setStatus('connecting');
+
+  let ws: WebSocket;
+  try {
+    ws = new WebSocket(wsUrl);
+  } catch (error) {
+    console.error('Failed to create WebSocket connection:', error);
+    setStatus('error');
+    return;
+  }
+  socket = ws;
+
+  // 旧连接（已经被关闭或替换）的事件不再处理
+  ws.onopen = () => {
+    if (socket !== ws) return;
+    reconnectAttempts = 0;
+    setStatus('connected');
+    // 新连接（包括重连）时重新订阅所有任务（单独连接的除外），已经完成的任务会立即返回结果
+    sendControl('subscribe', Array.from(handlers.keys()).filter(taskId => !fallbackSockets.has(taskId)));
+  };
+
+  ws.onmessage = (event) => {
+    if (event.data === 'pong') return;
+    try {
+      const message = JSON.parse(event.data);
+      if (message.task_id && !message.status && message.error) {
+        // 订阅被拒绝（超过每个连接的订阅数上限），不是任务状态，不能转给任务卡片
+        console.warn(`Task ${message.task_id} subscription rejected: ${message.error}`);
+        openFallbackSocket(message.task_id);
+      } else if (message.task_id) {
+        dispatch(message.task_id, message);
+      } else if (message.error) {
+        console.error('WebSocket error message:', message.error);
+      }
+    } catch (error) {
+      console.error('Failed to parse WebSocket message:', error);
+    }
+  };
+
+  ws.onclose = (event) => {
+    if (socket !== ws) return;
+    console.log('Task WebSocket disconnected', event.code, event.reason);
+    socket = null;
+    setStatus('disconnected');
+    // 没有订阅的任务时不需要重连
+    if (handlers.size === 0) return;
+    if (reconnectAttempts < maxReconnectAttempts) {
+      reconnectAttempts++;
+      reconnectTimer = setTimeout(() => {
+        reconnectTimer = null;
+        connect();
+      }, 2000 * reconnectAttempts);
+    } else {
+      // 重连次数用完，通知所有订阅中的任务
+      handlers.forEach((taskHandlers, taskId) => {
+        taskHandlers.forEach(handler => handler({ task_id: taskId, status: 'failed', message: '连接超时，请刷新页面重试' }));
+      });
+    }
+  };
+
+  ws.onerror = (error) => {
+    if (socket !== ws) return;
+    console.error('WebSocket error:', error);
+    setStatus('error');
+  };
+}
+
+/**
+ * 订阅一个任务的结果，返回取消订阅的函数。
+ * 第一个订阅时建立连接，最后一个取消订阅时关闭连接。
+ */
+export function subscribeTask(taskId: string, onMessage: MessageHandler, onStatus?: StatusHandler): () => void {
+  let taskHandlers = handlers.get(taskId);
+  const isNewTask = !taskHandlers;
+  if (!taskHandlers) {
+    taskHandlers = new Set();
+    handlers.set(taskId, taskHandlers);
+  }
+  taskHandlers.add(onMessage);
+  if (onStatus) {
+    statusHandlers.add(onStatus);
+    onStatus(status);
+  }
+
+  if (!socket && !reconnectTimer) {
+    reconnectAttempts = 0;
+    connect();
+  } else if (isNewTask) {
+    sendControl('subscribe', [taskId]);
+  }
+
+  return () => {
+    const current = handlers.get(taskId);
+    current?.delete(onMessage);
+    if (onStatus) statusHandlers.delete(onStatus);
+    if (current && current.size === 0) {
+      handlers.delete(taskId);
+      const fallback = fallbackSockets.get(taskId);
+      if (fallback) {
+        fallbackSockets.delete(taskId);
+        fallback.close();
+      } else {
+        sendControl('unsubscribe', [taskId]);
+      }
+    }
+    if (handlers.size === 0) {
+      if (reconnectTimer) {
+        clearTimeout(reconnectTimer);
+        reconnectTimer = null;
+      }
+      socket?.close();
+      socket = null;
+    }
+  };
+}